@@ -0,0 +1,89 @@
+"""Runs the benchmark suite, or compares two runs
+
+Usage:
+    python -m benchmarks run [--quick] [--output results.json] [benchmark ...]
+    python -m benchmarks compare baseline.json results.json [--threshold 0.15]
+
+`compare` exits with status 1 if any metric regressed by more than the
+threshold, so it can gate a dependency upgrade.
+"""
+import argparse
+import sys
+from . import bench_clean, bench_extract, bench_index, bench_render, bench_search
+from .results import compare, format_comparison, load_results, write_results
+
+BENCHMARKS = {
+    "extract": bench_extract,
+    "clean": bench_clean,
+    "render": bench_render,
+    "index": bench_index,
+    "search": bench_search,
+}
+
+
+def run(args):
+    metrics = {}
+    for name in args.benchmarks or list(BENCHMARKS):
+        print("Running {}...".format(name), file=sys.stderr)
+        metrics.update(BENCHMARKS[name].measure(quick=args.quick))
+
+    for name, result in sorted(metrics.items()):
+        print("{:<36} {:>12.3f} {}".format(name, result["value"], result["unit"]))
+    write_results(args.output, metrics, quick=args.quick)
+    print("Saved results to {}".format(args.output))
+
+
+def compare_cmd(args):
+    baseline = load_results(args.baseline)
+    current = load_results(args.current)
+    if baseline.get("quick") != current.get("quick"):
+        print("Warning: only one of the runs used --quick, so their corpora differ\n")
+
+    rows = compare(baseline, current, args.threshold)
+    print(format_comparison(baseline, current, rows))
+    regressed = [row[0] for row in rows if row[4]]
+    if regressed:
+        print("\n{} metrics regressed by more than {:.0%}".format(
+            len(regressed), args.threshold
+        ))
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+        "benchmarks", nargs="*",
+        help="The benchmarks to run, of {} (all by default)".format(", ".join(BENCHMARKS)),
+    )
+    run_parser.add_argument(
+        "--quick", action="store_true", help="Use smaller corpora and fewer repeats"
+    )
+    run_parser.add_argument(
+        "--output", default="benchmark-results.json", help="The results file to write"
+    )
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare results against a baseline"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.15,
+        help="The fraction by which a metric can get worse before it is flagged",
+    )
+    compare_parser.set_defaults(func=compare_cmd)
+
+    args = parser.parse_args()
+    unknown = set(getattr(args, "benchmarks", [])) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: {}".format(", ".join(sorted(unknown))))
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
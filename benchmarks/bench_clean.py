@@ -0,0 +1,79 @@
+"""Micro-benchmark of message cleaning
+
+Compares the single-pass `clean_message` with the previous cleaner, which
+popped quoted lines out of the middle of a list (quadratic on long, quote
+heavy messages), on a synthetic corpus from `benchmarks.corpus`.
+
+Usage: python -m benchmarks.bench_clean
+"""
+import time
+from python_search.indexer.cleaning import clean_messages
+from .corpus import synthetic_messages
+from .measure import best_of, metric
+
+
+def legacy_clean(message):
+    """`clean_message` before it was rewritten as a single pass"""
+    lines = message.split('\n')
+
+    l_idx = 0
+    while l_idx + 1 < len(lines):
+        line, next_line = lines[l_idx], lines[l_idx + 1]
+        if next_line.strip().startswith('>'):
+            lines.pop(l_idx)
+            while l_idx < len(lines) and lines[l_idx].strip().startswith('>'):
+                lines.pop(l_idx)
+        elif line.strip() in ['--', '-------------- next part --------------']:
+            lines = lines[:l_idx]
+            break
+        else:
+            l_idx += 1
+    return '\n'.join(lines)
+
+
+def run(clean, texts):
+    start = time.perf_counter()
+    cleaned = clean(texts)
+    return time.perf_counter() - start, sum(len(text) for text in cleaned)
+
+
+def measure(quick=False):
+    """Returns the cleaning throughput of the corpus, and the time to clean
+    its longest messages
+    """
+    texts = [message["text"] for message in synthetic_messages(1000 if quick else 5000)]
+    digests = sorted(texts, key=len)[-10:]
+    repeat = 3 if quick else 5
+    elapsed = best_of(lambda: clean_messages(texts), repeat=repeat)
+    return {
+        "clean.throughput": metric(len(texts) / elapsed, "msgs/s", higher_is_better=True),
+        "clean.longest_10": metric(
+            best_of(lambda: clean_messages(digests), repeat=repeat) * 1000, "ms"
+        ),
+    }
+
+
+def main(count=5000):
+    texts = [message["text"] for message in synthetic_messages(count)]
+    digests = sorted(texts, key=len)[-10:]
+    raw_size = sum(len(text) for text in texts)
+
+    print("{:<12} {:>8} {:>12} {:>12} {:>10}".format(
+        "cleaner", "docs", "time (s)", "kept (KB)", "removed"
+    ))
+    for label, corpus in (("all", texts), ("longest 10", digests)):
+        size = sum(len(text) for text in corpus)
+        for name, clean in (
+            ("before", lambda batch: [legacy_clean(text) for text in batch]),
+            ("after", clean_messages),
+        ):
+            elapsed, kept = run(clean, corpus)
+            print("{:<12} {:>8} {:>12.3f} {:>12.0f} {:>9.1%}".format(
+                "{} {}".format(name, label), len(corpus), elapsed,
+                kept / 1024, 1 - kept / size
+            ))
+    print("corpus size: {:.0f} KB".format(raw_size / 1024))
+
+
+if __name__ == "__main__":
+    main()
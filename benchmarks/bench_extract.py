@@ -0,0 +1,57 @@
+"""Micro-benchmark of message page parsing
+
+Compares the single-pass lxml extractor with the previous approach of one
+BeautifulSoup `find` per field plus `dateutil` date parsing, on the saved
+pipermail pages in `benchmarks/fixtures/pipermail`.
+
+Usage: python -m benchmarks.bench_extract
+"""
+import timeit
+from bs4 import BeautifulSoup
+from dateutil.parser import parse
+from python_search.scraper.extract import extract_message
+from .fixtures import pipermail_pages
+from .measure import best_of, metric
+
+
+def legacy_extract(html):
+    """The field extraction `Message` did before `extract_message`"""
+    soup = BeautifulSoup(html, "lxml")
+    return {
+        "text": soup.find("pre").text.strip(),
+        "sent_at": parse(soup.find("i").text).replace(tzinfo=None),
+        "author": soup.find("b").text.strip(),
+        "email": soup.find("a").text.strip(),
+        "subject": soup.find("h1").text.strip(),
+    }
+
+
+def per_message_cost(extract, html, number):
+    timer = timeit.Timer(lambda: extract(html))
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def measure(quick=False):
+    """Returns the time to extract the fields of each fixture page"""
+    number = 20 if quick else 200
+    return {
+        "extract.{}".format(name.rsplit(".", 1)[0]): metric(
+            best_of(lambda: extract_message(html), number=number) * 1000, "ms"
+        )
+        for name, html in pipermail_pages().items()
+    }
+
+
+def main(number=200):
+    print("{:<30} {:>12} {:>12} {:>8}".format("page", "before (ms)", "after (ms)", "speedup"))
+    for name, html in pipermail_pages().items():
+        assert legacy_extract(html) == extract_message(html), name
+        before = per_message_cost(legacy_extract, html, number)
+        after = per_message_cost(extract_message, html, number)
+        print("{:<30} {:>12.3f} {:>12.3f} {:>7.1f}x".format(
+            name, before * 1000, after * 1000, before / after
+        ))
+
+
+if __name__ == "__main__":
+    main()
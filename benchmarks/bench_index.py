@@ -0,0 +1,53 @@
+"""Benchmark of index building
+
+Writes a synthetic corpus to a scraper database in a temporary directory,
+builds a full index of it with `index_cmd` (which runs `update_index`), then
+appends more messages and indexes them incrementally. Reports the throughput
+of each build.
+
+Usage: python -m benchmarks.bench_index
+"""
+import os.path
+import tempfile
+import time
+from python_search.indexer import index_cmd
+from .corpus import write_database
+from .measure import metric, quiet
+
+
+def timed_build(db_path, index_dir, incremental):
+    start = time.perf_counter()
+    with quiet():
+        index_cmd(db_path, index_dir, incremental=incremental)
+    return time.perf_counter() - start
+
+
+def measure(quick=False, count=None, new_count=None):
+    count = count or (2000 if quick else 10000)
+    new_count = new_count or count // 10
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = os.path.join(work_dir, "corpus.db")
+        index_dir = os.path.join(work_dir, "index")
+        with quiet():
+            write_database(db_path, count)
+        full = timed_build(db_path, index_dir, incremental=False)
+
+        with quiet():
+            write_database(db_path, new_count, seed=411, first_id=count)
+        incremental = timed_build(db_path, index_dir, incremental=True)
+
+    return {
+        "index.full.throughput": metric(count / full, "msgs/s", higher_is_better=True),
+        "index.incremental.throughput": metric(
+            new_count / incremental, "msgs/s", higher_is_better=True
+        ),
+    }
+
+
+def main():
+    for name, result in sorted(measure().items()):
+        print("{:<32} {:>12.1f} {}".format(name, result["value"], result["unit"]))
+
+
+if __name__ == "__main__":
+    main()
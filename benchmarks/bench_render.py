@@ -0,0 +1,40 @@
+"""Micro-benchmark of message rendering
+
+Renders cleaned messages from the synthetic corpus with `render_as_html`, as
+the indexer does, and reports the throughput and the per-message latency
+percentiles (digests make up the tail).
+
+Usage: python -m benchmarks.bench_render
+"""
+import time
+from python_search.render import render_as_html
+from python_search.indexer.cleaning import clean_messages
+from .corpus import synthetic_messages
+from .measure import latency_metrics, metric, sample_latencies
+
+
+def measure(quick=False):
+    texts = clean_messages(
+        [message["text"] for message in synthetic_messages(500 if quick else 2000)]
+    )
+    # The first call loads Markdown's extensions
+    render_as_html(texts[0])
+
+    start = time.perf_counter()
+    samples = sample_latencies(render_as_html, texts)
+    elapsed = time.perf_counter() - start
+
+    metrics = latency_metrics("render", samples)
+    metrics["render.throughput"] = metric(
+        len(texts) / elapsed, "msgs/s", higher_is_better=True
+    )
+    return metrics
+
+
+def main():
+    for name, result in sorted(measure().items()):
+        print("{:<24} {:>12.3f} {}".format(name, result["value"], result["unit"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Benchmark of the frontend's queries
+
+Builds an index and its similar messages from a synthetic corpus in a
+temporary directory, then reports latency percentiles of:
+
+- `IndexSearcher.search`, the first time a page is requested (uncached),
+  the second time (cached), and restricted to a list and a date range
+- `IndexSearcher.search_for_thread`
+- `IndexSearcher.find_similar_messages`
+
+Usage: python -m benchmarks.bench_search
+"""
+import os.path
+import random
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from python_search.indexer import IndexSearcher, index_cmd, similar_cmd
+from .corpus import LIST_IDS, WORDS, write_database
+from .measure import latency_metrics, quiet, sample_latencies
+
+PAGES = 3
+# How SQLAlchemy stores datetimes in SQLite
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def queries(rng, count):
+    """Returns search queries of one to three words, some with wildcards"""
+    words = [word for word in WORDS if len(word) > 3]
+    result = []
+    for _ in range(count):
+        query = " ".join(rng.sample(words, rng.randint(1, 3)))
+        if rng.random() < 0.2:
+            query = query[:4] + "*"
+        result.append(query)
+    return result
+
+
+def build(db_path, index_dir, count):
+    with quiet():
+        write_database(db_path, count)
+        index_cmd(db_path, index_dir)
+        similar_cmd(index_dir)
+
+
+def sample_rows(db_path, rng, count):
+    """Returns `count` random (list_id, message_id, thread_parent, sent_at)
+    rows of the corpus
+    """
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT list_id, message_id, thread_parent, sent_at FROM message"
+    ).fetchall()
+    conn.close()
+    return [
+        row[:3] + (datetime.strptime(row[3], DATE_FORMAT),)
+        for row in rng.sample(rows, min(count, len(rows)))
+    ]
+
+
+def measure(quick=False, count=None):
+    count = count or (2000 if quick else 10000)
+    rng = random.Random(410)
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = os.path.join(work_dir, "corpus.db")
+        index_dir = os.path.join(work_dir, "index")
+        build(db_path, index_dir, count)
+        messages = sample_rows(db_path, rng, 100 if quick else 500)
+
+        searcher = IndexSearcher(index_dir)
+        workload = [
+            (query, page)
+            for query in queries(rng, 20 if quick else 100)
+            for page in range(1, PAGES + 1)
+        ]
+        # The first query opens the searcher
+        searcher.search("python")
+
+        def search(args):
+            query, page = args
+            return list(searcher.search(query, page=page))
+
+        metrics = {}
+        metrics.update(latency_metrics("search.uncached", sample_latencies(search, workload)))
+        metrics.update(latency_metrics("search.cached", sample_latencies(search, workload)))
+
+        # A year of one list, starting at the date of a random message
+        filtered = [
+            (query, rng.choice(LIST_IDS), row[3], row[3] + timedelta(days=365))
+            for query, row in zip(
+                queries(rng, 20 if quick else 100), rng.choices(messages, k=100)
+            )
+        ]
+
+        def filtered_search(args):
+            query, list_id, start, end = args
+            return list(searcher.search(query, list_id=list_id, start=start, end=end))
+
+        metrics.update(latency_metrics(
+            "search.filtered", sample_latencies(filtered_search, filtered)
+        ))
+        metrics.update(latency_metrics(
+            "thread",
+            sample_latencies(
+                lambda row: searcher.search_for_thread(row[0], row[2]), messages
+            ),
+        ))
+        metrics.update(latency_metrics(
+            "similar",
+            sample_latencies(
+                lambda row: searcher.find_similar_messages(row[0], row[1]), messages
+            ),
+        ))
+    return metrics
+
+
+def main():
+    for name, result in sorted(measure().items()):
+        print("{:<24} {:>12.3f} {}".format(name, result["value"], result["unit"]))
+
+
+if __name__ == "__main__":
+    main()
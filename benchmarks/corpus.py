@@ -0,0 +1,135 @@
+"""A synthetic mailing list corpus, shaped like `python_search.scraper.model.Message`
+
+Threads have a mix of depths, replies quote their parents (often with an
+"On ... wrote:" attribution), some messages carry signatures, attachments
+or list footers, and a few are digests running to thousands of lines.
+The corpus is generated from a seed, so runs are reproducible.
+"""
+import random
+from datetime import datetime, timedelta
+from python_search.scraper.model import Message
+from python_search.scraper.storage import MessageWriter, open_engine
+
+LIST_IDS = ["python-dev", "python-list", "python-ideas", "tutor", "distutils-sig"]
+AUTHORS = [
+    ("Guido van Rossum", "guido at python.org"),
+    ("Tim Peters", "tim.peters at gmail.com"),
+    ("Raymond Hettinger", "raymond.hettinger at gmail.com"),
+    ("Nick Coghlan", "ncoghlan at gmail.com"),
+    ("Jane Developer", "jane at example.com"),
+    ("Sam Newcomer", "sam at example.org"),
+]
+WORDS = (
+    "python import module package asyncio coroutine event loop thread gil "
+    "lock performance benchmark memory allocation garbage collector pep "
+    "proposal syntax semantics backwards compatibility release bug patch "
+    "test suite windows linux unicode bytes string dictionary list tuple "
+    "generator iterator decorator context manager exception traceback the "
+    "a an of to in and is that it for on with as this be we should would"
+).split()
+FOOTER = [
+    "_______________________________________________",
+    "Python-Dev mailing list",
+    "Python-Dev at python.org",
+    "https://mail.python.org/mailman/listinfo/python-dev",
+]
+ATTACHMENT = [
+    "-------------- next part --------------",
+    "An HTML attachment was scrubbed...",
+    "URL: <http://mail.python.org/pipermail/python-dev/attachments/x.html>",
+]
+
+
+def paragraph(rng, words):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    lines, line = [], []
+    for word in text.split():
+        line.append(word)
+        if len(line) >= 12:
+            lines.append(" ".join(line))
+            line = []
+    if line:
+        lines.append(" ".join(line))
+    return lines
+
+
+def body(rng, parent_body=None, digest=False):
+    lines = []
+    if digest:
+        for idx in range(rng.randint(100, 400)):
+            lines += ["Message: {}".format(idx + 1), ""]
+            lines += ["> " + line for line in paragraph(rng, rng.randint(50, 400))]
+            lines += [""] + paragraph(rng, rng.randint(80, 300)) + [""]
+        return "\n".join(lines)
+
+    lines += paragraph(rng, rng.randint(10, 60))
+    if parent_body is not None:
+        author = rng.choice(AUTHORS)[0]
+        lines += ["", "On Tue, May 1, 2018 at 10:00 AM, {} wrote:".format(author)]
+        if rng.random() < 0.3:
+            lines.append("")
+        quoted = parent_body.split("\n")[: rng.randint(5, 200)]
+        lines += [">" + line if line.startswith(">") else "> " + line for line in quoted]
+        lines += [""] + paragraph(rng, rng.randint(10, 80))
+
+    roll = rng.random()
+    if roll < 0.3:
+        lines += ["", "-- ", rng.choice(AUTHORS)[0]]
+    elif roll < 0.4:
+        lines += [""] + ATTACHMENT
+    elif roll < 0.6:
+        lines += [""] + FOOTER
+    return "\n".join(lines)
+
+
+def synthetic_messages(count, seed=410, digest_rate=0.005, first_id=0):
+    """Generates `count` messages as dicts with the fields of
+    `python_search.scraper.model.Message`
+
+    Messages are yielded in thread order, with thread depths drawn so that
+    most threads are short and a few are long and deep. Message ids count up
+    from `first_id`, so corpora with different `first_id`s can be appended
+    to one another.
+    """
+    rng = random.Random(seed)
+    sent_at = datetime(2000, 1, 1) + timedelta(hours=first_id)
+    message_id = first_id
+    count += first_id
+
+    while message_id < count:
+        list_id = rng.choice(LIST_IDS)
+        thread_parent = message_id
+        thread_size = min(int(rng.paretovariate(1.2)), 200, count - message_id)
+        bodies = []
+        for thread_idx in range(thread_size):
+            depth = 0 if thread_idx == 0 else rng.randint(1, min(thread_idx, 8))
+            parent_body = bodies[rng.randrange(len(bodies))] if bodies else None
+            text = body(rng, parent_body, digest=rng.random() < digest_rate)
+            bodies.append(text)
+            author, email = rng.choice(AUTHORS)
+            sent_at += timedelta(minutes=rng.randint(1, 600))
+            yield {
+                "list_id": list_id,
+                "message_id": "{:06d}".format(message_id),
+                "text": text,
+                "sent_at": sent_at,
+                "author": author,
+                "email": email,
+                "subject": "Re: [{}] Topic {}".format(list_id, thread_parent),
+                "thread_parent": thread_parent,
+                "thread_idx": thread_idx,
+                "thread_indent": depth * 2,
+                "page": sent_at.strftime("%Y-%B"),
+            }
+            message_id += 1
+
+
+def write_database(db_path, count, seed=410, first_id=0):
+    """Writes `count` synthetic messages to a scraper database at `db_path`,
+    the way the scraper would
+    """
+    engine = open_engine(db_path)
+    with MessageWriter(engine) as writer:
+        for fields in synthetic_messages(count, seed=seed, first_id=first_id):
+            writer.put(Message(**fields))
+    engine.dispose()
@@ -0,0 +1,13 @@
+import os.path
+from glob import glob
+
+FIXTURES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def pipermail_pages():
+    """Returns the saved pipermail message pages, as {file name: html}"""
+    pages = {}
+    for path in sorted(glob(os.path.join(FIXTURES_DIR, "pipermail", "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
@@ -0,0 +1,66 @@
+"""Helpers for timing code and summarizing the timings as metrics
+
+A metric is a dict with a `value`, its `unit`, and whether a higher value is
+better (throughputs) or worse (latencies). Benchmarks return their metrics
+as {name: metric}, which `benchmarks.results` saves and compares.
+"""
+import contextlib
+import io
+import logging
+import time
+import timeit
+
+PERCENTILES = (50, 90, 99)
+
+
+def metric(value, unit, higher_is_better=False):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def best_of(func, repeat=5, number=1):
+    """Returns the fastest time of one call of `func`, in seconds
+
+    Takes the minimum of `repeat` runs of `number` calls, which is the
+    least noisy estimate of the cost of the code itself.
+    """
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def sample_latencies(func, args):
+    """Calls `func` once with each item of `args`, returning the time each
+    call took, in seconds
+    """
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        func(arg)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, point):
+    """Returns the `point`th percentile of `samples` (nearest rank)"""
+    ordered = sorted(samples)
+    rank = max(int(round(point / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def latency_metrics(name, samples):
+    """Summarizes latency samples (in seconds) as millisecond percentiles"""
+    return {
+        "{}.p{}".format(name, point): metric(percentile(samples, point) * 1000, "ms")
+        for point in PERCENTILES
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silences the progress bars, reports and logs of the code under test"""
+    logging.disable(logging.INFO)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            yield
+    finally:
+        logging.disable(logging.NOTSET)
@@ -0,0 +1,82 @@
+"""Benchmark results files, and comparison of results against a baseline
+
+A results file is JSON holding the metrics of a run (see
+`benchmarks.measure`) and the versions of the libraries they depend on, so
+a regression can be traced to an upgrade.
+"""
+import json
+import platform
+from datetime import datetime
+from importlib import metadata
+
+LIBRARIES = ["whoosh", "lxml", "markdown", "sqlalchemy", "numpy", "beautifulsoup4"]
+
+
+def environment():
+    versions = {"python": platform.python_version()}
+    for library in LIBRARIES:
+        try:
+            versions[library] = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            versions[library] = None
+    return versions
+
+
+def write_results(path, metrics, quick=False):
+    results = {
+        "created_at": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "quick": quick,
+        "metrics": metrics,
+    }
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.15):
+    """Compares the metrics of two results files
+
+    A metric has regressed if it is more than `threshold` (a fraction)
+    worse than in the baseline: slower for latencies, lower for throughputs.
+    Metrics that are only in one of the files are skipped.
+
+    Returns
+    -------
+    list of (name, baseline value, current value, change, regressed)
+        One row per metric, where `change` is the relative change in value
+    """
+    rows = []
+    for name in sorted(current["metrics"]):
+        if name not in baseline["metrics"]:
+            continue
+        before = baseline["metrics"][name]
+        after = current["metrics"][name]
+        if not before["value"]:
+            continue
+        change = (after["value"] - before["value"]) / before["value"]
+        worse = -change if after["higher_is_better"] else change
+        rows.append((name, before["value"], after["value"], change, worse > threshold))
+    return rows
+
+
+def format_comparison(baseline, current, rows):
+    lines = []
+    for key in sorted(set(baseline["environment"]) | set(current["environment"])):
+        before = baseline["environment"].get(key)
+        after = current["environment"].get(key)
+        if before != after:
+            lines.append("{}: {} -> {}".format(key, before, after))
+    if lines:
+        lines.append("")
+
+    lines.append("{:<36} {:>12} {:>12} {:>9}".format("metric", "baseline", "current", "change"))
+    for name, before, after, change, regressed in rows:
+        lines.append("{:<36} {:>12.3f} {:>12.3f} {:>+8.1%}{}".format(
+            name, before, after, change, "  REGRESSED" if regressed else ""
+        ))
+    return "\n".join(lines)
@@ -1,5 +1,6 @@
 from flask_script import Manager
 from python_search.frontend.app import app
+from python_search.frontend import server
 from python_search import scraper, indexer
 
 manager = Manager(app)
@@ -15,8 +16,42 @@ manager = Manager(app)
     "--start_at", help="The mailing list to start at (alphabetically)"
 )
 @manager.option("--update", type=bool)
-def scrape(parallelism, start_at, update):
-    scraper.scrape_cmd(parallelism, start_at, update)
+@manager.option(
+    "--rate",
+    help="The maximum number of requests per second to mail.python.org",
+    type=float,
+)
+@manager.option(
+    "--concurrency",
+    help="The maximum number of requests in flight at once",
+    type=int,
+)
+@manager.option(
+    "--mode",
+    help="Scrape each message's page (html) or each month's archive (mbox)",
+    choices=["html", "mbox"],
+    default="html",
+)
+@manager.option(
+    "--metrics_file",
+    help="A file to write the run's metrics to when it ends",
+)
+@manager.option(
+    "--workers",
+    help="The number of threads scraping pages from all lists at once",
+    type=int,
+    default=4,
+)
+@manager.option(
+    "--base_url",
+    help="The server to scrape instead of https://mail.python.org",
+)
+def scrape(parallelism, start_at, update, rate, concurrency, mode, metrics_file,
+           workers, base_url):
+    scraper.scrape_cmd(
+        parallelism, start_at, update, rate, concurrency, mode, metrics_file,
+        workers, base_url,
+    )
 
 
 @manager.option(
@@ -28,8 +63,89 @@ def scrape(parallelism, start_at, update):
     "--index_dir", help="The directory of the index",
     required=True
 )
-def index(db, index_dir):
-    indexer.index_cmd(db, index_dir)
+@manager.option(
+    "--incremental",
+    help="Only index messages newer than the index's watermark",
+    type=bool,
+    default=False,
+)
+@manager.option(
+    "--procs",
+    help="The number of processes used to clean and analyze messages",
+    type=int,
+    default=1,
+)
+@manager.option(
+    "--metrics_file",
+    help="A file to write the run's metrics to when it ends",
+)
+@manager.option(
+    "--merge",
+    help="Merge small segments on each commit (small), merge each shard "
+    "into one segment at the end (final), or never merge (none)",
+    choices=["small", "final", "none"],
+    default="small",
+)
+def index(db, index_dir, incremental, procs, metrics_file, merge):
+    indexer.index_cmd(db, index_dir, incremental, procs, metrics_file, merge)
+
+
+@manager.option(
+    "--index_dir", help="The directory of the index",
+    required=True
+)
+def optimize(index_dir):
+    indexer.optimize_cmd(index_dir)
+
+
+@manager.option(
+    "--index_dir", help="The directory of the index",
+    required=True
+)
+@manager.option(
+    "--generation",
+    help="The generation to switch to (the previous one by default)",
+    type=int,
+)
+def rollback(index_dir, generation):
+    indexer.rollback_cmd(index_dir, generation)
+
+
+@manager.option(
+    "--index_dir", help="The directory of the index",
+    required=True
+)
+@manager.option("--archive", help="The tar file to write", required=True)
+@manager.option(
+    "--generation",
+    help="The generation to pack (the current one by default)",
+    type=int,
+)
+def pack(index_dir, archive, generation):
+    indexer.pack_cmd(index_dir, archive, generation)
+
+
+@manager.option(
+    "--index_dir", help="The directory of the index",
+    required=True
+)
+@manager.option("--archive", help="A tar file written by pack", required=True)
+def unpack(index_dir, archive):
+    indexer.unpack_cmd(index_dir, archive)
+
+
+@manager.option(
+    "--index_dir", help="The directory of the index",
+    required=True
+)
+@manager.option(
+    "--full",
+    help="Rehash every message instead of only the new ones",
+    type=bool,
+    default=False,
+)
+def similar(index_dir, full):
+    indexer.similar_cmd(index_dir, full)
 
 
 @manager.option(
@@ -52,8 +168,36 @@ def search(index_dir, query):
 )
 def run(index_dir):
     app.config["index_dir"] = index_dir
+    app.config["searcher"] = indexer.IndexSearcher(index_dir)
     app.run(debug=True)
 
 
+
+@manager.option(
+    "--index_dir", help="The directory of the index",
+    required=True
+)
+@manager.option("--host", help="The address to listen on", default="127.0.0.1")
+@manager.option("--port", help="The port to listen on", type=int, default=8000)
+@manager.option(
+    "--workers",
+    help="The number of worker processes (one per core by default)",
+    type=int,
+)
+@manager.option(
+    "--threads",
+    help="The number of request threads per worker",
+    type=int,
+    default=1,
+)
+@manager.option(
+    "--watch_interval",
+    help="Seconds between checks for a new index generation (0 to disable)",
+    type=float,
+    default=5.0,
+)
+def serve(index_dir, host, port, workers, threads, watch_interval):
+    server.serve(index_dir, host, port, workers, threads, watch_interval)
+
 if __name__ == "__main__":
     manager.run()
@@ -0,0 +1,184 @@
+import base64
+import binascii
+import json
+from flask import Blueprint, Response, abort, request
+from .helpers import get_searcher, parse_daterange, timed_search
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+# The fields a client can select with `fields=`. "snippet" only applies to
+# search results.
+MESSAGE_FIELDS = [
+    "list_id",
+    "message_id",
+    "author",
+    "subject",
+    "sent_at",
+    "thread_parent",
+    "thread_idx",
+    "thread_indent",
+    "page",
+    "text",
+    "html",
+    "snippet",
+]
+# Snippets cost a highlighting pass, so they're only sent when asked for
+DEFAULT_FIELDS = [field for field in MESSAGE_FIELDS if field != "snippet"]
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def encode_cursor(generation, after):
+    """Encodes the position of the last result of a page, and the generation
+    of the index it was read from, as an opaque cursor
+    """
+    data = json.dumps({"generation": generation, "after": after})
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Returns the (generation, position) a cursor was made from, or aborts
+    with a 400 if it isn't valid
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return data["generation"], data["after"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        abort(400, "Invalid cursor")
+
+
+def search_position(after):
+    """Validates the (score, store id) position of a search cursor"""
+    try:
+        score, store_id = after
+        return float(score), int(store_id)
+    except (ValueError, TypeError):
+        abort(400, "Invalid cursor")
+
+
+def thread_position(after):
+    """Validates the thread_idx position of a thread cursor"""
+    if not isinstance(after, int):
+        abort(400, "Invalid cursor")
+    return after
+
+
+def requested_fields():
+    """Returns the fields selected with `fields=a,b,c`"""
+    fields = request.args.get("fields")
+    if not fields:
+        return DEFAULT_FIELDS
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = set(fields) - set(MESSAGE_FIELDS)
+    if unknown:
+        abort(400, "Unknown fields: {}".format(", ".join(sorted(unknown))))
+    return fields
+
+
+def requested_page(position):
+    """Returns the (generation, position, limit) of the requested page of
+    results
+
+    The generation and position are None for the first page. `position`
+    validates the position of the cursor.
+    """
+    cursor = request.args.get("cursor")
+    generation, after = None, None
+    if cursor:
+        generation, after = decode_cursor(cursor)
+        after = position(after)
+    limit = request.args.get("limit", DEFAULT_LIMIT, type=int)
+    return generation, after, max(1, min(limit, MAX_LIMIT))
+
+
+def check_generation(messages, generation, after):
+    """Aborts with a 410 if the cursor's page was read from a generation of
+    the index that has since been replaced
+
+    Positions can't be carried over to another generation, since scores and
+    store ids change when the index is rebuilt.
+    """
+    if after is not None and messages.generation != generation:
+        abort(410, "The index has changed. Start again from the first page")
+
+
+def next_cursor(messages):
+    """Returns the cursor of the page after a `MessageStream`, or None if
+    it's the last page
+    """
+    if messages.next_after is None:
+        return None
+    return encode_cursor(messages.generation, messages.next_after)
+
+
+def message_json(message, fields):
+    data = {}
+    for field in fields:
+        value = getattr(message, field, None)
+        if field == "sent_at" and value is not None:
+            value = value.isoformat()
+        data[field] = value
+    return data
+
+
+def ndjson_response(messages, fields, total=None, next_cursor=None):
+    """Streams messages as newline-delimited JSON, one message per line
+
+    The size of the whole result set and the cursor of the next page (if
+    there is one) are sent in the `X-Total-Count` and `X-Next-Cursor`
+    headers.
+    """
+    def generate():
+        for message in messages:
+            yield json.dumps(message_json(message, fields)) + "\n"
+
+    headers = {}
+    if total is not None:
+        headers["X-Total-Count"] = str(total)
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(generate(), mimetype="application/x-ndjson", headers=headers)
+
+
+@api.route("/search")
+def search():
+    query = request.args.get("query", "")
+    start, end = parse_daterange(request.args.get("daterange", ""))
+    fields = requested_fields()
+    generation, after, limit = requested_page(search_position)
+    with timed_search():
+        results = get_searcher().stream_search(
+            query,
+            after=after,
+            limit=limit,
+            list_id=request.args.get("mail-id") or None,
+            start=start,
+            end=end,
+            snippets="snippet" in fields,
+        )
+    check_generation(results, generation, after)
+    return ndjson_response(
+        results, fields, results.total, next_cursor(results)
+    )
+
+
+@api.route("/thread/<list_id>/<int:thread_id>")
+def thread(list_id, thread_id):
+    fields = requested_fields()
+    generation, after, limit = requested_page(thread_position)
+    with timed_search():
+        messages = get_searcher().stream_thread(
+            list_id, thread_id, after=after, limit=limit
+        )
+    check_generation(messages, generation, after)
+    return ndjson_response(
+        messages, fields, messages.total, next_cursor(messages)
+    )
+
+
+@api.route("/similar/<list_id>/<message_id>")
+def similar(list_id, message_id):
+    fields = requested_fields()
+    with timed_search():
+        messages = get_searcher().find_similar_messages(list_id, message_id)
+    return ndjson_response(messages, fields, len(messages))
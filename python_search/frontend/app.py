@@ -1,11 +1,44 @@
-from flask import Flask, render_template, request
-from dateutil.parser import parse 
+import time
+from flask import (
+    Flask, Response, abort, g, jsonify, render_template, request, url_for
+)
+from .. import metrics
+from ..render import render_as_html
 from ..scraper.model import Message
-from ..indexer.indexer import IndexSearcher
-from markdown import markdown
-from .render import render_as_html
+from .api import api
+from .helpers import get_searcher, parse_daterange, timed_search
 
 app = Flask(__name__)
+app.register_blueprint(api)
+
+REQUEST_SECONDS = metrics.histogram(
+    "http_request_seconds", "Time taken to handle requests", ["endpoint", "status"]
+)
+RENDER_SECONDS = metrics.histogram(
+    "frontend_render_seconds", "Time spent rendering templates", ["endpoint"]
+)
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or "none",
+            status=response.status_code,
+        )
+    return response
+
+
+def render_page(template, **context):
+    with RENDER_SECONDS.time(endpoint=request.endpoint):
+        return render_template(template, **context)
 
 
 @app.route("/")
@@ -13,72 +46,140 @@ def index():
     return render_template("index.html")
 
 
+SEARCH_PAGE_SIZE = 10
+
+
 @app.route("/search")
 def search():
     query = request.args.get('query', '')
     daterange = request.args.get('daterange', '')
     mail_list_id = request.args.get('mail-id', '')
-    searcher = IndexSearcher(app.config["index_dir"])
-    search_results = [result for result in searcher.search(query) 
-                    if within_range(result.sent_at, daterange) and same_list(result.list_id, mail_list_id)]
-    
-    for result in search_results:
-        result.text = render_as_html(result.text)
-
-    return render_template(
-        "results.html", search_results=search_results, query=query
+    page = request.args.get('page', 1, type=int)
+    start, end = parse_daterange(daterange)
+    searcher = get_searcher()
+    with timed_search():
+        search_results = searcher.search(
+            query,
+            page=page,
+            n=SEARCH_PAGE_SIZE,
+            list_id=mail_list_id or None,
+            start=start,
+            end=end,
+        )
+
+    return render_page(
+        "results.html",
+        search_results=search_results,
+        query=query,
+        total=search_results.total,
+        page=search_results.page,
+        page_count=search_results.page_count,
     )
 
 
-@app.route("/thread/<thread_id>")
-def get_list(thread_id):
-    searcher = IndexSearcher(app.config["index_dir"])
-    search_results = list(searcher.search_for_thread(thread_id))
-    search_results.sort(key=lambda res: res.thread_idx)
+THREAD_PAGE_SIZE = 100
+
+
+@app.route("/thread/<list_id>/<int:thread_id>")
+def get_list(list_id, thread_id):
+    page = request.args.get('page', 1, type=int)
+    searcher = get_searcher()
+    with timed_search():
+        search_results = searcher.search_for_thread(
+            list_id, thread_id, page=page, n=THREAD_PAGE_SIZE
+        )
+        thread_size = searcher.thread_size(list_id, thread_id)
+    page_count = (thread_size + THREAD_PAGE_SIZE - 1) // THREAD_PAGE_SIZE
 
     for result in search_results:
-        result.text = render_as_html(result.text)
+        result.text = rendered_text(result)
 
-    return render_template(
+    return render_page(
         "results.html",
         search_results=search_results,
         hide_thread=True,
         thread_id=thread_id,
+        page=page,
+        page_count=page_count,
     )
 
 
+@app.route('/message/<list_id>/<message_id>')
+def get_message(list_id, message_id):
+    with timed_search():
+        message = get_searcher().get_message(list_id, message_id)
+    if message is None:
+        abort(404)
+    message.text = rendered_text(message)
+
+    return render_page("results.html", search_results=[message])
+
+
 @app.route('/similar/<list_id>/<message_id>')
 def get_similar(list_id, message_id):
-    searcher = IndexSearcher(app.config["index_dir"])
-    search_results = list(searcher.find_similar_messages(list_id, message_id))
+    searcher = get_searcher()
+    with timed_search():
+        search_results = list(searcher.find_similar_messages(list_id, message_id))
 
     for result in search_results:
-        result.text = render_as_html(result.text)
+        result.text = rendered_text(result)
 
-    return render_template(
+    return render_page(
         "results.html",
         search_results=search_results,
     )
 
 
+@app.route('/stats')
+def stats():
+    return jsonify(query_cache=get_searcher().query_cache.stats())
+
+
+@app.route('/metrics')
+def metrics_view():
+    """The metrics, in the Prometheus text exposition format
+
+    Under the pre-forking server, counters and histograms are summed across
+    its workers (see `metrics.aggregate`).
+    """
+    metrics_dir = app.config.get("metrics_dir")
+    if metrics_dir is not None:
+        exposition = metrics.aggregate(metrics_dir)
+    else:
+        exposition = metrics.exposition()
+    return Response(
+        exposition, content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.route('/about')
 def about():
     return render_template('about.html')
 
 
-def within_range(sent_time, daterange):
-    if not daterange:
-        return True
-    date_parts = daterange.split('-')
-    start_date = parse(date_parts[0].strip())
-    end_date = parse(date_parts[1].strip())
-    return sent_time >= start_date and sent_time < end_date
+@app.template_global()
+def page_url(page):
+    """Returns the URL of the current view with its page set to `page`"""
+    args = request.args.to_dict()
+    args['page'] = page
+    args.update(request.view_args or {})
+    return url_for(request.endpoint, **args)
+
+
+@app.template_global()
+def page_window(page, page_count, width=5):
+    """Returns the page numbers to link to around `page`"""
+    first = max(1, page - width)
+    last = min(page_count, page + width)
+    return range(first, last + 1)
+
 
+def rendered_text(result):
+    """Returns the message's HTML, rendering it only if the indexer didn't"""
+    if getattr(result, 'html', None):
+        return result.html
+    return render_as_html(result.text)
 
-def same_list(result_list_id, filter_list_id):
-    if not filter_list_id:
-        return True
-    return filter_list_id == result_list_id
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,44 @@
+"""Helpers shared by the views of the app and of the JSON API"""
+import threading
+from flask import current_app, request
+from dateutil.parser import parse
+from .. import metrics
+from ..indexer.indexer import IndexSearcher
+
+SEARCH_SECONDS = metrics.histogram(
+    "frontend_search_seconds", "Time spent reading from the index", ["endpoint"]
+)
+
+_searcher_lock = threading.Lock()
+
+
+def get_searcher():
+    """Returns the process-wide IndexSearcher, creating it on first use
+
+    The searcher is shared by every request, and reloads itself when the
+    indexer commits a new generation of the index.
+    """
+    config = current_app.config
+    if config.get("searcher") is None:
+        with _searcher_lock:
+            if config.get("searcher") is None:
+                config["searcher"] = IndexSearcher(config["index_dir"])
+    return config["searcher"]
+
+
+def timed_search():
+    """Times the body of a `with` block as index reads of this view"""
+    return SEARCH_SECONDS.time(endpoint=request.endpoint)
+
+
+def parse_daterange(daterange):
+    """Parses a "start - end" date range into a (start, end) pair
+
+    Returns (None, None) if no range is given
+    """
+    if not daterange:
+        return None, None
+    date_parts = daterange.split('-')
+    start_date = parse(date_parts[0].strip())
+    end_date = parse(date_parts[1].strip())
+    return start_date, end_date
@@ -0,0 +1,180 @@
+"""A pre-forking production server for the frontend
+
+`serve` runs the app under gunicorn with `preload_app`. The master process
+opens the index and warms it up (see `IndexSearcher.warm`) before forking
+its workers, so every worker starts warm and shares the master's pages
+copy-on-write.
+
+A thread in the master watches the index for new generations. When the
+indexer commits one, the master sends itself SIGHUP: gunicorn then reloads,
+which warms a searcher over the new generation, starts new workers from it
+and gracefully stops the old ones once their requests have finished.
+
+Each worker writes its metrics to a directory shared by the server every
+few seconds and when it exits, so `/metrics` can sum up every worker's,
+whichever worker answers.
+"""
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from gunicorn.app.base import BaseApplication
+from .. import metrics
+from ..indexer.indexer import IndexSearcher
+from .app import app
+
+logger = logging.getLogger(__name__)
+
+
+def warm_searcher(index_dir):
+    """Opens and warms a searcher over the latest generation of the index,
+    and makes it the app's searcher
+    """
+    start = time.perf_counter()
+    searcher = IndexSearcher(index_dir)
+    searcher.warm()
+    old = app.config.get("searcher")
+    app.config["index_dir"] = index_dir
+    app.config["searcher"] = searcher
+    if old is not None:
+        old.close()
+    logger.info(
+        "Warmed generation {} of the index in {:.1f}s".format(
+            searcher.generation(), time.perf_counter() - start
+        )
+    )
+    return searcher
+
+
+class GenerationWatcher(threading.Thread):
+
+    """Sends the master SIGHUP when another generation of the index is
+    switched to (or, for an index written before generations, when the
+    indexer commits to a shard)
+    """
+
+    def __init__(self, index_dir, interval):
+        super().__init__(name="generation-watcher", daemon=True)
+        self.index_dir = index_dir
+        self.interval = interval
+
+    def run(self):
+        signalled = None
+        while True:
+            time.sleep(self.interval)
+            searcher = app.config["searcher"]
+            try:
+                stale = not searcher.up_to_date()
+            except Exception:
+                logger.exception("Couldn't read the index's generation")
+                continue
+            # Only signal once per searcher; the reload swaps in a new one
+            if stale and searcher is not signalled:
+                logger.info("New index generation found, reloading")
+                signalled = searcher
+                os.kill(os.getpid(), signal.SIGHUP)
+
+
+class SampleWriter(threading.Thread):
+
+    """Writes a worker's metrics to the server's metrics directory every
+    `interval` seconds (see `metrics.write_samples`)
+    """
+
+    def __init__(self, directory, interval):
+        super().__init__(name="sample-writer", daemon=True)
+        self.directory = directory
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                metrics.write_samples(self.directory)
+            except Exception:
+                logger.exception("Couldn't write the worker's metrics")
+
+
+class Server(BaseApplication):
+
+    """Gunicorn, configured in code rather than from the command line"""
+
+    def __init__(self, index_dir, options, watch_interval, metrics_dir,
+                 metrics_interval=5.0):
+        self.index_dir = index_dir
+        self.options = options
+        self.watch_interval = watch_interval
+        self.metrics_dir = metrics_dir
+        self.metrics_interval = metrics_interval
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set("preload_app", True)
+        self.cfg.set("when_ready", self.when_ready)
+        self.cfg.set("on_reload", self.on_reload)
+        self.cfg.set("post_fork", self.post_fork)
+        self.cfg.set("worker_exit", self.worker_exit)
+
+    def load(self):
+        return app
+
+    def when_ready(self, server):
+        # The master's own samples (e.g. from warming the index) count once
+        metrics.write_samples(self.metrics_dir)
+        if self.watch_interval:
+            GenerationWatcher(self.index_dir, self.watch_interval).start()
+
+    def on_reload(self, server):
+        warm_searcher(self.index_dir)
+        metrics.write_samples(self.metrics_dir)
+
+    def post_fork(self, server, worker):
+        app.config["searcher"].after_fork()
+        # Workers start from a copy of the master's samples, which the
+        # master has already written
+        metrics.drain()
+        SampleWriter(self.metrics_dir, self.metrics_interval).start()
+
+    def worker_exit(self, server, worker):
+        metrics.write_samples(self.metrics_dir)
+
+
+def serve(index_dir, host="127.0.0.1", port=8000, workers=None, threads=1,
+          watch_interval=5.0):
+    """Serves the frontend from a pre-forked pool of worker processes
+
+    Parameters
+    ----------
+    index_dir : str
+        The directory of the index
+    host : str
+        The address to listen on
+    port : int
+        The port to listen on
+    workers : int, optional
+        The number of worker processes (by default, one per core)
+    threads : int
+        The number of request threads per worker. Searches hold the GIL,
+        so throughput comes from workers; threads help with slow clients.
+    watch_interval : float
+        How often (in seconds) to check the index for a new generation, or
+        0 to never reload
+    """
+    warm_searcher(index_dir)
+    options = {
+        "bind": "{}:{}".format(host, port),
+        "workers": workers or os.cpu_count() or 1,
+        "threads": threads,
+        "worker_class": "gthread" if threads > 1 else "sync",
+    }
+    metrics_dir = tempfile.mkdtemp(prefix="python-search-metrics-")
+    app.config["metrics_dir"] = metrics_dir
+    try:
+        Server(index_dir, options, watch_interval, metrics_dir).run()
+    finally:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
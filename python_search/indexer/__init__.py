@@ -1 +1,9 @@
-from .indexer import index_cmd, IndexSearcher
\ No newline at end of file
+from .indexer import (
+    index_cmd,
+    optimize_cmd,
+    pack_cmd,
+    rollback_cmd,
+    similar_cmd,
+    unpack_cmd,
+    IndexSearcher,
+)
@@ -1,23 +1,58 @@
+import re
+
+# Lines after which the rest of a message is a signature, an attachment or
+# a mailing list footer
+END_MARKERS = frozenset([
+    '--',
+    '-------------- next part --------------',
+    '-----Original Message-----',
+    '_______________________________________________',
+])
+
+# Reply attribution lines, e.g. "On Tue, May 1, 2018 at 10:00 AM, Guido
+# van Rossum <guido at python.org> wrote:"
+ATTRIBUTION_RE = re.compile(r'^On .{0,200}\swrote:$')
+
+
 def clean_message(message):
+    """Strips quoted replies, signatures and attachments from a message
+
+    Runs in a single pass over the message's lines.
+    """
     lines = message.split('\n')
+    stripped = [line.strip() for line in lines]
+    line_count = len(lines)
+    kept = []
 
-    # Remove quoted text from messages
     l_idx = 0
-    while l_idx + 1 < len(lines):
-        line, next_line = lines[l_idx], lines[l_idx + 1]
-        if next_line.strip().startswith('>'):
-            lines.pop(l_idx)
-            while l_idx < len(lines) and lines[l_idx].strip().startswith('>'):
-                lines.pop(l_idx)
-        # Remove attachment messages from messages
-        elif line.strip() in ['--', '-------------- next part --------------']:
-            lines = lines[:l_idx]
-            break
-        else:
-            l_idx += 1
-    return '\n'.join(lines)
+    while l_idx + 1 < line_count:
+        line = stripped[l_idx]
+        # Remove quoted text, along with the line that introduces it
+        if stripped[l_idx + 1][:1] == '>':
+            l_idx += 2
+            while l_idx < line_count and stripped[l_idx][:1] == '>':
+                l_idx += 1
+            continue
+        # Remove signatures, attachments and footers
+        if line in END_MARKERS:
+            return '\n'.join(kept)
+        # Remove attributions that are separated from their quote
+        if not (line[:3] == 'On ' and ATTRIBUTION_RE.match(line)):
+            kept.append(lines[l_idx])
+        l_idx += 1
+
+    kept.extend(lines[l_idx:])
+    return '\n'.join(kept)
+
+
+def clean_messages(messages):
+    """Cleans a batch of messages (see `clean_message`)"""
+    return [clean_message(message) for message in messages]
 
 
 if __name__ == '__main__':
     test_document = 'start\nQuote Header\n>quote\n>quote\nNot Quoted'
     assert clean_message(test_document) == 'start\nNot Quoted'
+
+    test_document = 'start\nOn Tue, Guido wrote:\n\n>quote\nNot Quoted\n-- \nsig'
+    assert clean_message(test_document) == 'start\nNot Quoted'
@@ -0,0 +1,269 @@
+import json
+import mmap
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+
+# The stored fields of a message. Whoosh only stores the message's ids and
+# its `store_id`, which points at its record here.
+RECORD_FIELDS = [
+    "list_id",
+    "message_id",
+    "content",
+    "html",
+    "author",
+    "subject",
+    "sent_at",
+    "thread_parent",
+    "thread_idx",
+    "thread_indent",
+    "page",
+]
+
+# One entry per record: the offset and length of its compressed block in the
+# data file, and its position in the block
+ENTRY = np.dtype([("offset", "<u8"), ("length", "<u4"), ("slot", "<u4")])
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+STORE_FILE_RE = re.compile(r"^docstore-(\d+)\.idx$")
+# Incremental builds append to the latest epoch while its data file is
+# smaller than this, and start a new epoch after that (each build copies
+# the epoch it appends to, see `generations.clone_generation`)
+APPEND_LIMIT = 64 << 20
+
+
+def store_paths(index_dir, epoch):
+    base = os.path.join(index_dir, "docstore-{}".format(epoch))
+    return base + ".dat", base + ".idx"
+
+
+def store_epochs(index_dir):
+    """Returns the epochs of the document stores in `index_dir`"""
+    epochs = []
+    for name in os.listdir(index_dir):
+        match = STORE_FILE_RE.match(name)
+        if match:
+            epochs.append(int(match.group(1)))
+    return sorted(epochs)
+
+
+def appendable_epoch(index_dir):
+    """Returns the latest epoch of the store if an incremental build can
+    append to it, or None
+    """
+    epochs = store_epochs(index_dir)
+    if not epochs:
+        return None
+    data_path, _ = store_paths(index_dir, epochs[-1])
+    if os.path.getsize(data_path) >= APPEND_LIMIT:
+        return None
+    return epochs[-1]
+
+
+def make_store_id(epoch, record):
+    return (epoch << 32) | record
+
+
+def split_store_id(store_id):
+    return store_id >> 32, store_id & 0xFFFFFFFF
+
+
+def encode_record(document):
+    record = {field: document.get(field) for field in RECORD_FIELDS}
+    if record["sent_at"] is not None:
+        record["sent_at"] = record["sent_at"].strftime(DATE_FORMAT)
+    return record
+
+
+def decode_record(record):
+    if record["sent_at"] is not None:
+        record["sent_at"] = datetime.strptime(record["sent_at"], DATE_FORMAT)
+    return record
+
+
+class DocStoreWriter:
+
+    """Appends message records to a document store
+
+    Records are gathered into blocks of about `block_bytes`, which are
+    compressed and appended to `docstore-<epoch>.dat`. The offset table,
+    `docstore-<epoch>.idx`, is only extended on `commit`, so readers never
+    see records whose blocks haven't been written.
+
+    Every full rebuild, and incremental builds once the latest epoch is
+    large (see `APPEND_LIMIT`), start a new epoch.
+    """
+
+    def __init__(self, index_dir, new_epoch=False, block_bytes=1 << 16):
+        """
+        Parameters
+        ----------
+        index_dir : str
+            The directory of the index
+        new_epoch : bool
+            Whether to start a new, empty store rather than appending to the
+            latest one
+        block_bytes : int
+            The uncompressed size at which a block is written
+        """
+        self.index_dir = index_dir
+        self.block_bytes = block_bytes
+        epochs = store_epochs(index_dir)
+        if new_epoch or not epochs:
+            self.epoch = max(epochs, default=0) + 1
+        else:
+            self.epoch = epochs[-1]
+
+        data_path, index_path = store_paths(index_dir, self.epoch)
+        self._data = open(data_path, "ab")
+        self._index = open(index_path, "ab")
+        self._offset = self._data.tell()
+        self._committed = self._index.tell() // ENTRY.itemsize
+        self._block = []
+        self._block_size = 0
+        self._entries = []
+
+    def add(self, document):
+        """Adds the stored fields of `document` to the store
+
+        Returns
+        -------
+        int
+            The record's store id
+        """
+        record = encode_record(document)
+        store_id = make_store_id(
+            self.epoch, self._committed + len(self._entries) + len(self._block)
+        )
+        self._block.append(record)
+        self._block_size += len(record["content"] or "") + len(record["html"] or "")
+        if self._block_size >= self.block_bytes:
+            self._write_block()
+        return store_id
+
+    def _write_block(self):
+        if not self._block:
+            return
+        data = zlib.compress(json.dumps(self._block).encode("utf-8"))
+        self._data.write(data)
+        for slot in range(len(self._block)):
+            self._entries.append((self._offset, len(data), slot))
+        self._offset += len(data)
+        self._block = []
+        self._block_size = 0
+
+    def commit(self):
+        """Writes out every added record, and makes them visible to readers"""
+        self._write_block()
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        if self._entries:
+            self._index.write(np.array(self._entries, dtype=ENTRY).tobytes())
+            self._index.flush()
+            self._committed += len(self._entries)
+            self._entries = []
+
+    def close(self):
+        self.commit()
+        self._data.close()
+        self._index.close()
+
+
+class _MappedStore:
+
+    """The memory-mapped files of one epoch of the document store"""
+
+    def __init__(self, index_dir, epoch):
+        data_path, index_path = store_paths(index_dir, epoch)
+        self.data = _map(data_path)
+        index = _map(index_path)
+        count = len(index) // ENTRY.itemsize if index is not None else 0
+        self.entries = np.frombuffer(
+            index or b"", dtype=ENTRY, count=count
+        )
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def _map(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class DocStore:
+
+    """Reads message records from the document store
+
+    Stores are memory-mapped, and remapped when a lookup runs past the end
+    of the mapping (i.e. the indexer has committed more records). Recently
+    decompressed blocks are cached, and `get_many` decompresses each block
+    at most once.
+    """
+
+    def __init__(self, index_dir, cache_blocks=256):
+        self.index_dir = index_dir
+        self.cache_blocks = cache_blocks
+        self._stores = {}
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, epoch, record):
+        store = self._stores.get(epoch)
+        if store is None or record >= len(store):
+            try:
+                store = _MappedStore(self.index_dir, epoch)
+            except FileNotFoundError:
+                return None
+            self._stores[epoch] = store
+        return store
+
+    def _block(self, epoch, store, offset, length):
+        key = (epoch, offset)
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                return self._blocks[key]
+
+        data = zlib.decompress(store.data[offset:offset + length])
+        block = json.loads(data.decode("utf-8"))
+
+        with self._lock:
+            self._blocks[key] = block
+            while len(self._blocks) > self.cache_blocks:
+                self._blocks.popitem(last=False)
+        return block
+
+    def open_all(self):
+        """Maps the store of every epoch"""
+        for epoch in store_epochs(self.index_dir):
+            self._store(epoch, 0)
+
+    def get_many(self, store_ids):
+        """Reads the records of `store_ids`
+
+        Returns
+        -------
+        list of dict
+            The record of each store id, in the order given (None for ids
+            that aren't in the store)
+        """
+        records = []
+        for store_id in store_ids:
+            epoch, record = split_store_id(store_id)
+            store = self._store(epoch, record)
+            if store is None or record >= len(store):
+                records.append(None)
+                continue
+            offset, length, slot = store.entries[record]
+            block = self._block(epoch, store, int(offset), int(length))
+            records.append(decode_record(dict(block[slot])))
+        return records
+
+    def get(self, store_id):
+        return self.get_many([store_id])[0]
@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from whoosh.idsets import DocIdSet
+from whoosh.query import DateRange, Term
+
+
+class DocFilter(DocIdSet):
+
+    """An immutable set of document numbers, used as a search filter
+
+    The set is held as a Python int so filters can be combined with fast
+    bitwise operations, plus its little-endian bytes for O(1) membership
+    tests while collecting results.
+    """
+
+    def __init__(self, bits, doc_count):
+        self.bits = bits
+        self._bytes = bits.to_bytes((doc_count + 7) // 8, "little")
+
+    def __contains__(self, docnum):
+        bucket = docnum >> 3
+        if bucket >= len(self._bytes):
+            return False
+        return bool(self._bytes[bucket] & (1 << (docnum & 7)))
+
+    def __iter__(self):
+        for bucket, byte in enumerate(self._bytes):
+            while byte:
+                low = byte & -byte
+                yield (bucket << 3) + low.bit_length() - 1
+                byte ^= low
+
+    def __len__(self):
+        return bin(self.bits).count("1")
+
+    def __bool__(self):
+        # Whoosh treats a falsy filter as "no filter", so emptiness has to be
+        # checked by the caller (see `FilterCache.build`)
+        return True
+
+
+def month_start(year, month):
+    if month > 12:
+        year, month = year + 1, 1
+    return datetime(year, month, 1)
+
+
+class FilterCache:
+
+    """Caches the filter bitsets of one searcher
+
+    Bitsets are kept per mailing list and per calendar month. Date ranges
+    are built from the cached months they cover, so only the partial months
+    at either end of the range need to be read from the index.
+
+    Document numbers are only meaningful for one reader, so a cache must be
+    thrown away with its searcher.
+    """
+
+    def __init__(self, searcher, maxsize=512):
+        self.searcher = searcher
+        self.doc_count = searcher.doc_count_all()
+        self.maxsize = maxsize
+        self._bitsets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def adopt(self, other):
+        """Takes over the bitsets of `other`, a cache of a searcher over the
+        same generation of the index
+        """
+        with other._lock:
+            bitsets = OrderedDict(other._bitsets)
+        with self._lock:
+            self._bitsets = bitsets
+
+    def build(self, list_id=None, start=None, end=None):
+        """Returns a filter for messages of `list_id` sent in [start, end)
+
+        Returns None if no filter applies, and an empty DocFilter if nothing
+        can match (which callers must check, see `DocFilter.__bool__`).
+        """
+        bits = None
+        if list_id:
+            bits = self.list_bits(list_id)
+        if start is not None or end is not None:
+            date_bits = self.date_bits(start, end)
+            bits = date_bits if bits is None else bits & date_bits
+
+        if bits is None:
+            return None
+        return DocFilter(bits, self.doc_count)
+
+    def list_bits(self, list_id):
+        return self._cached(("list", list_id), Term("list_id", list_id))
+
+    def month_bits(self, year, month):
+        query = DateRange(
+            "sent_at",
+            month_start(year, month),
+            month_start(year, month + 1),
+            endexcl=True,
+        )
+        return self._cached(("month", year, month), query)
+
+    def date_bits(self, start=None, end=None):
+        if start is None or end is None:
+            # Open-ended ranges aren't broken into months
+            return self._query_bits(DateRange("sent_at", start, end, endexcl=True))
+
+        bits = 0
+        year, month = start.year, start.month
+        while month_start(year, month) < end:
+            first, last = month_start(year, month), month_start(year, month + 1)
+            if start <= first and last <= end:
+                bits |= self.month_bits(year, month)
+            else:
+                query = DateRange(
+                    "sent_at", max(start, first), min(end, last), endexcl=True
+                )
+                bits |= self._query_bits(query)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return bits
+
+    def _cached(self, key, query):
+        with self._lock:
+            if key in self._bitsets:
+                self._bitsets.move_to_end(key)
+                return self._bitsets[key]
+
+        bits = self._query_bits(query)
+
+        with self._lock:
+            self._bitsets[key] = bits
+            while len(self._bitsets) > self.maxsize:
+                self._bitsets.popitem(last=False)
+        return bits
+
+    def _query_bits(self, query):
+        buf = bytearray((self.doc_count + 7) // 8)
+        for docnum in query.docs(self.searcher):
+            buf[docnum >> 3] |= 1 << (docnum & 7)
+        return int.from_bytes(buf, "little")
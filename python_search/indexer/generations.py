@@ -0,0 +1,303 @@
+import fcntl
+import os
+import re
+import shutil
+import sqlite3
+import tarfile
+from contextlib import contextmanager
+from .docstore import appendable_epoch, store_epochs, store_paths
+from .shards import LAYOUT_FILE, SHARDS_DIR
+from .similar import SIMILAR_FILE
+from .threads import THREADS_FILE
+from .watermark import WATERMARK_FILE
+
+# Every build of the index (`index`, `similar` and `optimize`) writes a new
+# generation, `<index_dir>/generations/<number>`, which is never modified
+# once it has been published. `<index_dir>/current` is a symlink to the
+# generation that is served; publishing a build switches it atomically.
+#
+# An incremental build starts from a copy of the current generation. Files
+# that are never modified in place (Whoosh's segments and tables of
+# contents, and everything that is replaced rather than rewritten) are hard
+# links, so the copy is cheap.
+GENERATIONS_DIR = "generations"
+CURRENT_LINK = "current"
+BUILD_LOCK = "build.lock"
+BUILDING_PREFIX = ".building-"
+# The number of generations kept for rolling back (the current generation
+# is always kept)
+KEEP_GENERATIONS = 3
+GENERATION_RE = re.compile(r"^\d+$")
+BUILDING_RE = re.compile(r"^" + re.escape(BUILDING_PREFIX) + r"(\d+)$")
+# The files of an index written before it was versioned
+UNVERSIONED_RE = re.compile(
+    r"^(_?MAIN_.*|docstore-\d+\.(dat|idx)|threads\.db(-wal|-shm)?|"
+    r"similar\.npz|watermark\.json|shards\.json|shards)$"
+)
+
+
+def generation_path(index_dir, number):
+    return os.path.join(index_dir, GENERATIONS_DIR, str(number))
+
+
+def generation_numbers(index_dir):
+    """Returns the numbers of the published generations, oldest first"""
+    root = os.path.join(index_dir, GENERATIONS_DIR)
+    if not os.path.isdir(root):
+        return []
+    return sorted(int(name) for name in os.listdir(root) if GENERATION_RE.match(name))
+
+
+def current_generation(index_dir):
+    """Returns the number of the current generation, or None if no
+    generation has been published
+    """
+    try:
+        target = os.readlink(os.path.join(index_dir, CURRENT_LINK))
+    except OSError:
+        return None
+    return int(os.path.basename(target))
+
+
+def current_path(index_dir):
+    """Returns the directory of the current generation
+
+    An index that was written before generations were introduced is read
+    from `index_dir` itself.
+    """
+    number = current_generation(index_dir)
+    if number is None:
+        return index_dir
+    return generation_path(index_dir, number)
+
+
+@contextmanager
+def build_lock(index_dir):
+    """Holds the index's build lock for the duration of the block, waiting
+    for other builds to finish
+
+    Builds start from the current generation, so two at once would each
+    lose the other's changes.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, BUILD_LOCK), "w") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. a file system without hard links
+        shutil.copy2(src, dst)
+
+
+def _copy_database(src, dst):
+    # The backup API also copies what is still in the write-ahead log
+    source = sqlite3.connect(src)
+    target = sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def clone_generation(src, dst):
+    """Copies the index in `src` into the new directory `dst`, for an
+    incremental build
+
+    Files that builds modify in place are copied: the thread store, and the
+    latest epoch of the document store if it's small enough to be appended
+    to (see `docstore.appendable_epoch`). Everything else is hard linked.
+    """
+    os.makedirs(dst)
+    shards_dir = os.path.join(src, SHARDS_DIR)
+    if os.path.isdir(shards_dir):
+        for name in os.listdir(shards_dir):
+            if name.startswith("."):
+                continue
+            os.makedirs(os.path.join(dst, SHARDS_DIR, name))
+            for filename in os.listdir(os.path.join(shards_dir, name)):
+                if not filename.endswith("LOCK"):
+                    _link_or_copy(
+                        os.path.join(shards_dir, name, filename),
+                        os.path.join(dst, SHARDS_DIR, name, filename),
+                    )
+
+    appendable = appendable_epoch(src)
+    for epoch in store_epochs(src):
+        for path in store_paths(src, epoch):
+            target = os.path.join(dst, os.path.basename(path))
+            if epoch == appendable:
+                shutil.copy2(path, target)
+            else:
+                _link_or_copy(path, target)
+
+    for filename in (LAYOUT_FILE, SIMILAR_FILE, WATERMARK_FILE):
+        if os.path.exists(os.path.join(src, filename)):
+            _link_or_copy(os.path.join(src, filename), os.path.join(dst, filename))
+    if os.path.exists(os.path.join(src, THREADS_FILE)):
+        _copy_database(os.path.join(src, THREADS_FILE), os.path.join(dst, THREADS_FILE))
+
+
+class Build:
+
+    """A generation of the index that is being written
+
+    The generation is written to a hidden directory, and only gets its
+    number (and can be switched to) once it is published.
+
+    Attributes
+    ----------
+    path : str
+        The directory to write the generation to
+    number : int
+        The number the generation is published as
+    """
+
+    def __init__(self, index_dir, clone=False):
+        """
+        Parameters
+        ----------
+        index_dir : str
+            The directory of the index
+        clone : bool
+            Whether to start from a copy of the current generation rather
+            than an empty directory
+        """
+        self.index_dir = index_dir
+        root = os.path.join(index_dir, GENERATIONS_DIR)
+        os.makedirs(root, exist_ok=True)
+        building = [
+            int(match.group(1))
+            for match in map(BUILDING_RE.match, os.listdir(root))
+            if match
+        ]
+        self.number = max(generation_numbers(index_dir) + building, default=0) + 1
+        self.path = os.path.join(root, BUILDING_PREFIX + str(self.number))
+        if clone:
+            clone_generation(current_path(index_dir), self.path)
+        else:
+            os.makedirs(self.path)
+
+    def publish(self):
+        """Makes the generation the current one"""
+        path = generation_path(self.index_dir, self.number)
+        os.rename(self.path, path)
+        self.path = path
+        switch_generation(self.index_dir, self.number)
+
+    def abandon(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@contextmanager
+def new_generation(index_dir, clone=False):
+    """Writes a new generation of the index in the block, and publishes it
+    if the block succeeds
+
+    Old generations are garbage collected afterwards.
+
+    Yields
+    ------
+    Build
+    """
+    with build_lock(index_dir):
+        new = Build(index_dir, clone)
+        try:
+            yield new
+        except BaseException:
+            new.abandon()
+            raise
+        new.publish()
+        collect_garbage(index_dir)
+
+
+def switch_generation(index_dir, number):
+    """Points `current` at the generation `number`, atomically"""
+    if not os.path.isdir(generation_path(index_dir, number)):
+        raise ValueError("Index generation {} doesn't exist".format(number))
+    link = os.path.join(index_dir, CURRENT_LINK)
+    tmp_link = link + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.join(GENERATIONS_DIR, str(number)), tmp_link)
+    os.replace(tmp_link, link)
+
+
+def collect_garbage(index_dir, keep=KEEP_GENERATIONS):
+    """Deletes all but the newest `keep` generations (and the current one),
+    abandoned builds and the files of an unversioned index
+
+    Must be called with the build lock held. Frontends that are still
+    reading a deleted generation keep the files they have open.
+    """
+    current = current_generation(index_dir)
+    numbers = generation_numbers(index_dir)
+    for number in numbers[:-keep] if keep else numbers:
+        if number != current:
+            shutil.rmtree(generation_path(index_dir, number))
+
+    root = os.path.join(index_dir, GENERATIONS_DIR)
+    for name in os.listdir(root):
+        if BUILDING_RE.match(name):
+            shutil.rmtree(os.path.join(root, name))
+
+    if current is not None:
+        for name in os.listdir(index_dir):
+            if UNVERSIONED_RE.match(name):
+                path = os.path.join(index_dir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+
+
+def pack_generation(index_dir, archive_path, number=None):
+    """Writes a generation (by default the current one) to a tar archive,
+    for copying to other servers (see `unpack_generation`)
+
+    Returns the number of the generation.
+    """
+    number = number if number is not None else current_generation(index_dir)
+    if number is None:
+        raise ValueError("The index has no generations to pack")
+    path = generation_path(index_dir, number)
+    tmp_path = archive_path + ".tmp"
+    with tarfile.open(tmp_path, "w") as archive:
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.endswith("LOCK"):
+                    continue
+                filepath = os.path.join(root, filename)
+                archive.add(filepath, os.path.relpath(filepath, path))
+    os.replace(tmp_path, archive_path)
+    return number
+
+
+def _check_member(member):
+    parts = member.name.split("/")
+    if member.name.startswith("/") or ".." in parts:
+        raise ValueError("Unsafe path in index archive: {}".format(member.name))
+    if not (member.isfile() or member.isdir()):
+        raise ValueError("Unexpected file in index archive: {}".format(member.name))
+
+
+def unpack_generation(index_dir, archive_path):
+    """Publishes the generation packed in `archive_path` as a new generation
+    of the index
+
+    Returns the number of the new generation.
+    """
+    with new_generation(index_dir) as new, tarfile.open(archive_path) as archive:
+        members = archive.getmembers()
+        for member in members:
+            _check_member(member)
+        archive.extractall(new.path, members)
+    return new.number
@@ -1,89 +1,487 @@
-import os.path
+import heapq
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import Pool
+from operator import itemgetter
 from whoosh import index
+from whoosh.collectors import FilterCollector, TopCollector
 from whoosh.fields import Schema, TEXT, ID, DATETIME, NUMERIC
 from whoosh.qparser import QueryParser
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from tqdm import tqdm
+from .. import metrics
+from ..render import render_as_html, RENDER_VERSION
 from ..scraper.model import Message
-from .cleaning import clean_message
+from ..scraper.storage import open_engine
+from .cleaning import clean_messages
+from .docstore import DocStore, DocStoreWriter, appendable_epoch
+from .generations import (
+    build_lock,
+    current_generation,
+    current_path,
+    generation_numbers,
+    generation_path,
+    new_generation,
+    pack_generation,
+    switch_generation,
+    unpack_generation,
+)
+from .query_cache import CachedPage, QueryCache
+from .shards import (
+    ShardedSearcher,
+    ShardWriters,
+    layout_is_current,
+    needs_optimize,
+    shard_for,
+    shard_names,
+    shard_path,
+    shard_stats,
+    within_range,
+)
+from .similar import SimilarMessages, SIMILAR_FILE
+from .snippets import Snippets, query_terms
+from .source import MessageSource
+from .threads import ThreadStore
+from .timing import StageTimer
+from .watermark import Watermark
+
+STAGE_SECONDS = metrics.histogram(
+    "indexer_stage_seconds",
+    "Time taken by each stage of indexing: per row for fetch, per document "
+    "for clean, render, store and analyze, per commit (including merging "
+    "segments) for commit, and per run for the final merge of the \"final\" "
+    "merge policy",
+    ["stage"],
+)
+ROWS_INDEXED = metrics.counter(
+    "indexer_rows_total", "Database rows read by the indexer"
+)
+DOCUMENTS_INDEXED = metrics.counter(
+    "indexer_documents_total", "Documents written to the index"
+)
+ROWS_PER_SECOND = metrics.gauge(
+    "indexer_rows_per_second", "Rows indexed per second by the last run"
+)
 
 # Setup Index
 schema = Schema(
+    doc_key=ID(unique=True),
     list_id=ID(stored=True),
     message_id=ID(stored=True),
-    content=TEXT(stored=True),
-    author=TEXT(stored=True),
-    subject=TEXT(stored=True),
-    sent_at=DATETIME(stored=True),
-    thread_parent=NUMERIC(stored=True),
-    thread_idx=NUMERIC(stored=True),
-    thread_indent=NUMERIC(stored=True),
-    page=TEXT(stored=True),
+    # Everything else is stored in the document store (see `docstore.py`)
+    store_id=NUMERIC(int, bits=64, signed=False, stored=True),
+    content=TEXT,
+    author=TEXT,
+    subject=TEXT,
+    sent_at=DATETIME,
+    thread_parent=NUMERIC,
+    thread_idx=NUMERIC,
+    thread_indent=NUMERIC,
+    page=TEXT,
 )
 
+# The most shard writers a build keeps open at once
+MAX_OPEN_WRITERS = 16
 
-def open_index(index_dir):
-    if not os.path.exists(index_dir):
-        os.mkdir(index_dir)
-        return index.create_in(index_dir, schema)
-    else:
-        return index.open_dir(index_dir)
+# How a build merges the segments of the index:
+# - "small": merge small segments on every commit (Whoosh's default)
+# - "final": never merge while loading, then merge each shard that was
+#   written to into a single segment at the end of the run
+# - "none": never merge, leaving it to `optimize_cmd`
+MERGE_POLICIES = ("small", "final", "none")
 
 
-def dict_factory(cursor, row):
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+BLACKLISTED_LISTS = []
 
 
-BLACKLISTED_LISTS = []
+def message_key(list_id, message_id):
+    """Returns the unique key of a message in the index"""
+    return "{}/{}".format(list_id, message_id)
+
+
+def prepare_documents(rows):
+    """Cleans and renders a batch of message rows into the fields of index
+    documents
+
+    Runs in the indexing worker processes. The texts of the batch are
+    cleaned together (see `clean_messages`). Returns, for each row, its
+    watermark information, its document (None if the message has no text)
+    and the time spent on it in each stage. A row's share of the cleaning
+    time is the batch's average.
+    """
+    texts = [row["text"] for row in rows if row["text"]]
+    start = time.perf_counter()
+    contents = iter(clean_messages(texts))
+    clean_seconds = (time.perf_counter() - start) / max(len(texts), 1)
+
+    prepared = []
+    for row in rows:
+        timings = {}
+        document = None
+        if row["text"]:
+            content = next(contents)
+            timings["clean"] = clean_seconds
+
+            start = time.perf_counter()
+            html = render_as_html(content)
+            timings["render"] = time.perf_counter() - start
+
+            document = dict(
+                doc_key=message_key(row["list_id"], row["message_id"]),
+                list_id=row["list_id"],
+                message_id=row["message_id"],
+                content=content,
+                html=html,
+                author=row["author"],
+                sent_at=row["sent_at"],
+                thread_parent=row["thread_parent"],
+                thread_idx=row["thread_idx"],
+                thread_indent=row["thread_indent"],
+                page=row["page"],
+                subject=row["subject"],
+            )
+        prepared.append(
+            (row["list_id"], row["rowid"], row["sent_at"], document, timings)
+        )
+    return prepared
+
+
+def prepare_serially(rows, chunk_size=200):
+    """Prepares documents on the calling process, a chunk at a time"""
+    for chunk in batched(rows, chunk_size):
+        yield from prepare_documents(chunk)
 
 
-def update_index(session, index):
-    print("Calculating query size...")
-    query = session.query(Message)#.filter(Message.sent_at > '2016-01-01').filter_by(list_id='python-dev')
-    count = query.count()
-    writer = index.writer()
+def prepare_in_pool(pool, rows, batch_size=2000, chunk_size=200):
+    """Prepares documents in `pool`, keeping one batch in flight while the
+    previous one is written
 
+    Each batch is split into chunks of `chunk_size` rows, which the workers
+    prepare with `prepare_documents`. Rows are read on the calling thread,
+    since SQLite connections can't be shared with the pool's feeder thread.
+    """
+    pending = None
+    for batch in batched(rows, batch_size):
+        result = pool.map_async(
+            prepare_documents, list(batched(batch, chunk_size)), chunksize=1
+        )
+        if pending is not None:
+            for chunk in pending.get():
+                yield from chunk
+        pending = result
+    if pending is not None:
+        for chunk in pending.get():
+            yield from chunk
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def index_fields(document, store_id):
+    """Returns the fields of `document` that go into the inverted index"""
+    fields = {name: document[name] for name in schema.names() if name in document}
+    fields["store_id"] = store_id
+    return fields
+
+
+def open_writer(index, procs=1):
+    if procs > 1:
+        # Each sub-writer analyzes documents in its own process and writes
+        # its own segment
+        return index.writer(procs=procs, multisegment=True, limitmb=256)
+    return index.writer()
+
+
+def update_index(
+    source, writers, watermark, threads, docstore, incremental=False, procs=1,
+    optimize=False,
+):
+    """Indexes the messages of `source` (a `MessageSource`) into the shards
+    of `writers` (a `ShardWriters`)
+
+    Each message goes into the shard of its mailing list's group and the
+    year it was sent (see `shards.py`). A full build replaces every document
+    in the index. An incremental build only reads rows past the watermark
+    and replaces documents that share a (list_id, message_id) key, so running
+    it twice never duplicates a message. It only opens the shards that new
+    messages fall in, which are usually those of the current year.
+
+    With `procs` > 1, cleaning runs in a pool of worker processes and
+    analysis in `procs` sub-writers.
+
+    If `optimize` is set, each shard that was written to is merged into a
+    single segment once everything has been committed.
+
+    The thread store and the document store are written alongside the
+    index. The document store is committed first, so the index never points
+    at records that haven't been written.
+    """
+    if not incremental:
+        watermark.reset()
+        watermark.render_version = RENDER_VERSION
+        threads.clear()
+
+    since = watermark if incremental else None
+    count = source.approximate_count(since)
+    timer = StageTimer(STAGE_SECONDS)
+    started = time.perf_counter()
+
+    rows = timer.timed_iter("fetch", source.rows(since))
+
+    pool = None
+    if procs > 1:
+        pool = Pool(processes=procs)
+        prepared = prepare_in_pool(pool, rows)
+    else:
+        prepared = prepare_serially(rows)
+
+    idx = -1
+    uncommitted = 0
+    indexed = 0
     with tqdm(total=count) as pbar:
-        for idx, message in enumerate(query.yield_per(100)):
+        for idx, (list_id, rowid, sent_at, document, timings) in enumerate(prepared):
             pbar.update(1)
-            if not message.text:
+            ROWS_INDEXED.inc()
+            watermark.advance(list_id, rowid, sent_at)
+            if document is None:
                 continue
 
-            writer.add_document(
-                list_id=message.list_id,
-                message_id=message.message_id,
-                content=clean_message(message.text),
-                author=message.author,
-                sent_at=message.sent_at,
-                thread_parent=message.thread_parent,
-                thread_idx=message.thread_idx,
-                thread_indent=message.thread_indent,
-                page=message.page,
-                subject=message.subject,
+            for stage, seconds in timings.items():
+                timer.add(stage, seconds)
+            uncommitted += 1
+            indexed += 1
+            DOCUMENTS_INDEXED.inc()
+            with timer.time("store"):
+                store_id = docstore.add(document)
+            with timer.time("analyze"):
+                writer = writers.writer(
+                    shard_for(document["list_id"], document["sent_at"])
+                )
+                if incremental:
+                    writer.update_document(**index_fields(document, store_id))
+                else:
+                    writer.add_document(**index_fields(document, store_id))
+            threads.add(
+                document["list_id"],
+                document["message_id"],
+                document["thread_parent"],
+                document["thread_idx"],
             )
+
             if idx % 10000 == 0 and idx != 0:
                 pbar.write("Comitting at doc {}...".format(idx))
-                writer.commit()
-                writer = index.writer()
+                with timer.time("commit", uncommitted):
+                    docstore.commit()
+                    writers.commit()
+                    threads.commit()
+                watermark.save()
+                uncommitted = 0
         pbar.write("Comitting at doc {}...".format(idx+1))
-    writer.commit()
+    with timer.time("commit", uncommitted):
+        docstore.commit()
+        writers.finish()
+        threads.commit()
+    watermark.save()
+    if optimize:
+        print("Merging segments...")
+        with timer.time("merge", indexed):
+            writers.optimize()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    ROWS_PER_SECOND.set((idx + 1) / (time.perf_counter() - started))
+    print(timer.report())
 
 
-def index_cmd(db, index_dir):
-    index = open_index(index_dir)
+def index_cmd(db, index_dir, incremental=False, procs=1, metrics_file=None,
+              merge="small"):
+    """Indexes the scraper database `db` into a new generation of the index
+    in `index_dir`, and switches to it (see `generations.py`)
 
-    engine = create_engine("sqlite:///{}".format(db))
-    session = sessionmaker(bind=engine)()
+    A full build starts from an empty generation, and an incremental one
+    from a copy of the current generation. `merge` is the merge policy of the
+    run (see `MERGE_POLICIES`). If `metrics_file` is given, the run's metrics
+    are written to it when the run ends.
+    """
+    if merge not in MERGE_POLICIES:
+        raise ValueError("Unknown merge policy: {}".format(merge))
+    os.makedirs(index_dir, exist_ok=True)
+    current = current_path(index_dir)
 
-    update_index(session, index)
+    if incremental and not layout_is_current(current, schema):
+        print("Index layout is out of date. Rebuilding the full index...")
+        incremental = False
+
+    if incremental and Watermark.load(current).render_version != RENDER_VERSION:
+        print("Message renderer has changed. Rebuilding the full index...")
+        incremental = False
+
+    # Creates the indexes the source's queries rely on
+    open_engine(db).dispose()
+    source = MessageSource(db)
+
+    with new_generation(index_dir, clone=incremental) as build:
+        watermark = Watermark.load(build.path)
+        threads = ThreadStore(build.path)
+        docstore = DocStoreWriter(
+            build.path,
+            new_epoch=not incremental or appendable_epoch(build.path) is None,
+        )
+        writers = ShardWriters(
+            build.path,
+            schema,
+            lambda shard: open_writer(shard, procs),
+            # Each writer has `procs` sub-writers
+            max_open=max(1, MAX_OPEN_WRITERS // procs),
+            before_commit=docstore.commit,
+            merge=merge == "small",
+        )
+
+        update_index(
+            source,
+            writers,
+            watermark,
+            threads,
+            docstore,
+            incremental=incremental,
+            procs=procs,
+            optimize=merge == "final",
+        )
+        docstore.close()
+        threads.close()
+    print("Switched to generation {} of the index".format(build.number))
+    source.close()
+    if metrics_file:
+        metrics.dump(metrics_file)
+
+
+def indexed_documents(docstore, store_ids, batch_size=1000):
+    """Yields the (doc_key, store_id, content) of the documents with the
+    given store ids
+    """
+    for batch in batched(store_ids, batch_size):
+        for store_id, record in zip(batch, docstore.get_many(batch)):
+            if record is not None:
+                key = message_key(record["list_id"], record["message_id"])
+                yield key, store_id, record["content"]
+
+
+def similar_cmd(index_dir, full=False):
+    """Finds the most similar messages of each message in the index, and
+    saves them in a new generation of the index
+
+    Only messages that aren't in the existing similarity index, or that
+    were re-indexed since they were hashed, are hashed, unless `full` is set.
+    """
+    with new_generation(index_dir, clone=True) as build:
+        add_similar_messages(build.path, full)
+    print("Switched to generation {} of the index".format(build.number))
+
+
+def add_similar_messages(path, full=False):
+    """Updates the similarity index of the index in `path`"""
+    docstore = DocStore(path)
+    similar = SimilarMessages(path) if full else SimilarMessages.load(path)
+
+    store_ids = []
+    seen = set()
+    for name in shard_names(path):
+        with index.open_dir(shard_path(path, name)).reader() as reader:
+            # Replaced documents are left out, so a re-indexed message shows
+            # up with the store id of its new record
+            for _, fields in reader.iter_docs():
+                key = message_key(fields["list_id"], fields["message_id"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                if similar.store_id(key) != fields["store_id"]:
+                    store_ids.append(fields["store_id"])
+
+    print("Hashing {} new or re-indexed messages...".format(len(store_ids)))
+    similar.add(indexed_documents(docstore, store_ids), count=len(store_ids))
+
+    similar.save()
+    print("Saved the similar messages of {} messages".format(len(similar)))
+
+
+def optimize_cmd(index_dir):
+    """Merges the segments of each shard of the index into one, in a new
+    generation of the index
+
+    The frontend keeps serving the current generation until the merged one
+    is switched to.
+    """
+    current = current_path(index_dir)
+    names = shard_names(current)
+    before = [0, 0]
+    after = [0, 0]
+    optimized = 0
+    with new_generation(index_dir, clone=True) as build:
+        for name in tqdm(names):
+            segments, size = shard_stats(shard_path(current, name))
+            before[0] += segments
+            before[1] += size
+            path = shard_path(build.path, name)
+            if needs_optimize(path):
+                index.open_dir(path).optimize()
+                optimized += 1
+            segments, size = shard_stats(path)
+            after[0] += segments
+            after[1] += size
+
+    print("Optimized {} of {} shards".format(optimized, len(names)))
+    print("Segments: {} -> {}".format(before[0], after[0]))
+    print("Size: {:.1f} MB -> {:.1f} MB".format(before[1] / 2**20, after[1] / 2**20))
+    print("Switched to generation {} of the index".format(build.number))
+
+
+def rollback_cmd(index_dir, generation=None):
+    """Switches the index back to an earlier generation (by default the one
+    before the current one)
+    """
+    with build_lock(index_dir):
+        numbers = generation_numbers(index_dir)
+        if generation is None:
+            older = [n for n in numbers if n < (current_generation(index_dir) or 0)]
+            if not older:
+                print("There is no earlier generation to roll back to")
+                return
+            generation = older[-1]
+        switch_generation(index_dir, generation)
+    print("Switched to generation {} of the index".format(generation))
+
+
+def pack_cmd(index_dir, archive, generation=None):
+    """Packs a generation of the index (by default the current one) into
+    the tar file `archive`
+    """
+    number = pack_generation(index_dir, archive, generation)
+    print("Packed generation {} of the index into {}".format(number, archive))
+
+
+def unpack_cmd(index_dir, archive):
+    """Unpacks a generation packed by `pack_cmd` into the index, and
+    switches to it
+    """
+    number = unpack_generation(index_dir, archive)
+    print("Switched to generation {} of the index".format(number))
 
 
 def index_result_to_message(result):
-    return Message(
+    """Converts a document store record into a `Message`"""
+    message = Message(
         list_id=result['list_id'],
         message_id=result['message_id'],
         text=result['content'],
@@ -95,33 +493,614 @@ def index_result_to_message(result):
         page=result['page'],
         subject=result['subject'],
     )
+    # Pre-rendered HTML of the message body (see `prepare_documents`)
+    message.html = result.get('html')
+    return message
+
+
+def store_ids_of(lease, hits):
+    """Returns the store ids of `hits`, (shard, docnum) pairs of a
+    `ShardLease`, in the same order
+    """
+    store_ids = {
+        (name, docnum): lease.searcher(name).stored_fields(docnum)["store_id"]
+        for name, docnum in sorted(hits)
+    }
+    return [store_ids[hit] for hit in hits]
+
+
+def stored_records(lease, docstore, hits):
+    """Loads the document store records of `hits`, in the same order
+
+    Records that are missing from the store are None.
+    """
+    return docstore.get_many(store_ids_of(lease, hits))
+
+
+def stored_messages(lease, docstore, keys):
+    """Loads the stored messages with the given doc keys, in the order of
+    `keys`
+
+    Keys that aren't in the index are skipped.
+    """
+    return [
+        index_result_to_message(record)
+        for record in stored_records(lease, docstore, lease.documents(keys))
+        if record is not None
+    ]
+
+
+def matched_terms(lease, query, hits):
+    """Returns the words of the content field that `query` matches in the
+    shards of `hits` (see `query_terms`)
+    """
+    terms = set()
+    for name in {name for name, _ in hits}:
+        terms |= query_terms(query, lease.searcher(name).reader())
+    return terms
+
+
+class SeekCollector(TopCollector):
+
+    """Collects the best `limit` matches that come after the match `after`
+
+    Matches are ordered by score, best first, then by store id, so the
+    order is the same on every search of a generation of the index and a
+    page of results can resume right after the last match of the previous
+    page, without collecting the matches before it.
+
+    Attributes
+    ----------
+    skipped : int
+        The number of matches at or before `after`
+    """
+
+    def __init__(self, limit, after=None):
+        """
+        Parameters
+        ----------
+        limit : int
+            The number of matches to keep
+        after : (float, int), optional
+            The (score, store id) of the match to resume after
+        """
+        # Block quality skipping would drop matches that tie with the worst
+        # kept score, which may come first by store id
+        super().__init__(limit=limit, usequality=False)
+        self.after = after
+        self.skipped = 0
+
+    def prepare(self, top_searcher, q, context):
+        super().prepare(top_searcher, q, context)
+        self.skipped = 0
+        self._store_ids = {}
+
+    def _store_id(self, docnum):
+        store_id = self._store_ids.get(docnum)
+        if store_id is None:
+            store_id = self.top_searcher.stored_fields(docnum)["store_id"]
+            self._store_ids[docnum] = store_id
+        return store_id
+
+    def _collect(self, global_docnum, score):
+        self.total += 1
+        if self.after is not None:
+            after_score, after_id = self.after
+            if score > after_score or (
+                score == after_score
+                and self._store_id(global_docnum) <= after_id
+            ):
+                self.skipped += 1
+                return 0
+
+        items = self.items
+        if len(items) == self.limit and score < items[0][0]:
+            return 0
+        # Store ids are negated so that lower ids win ties on score
+        item = (score, 0 - self._store_id(global_docnum), global_docnum)
+        if len(items) < self.limit:
+            heapq.heappush(items, item)
+        elif item > items[0]:
+            heapq.heapreplace(items, item)
+        else:
+            return 0
+        return 0 - score
+
+    def hits(self):
+        """Returns the kept matches as (score, store id, docnum), in order"""
+        return [
+            (score, 0 - store_id, docnum)
+            for score, store_id, docnum in sorted(self.items, reverse=True)
+        ]
+
+
+class MessageStream:
+
+    """The messages of a result set, read from the document store in batches
+    as they are iterated
+
+    No searcher is held while the stream is consumed: store ids don't
+    depend on the searcher, and the document store of the generation that
+    was searched stays readable until that generation is garbage collected.
+
+    Attributes
+    ----------
+    total : int
+        The size of the whole result set, of which this is a slice
+    generation : int
+        The generation of the index that was read, or None if the index
+        isn't versioned
+    next_after : object
+        The position to resume after for the next slice, or None if this
+        slice is the last
+    """
+
+    def __init__(self, docstore, store_ids, total, snippets=None, batch_size=100,
+                 generation=None, next_after=None):
+        self.docstore = docstore
+        self.store_ids = store_ids
+        self.total = total
+        self.snippets = snippets
+        self.batch_size = batch_size
+        self.generation = generation
+        self.next_after = next_after
+
+    def __iter__(self):
+        for batch in batched(self.store_ids, self.batch_size):
+            for record in self.docstore.get_many(batch):
+                if record is None:
+                    continue
+                message = index_result_to_message(record)
+                if self.snippets is not None:
+                    message.snippet = self.snippets.snippet(record["content"])
+                yield message
+
+
+class SearchResults:
+
+    """One page of search results
+
+    Iterating over the results yields the page's messages.
+
+    Attributes
+    ----------
+    total : int
+        The number of messages matching the query
+    page : int
+        The page number, starting at 1
+    pagelen : int
+        The number of results per page
+    """
+
+    def __init__(self, messages, total, page, pagelen):
+        self.messages = messages
+        self.total = total
+        self.page = page
+        self.pagelen = pagelen
+
+    @property
+    def page_count(self):
+        return (self.total + self.pagelen - 1) // self.pagelen
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __len__(self):
+        return len(self.messages)
+
+
+class _Generation:
+
+    """The readers of one generation of the index (see `generations.py`),
+    shared by the requests that have it pinned
+    """
+
+    def __init__(self, path, number):
+        self.path = path
+        self.number = number
+        # A published generation never changes, so its shards don't have to
+        # be checked for new commits
+        self.shards = ShardedSearcher(
+            path, check_interval=math.inf if number is not None else 2.0
+        )
+        self.threads = ThreadStore(path)
+        self.docstore = DocStore(path)
+        self.refs = 0
+        self.retired = False
+        self._similar = None
+        self._similar_mtime = None
+
+    def similar_messages(self):
+        """Returns the similarity index built by `similar_cmd`, reloading it
+        when it has been rebuilt
+        """
+        try:
+            mtime = os.path.getmtime(os.path.join(self.path, SIMILAR_FILE))
+        except OSError:
+            mtime = None
+        if self._similar is None or mtime != self._similar_mtime:
+            self._similar = SimilarMessages.load(self.path)
+            self._similar_mtime = mtime
+        return self._similar
+
+    def close(self):
+        self.shards.close()
+        self.threads.close()
 
 
 class IndexSearcher:
-    def __init__(self, index_dir):
-        self.index = open_index(index_dir)
 
-    def search(self, query_str, page=1, n=10):
-        with self.index.searcher() as searcher:
-            query = QueryParser("content", self.index.schema).parse(query_str)
+    """Searches the shards of an index
+
+    A query is run on every shard that can hold matches, in a pool of
+    `search_threads` threads, and the best hits of all shards are merged by
+    score. Shards of other mailing list groups and of years outside the date
+    range are skipped. Scores are computed from each shard's own term
+    statistics, so they are close to, but not exactly, those of a single
+    index.
+
+    Each request pins the current generation of the index (see `pin`). At
+    most every `check_interval` seconds, the searcher checks whether another
+    generation has been switched to, and opens it for the requests that
+    follow.
+    """
+
+    def __init__(self, index_dir, search_threads=4, check_interval=2.0):
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.query_cache = QueryCache()
+        self.search_threads = search_threads
+        self.check_interval = check_interval
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._switch_lock = threading.Lock()
+        self._current = self._open_current()
+        self._last_check = time.monotonic()
+
+    def _open_current(self):
+        number = current_generation(self.index_dir)
+        if number is None:
+            return _Generation(self.index_dir, None)
+        return _Generation(generation_path(self.index_dir, number), number)
+
+    @contextmanager
+    def pin(self):
+        """Pins the current generation of the index for the duration of the
+        block
+
+        A request reads a single generation from start to end, even if
+        another one is switched to meanwhile. A generation is closed once it
+        has been replaced and the last request reading it has finished.
+
+        Yields
+        ------
+        _Generation
+        """
+        self._maybe_switch()
+        with self._lock:
+            generation = self._current
+            generation.refs += 1
+        try:
+            yield generation
+        finally:
+            with self._lock:
+                generation.refs -= 1
+                if generation.retired and generation.refs == 0:
+                    generation.close()
+
+    def _maybe_switch(self):
+        if time.monotonic() - self._last_check < self.check_interval:
+            return
+        # Only one thread opens a new generation; the others carry on with
+        # the current one
+        if not self._switch_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_check = time.monotonic()
+            if current_generation(self.index_dir) != self._current.number:
+                self._replace(self._open_current())
+        finally:
+            self._switch_lock.release()
+
+    def _replace(self, fresh):
+        with self._lock:
+            old, self._current = self._current, fresh
+            old.retired = True
+            if old.refs == 0:
+                old.close()
 
-            results = searcher.search_page(query, page, pagelen=n)
-            for result in results:
-                yield index_result_to_message(result)
+    def warm(self):
+        """Loads what requests read into memory ahead of time: the filter
+        bitsets of every mailing list in every shard, the similar messages
+        and the document store's offset tables
 
-    def search_for_thread(self, query_str):
-        with self.index.searcher() as searcher:
-            query = QueryParser("thread_parent", self.index.schema).parse(query_str)
+        Called by the server before it forks its workers, so they start warm
+        and share these pages copy-on-write.
+        """
+        with self.pin() as generation, generation.shards.lease() as lease:
+            for shard in lease.leases.values():
+                for list_id in shard.searcher.lexicon("list_id"):
+                    shard.filters.list_bits(list_id.decode("utf-8"))
+            generation.similar_messages()
+            generation.docstore.open_all()
+        # Loads Markdown's extensions
+        render_as_html("")
 
-            results = searcher.search(query, limit=None)
-            for result in results:
-                yield index_result_to_message(result)
+    def after_fork(self):
+        """Reopens the index in a forked worker process"""
+        self._current.shards.reopen()
+        # The pool's threads don't survive a fork
+        self._pool = None
 
-    def find_similar_messages(self, list_id, message_id):
-        with self.index.searcher() as searcher:
-            result = searcher.document_number(list_id=list_id, message_id=message_id)
-            if not result:
-                return []
+    def generation(self):
+        """Returns the number of the generation being searched (None for an
+        index written before generations)
+        """
+        return self._current.number
 
-            for similar in searcher.more_like(result, 'content', top=25):
-                yield index_result_to_message(similar)
\ No newline at end of file
+    def up_to_date(self):
+        """Returns whether the current generation is being searched, and
+        every one of its shards at its latest commit
+        """
+        generation = self._current
+        return (
+            current_generation(self.index_dir) == generation.number
+            and generation.shards.up_to_date()
+        )
+
+    def close(self):
+        with self._lock:
+            self._current.retired = True
+            if self._current.refs == 0:
+                self._current.close()
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False)
+
+    def _map(self, fn, names):
+        """Calls `fn` on each shard of `names`, in the search thread pool"""
+        if len(names) <= 1:
+            return [fn(name) for name in names]
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(
+                self.search_threads, thread_name_prefix="search"
+            )
+            self._pool_pid = os.getpid()
+        return list(self._pool.map(fn, names))
+
+    def search(self, query_str, page=1, n=10, list_id=None, start=None, end=None):
+        """Searches message contents for `query_str`
+
+        Results can be restricted to one mailing list and to messages sent in
+        [start, end). The restrictions are applied as filters inside the
+        index, so every page of results is full.
+
+        Pages are cached per index generation, keyed on the parsed query, so
+        queries that only differ in case or spacing share an entry.
+
+        Each message has a `snippet`: HTML of the fragments of its text that
+        best match the query, with matched words highlighted.
+
+        Returns
+        -------
+        SearchResults
+            The messages on page `page` of the results, `n` per page
+        """
+        page = max(page, 1)
+        query = QueryParser("content", schema).parse(query_str)
+        key = (repr(query), list_id or None, start, end, page, n)
+        with self.pin() as generation, generation.shards.lease() as lease:
+            cached = self.query_cache.get(lease.generation, key)
+            if cached is None:
+                cached = self._search_page(lease, query, page, n, list_id, start, end)
+                self.query_cache.put(lease.generation, key, cached)
+
+            records = stored_records(lease, generation.docstore, cached.docnums)
+            if cached.snippets is None:
+                snippets = Snippets(
+                    matched_terms(lease, query, cached.docnums),
+                    schema["content"].analyzer,
+                )
+                cached.snippets = [
+                    snippets.snippet(record["content"]) if record else None
+                    for record in records
+                ]
+
+        messages = []
+        for record, snippet in zip(records, cached.snippets):
+            if record is not None:
+                message = index_result_to_message(record)
+                message.snippet = snippet
+                messages.append(message)
+        return SearchResults(messages, cached.total, cached.page, n)
+
+    def stream_search(self, query_str, after=None, limit=100, list_id=None,
+                      start=None, end=None, snippets=False):
+        """Returns the `limit` results of `query_str` that come after the
+        result `after`, for streaming
+
+        Results are ordered by score, then by store id. Takes the same
+        filters as `search`, but isn't cached. The cost of a page doesn't
+        depend on how deep it is, but positions are only meaningful within
+        the generation of the index they were read from.
+
+        Parameters
+        ----------
+        after : (float, int), optional
+            The (score, store id) of the last result of the previous page,
+            as given by the `next_after` of its stream
+
+        Returns
+        -------
+        MessageStream
+            The results, which are read from the document store as they are
+            iterated. Messages have a `snippet` if `snippets` is set.
+        """
+        query = QueryParser("content", schema).parse(query_str)
+        with self.pin() as generation, generation.shards.lease() as lease:
+            hits, total, skipped = self._hits_after(
+                lease, query, after, limit, list_id, start, end
+            )
+            next_after = None
+            if hits and skipped + len(hits) < total:
+                score, store_id, _, _ = hits[-1]
+                next_after = (score, store_id)
+            store_ids = [store_id for _, store_id, _, _ in hits]
+            highlighter = None
+            if snippets:
+                highlighter = Snippets(
+                    matched_terms(
+                        lease, query, [(name, docnum) for _, _, name, docnum in hits]
+                    ),
+                    schema["content"].analyzer,
+                )
+            return MessageStream(
+                generation.docstore,
+                store_ids,
+                total,
+                highlighter,
+                generation=generation.number,
+                next_after=next_after,
+            )
+
+    def _hits_after(self, lease, query, after, limit, list_id, start, end):
+        """Runs `query` on the shards that can hold matches, keeping the
+        best `limit` matches after `after` (see `SeekCollector`)
+
+        Returns
+        -------
+        list of (float, int, str, int)
+            The hits as (score, store id, shard, docnum), in order
+        int
+            The number of documents matching in all shards
+        int
+            The number of those at or before `after`
+        """
+        def search_shard(name):
+            shard = lease.leases[name]
+            if within_range(name, start, end):
+                doc_filter = shard.filters.build(list_id)
+            else:
+                doc_filter = shard.filters.build(list_id, start, end)
+            if doc_filter is not None and not doc_filter.bits:
+                return [], 0, 0
+
+            seek = SeekCollector(limit, after)
+            collector = seek
+            if doc_filter is not None:
+                collector = FilterCollector(seek, allow=doc_filter)
+            shard.searcher.search_with_collector(query, collector)
+            return (
+                [(score, store_id, name, docnum)
+                 for score, store_id, docnum in seek.hits()],
+                seek.total,
+                seek.skipped,
+            )
+
+        found = self._map(search_shard, lease.names(list_id, start, end))
+        hits = [hit for shard_hits, _, _ in found for hit in shard_hits]
+        hits = heapq.nsmallest(limit, hits, key=lambda hit: (-hit[0], hit[1]))
+        return (
+            hits,
+            sum(total for _, total, _ in found),
+            sum(skipped for _, _, skipped in found),
+        )
+
+    def _top_hits(self, lease, query, limit, list_id, start, end):
+        """Runs `query` on the shards that can hold matches
+
+        Returns
+        -------
+        list of (float, str, int)
+            The best `limit` hits of all shards as (score, shard, docnum),
+            best first
+        int
+            The number of documents matching in all shards
+        """
+        def search_shard(name):
+            shard = lease.leases[name]
+            if within_range(name, start, end):
+                doc_filter = shard.filters.build(list_id)
+            else:
+                doc_filter = shard.filters.build(list_id, start, end)
+            if doc_filter is not None and not doc_filter.bits:
+                return [], 0
+
+            results = shard.searcher.search(query, limit=limit, filter=doc_filter)
+            return (
+                [(score, name, docnum) for score, docnum in results.top_n],
+                len(results),
+            )
+
+        found = self._map(search_shard, lease.names(list_id, start, end))
+        hits = [hit for shard_hits, _ in found for hit in shard_hits]
+        # Ties keep the order of the shards and of each shard's hits
+        return heapq.nlargest(limit, hits, key=itemgetter(0)), sum(
+            total for _, total in found
+        )
+
+    def _search_page(self, lease, query, page, n, list_id, start, end):
+        hits, total = self._top_hits(lease, query, page * n, list_id, start, end)
+        # Like `Searcher.search_page`, a page past the end is the last page
+        page = min(page, (total + n - 1) // n)
+        hits = hits[max(page - 1, 0) * n:page * n]
+        return CachedPage(
+            [(name, docnum) for _, name, docnum in hits],
+            total,
+            page,
+        )
+
+    def get_message(self, list_id, message_id):
+        """Returns a single message, or None if it isn't in the index"""
+        with self.pin() as generation, generation.shards.lease() as lease:
+            messages = stored_messages(
+                lease, generation.docstore, [message_key(list_id, message_id)]
+            )
+        return messages[0] if messages else None
+
+    def search_for_thread(self, list_id, thread_parent, page=1, n=100):
+        """Returns a page of the messages in a thread, in thread order"""
+        with self.pin() as generation, generation.shards.lease() as lease:
+            message_ids = generation.threads.thread(
+                list_id, thread_parent, offset=(page - 1) * n, limit=n
+            )
+            keys = [message_key(list_id, message_id) for message_id in message_ids]
+            return stored_messages(lease, generation.docstore, keys)
+
+    def stream_thread(self, list_id, thread_parent, after=None, limit=None):
+        """Returns the `limit` messages of a thread that come after thread
+        position `after`, in thread order, for streaming (see `MessageStream`)
+        """
+        with self.pin() as generation, generation.shards.lease() as lease:
+            rows = generation.threads.thread_after(
+                list_id, thread_parent, after=after, limit=limit
+            )
+            keys = [message_key(list_id, message_id) for _, message_id in rows]
+            store_ids = store_ids_of(lease, lease.documents(keys))
+            total = generation.threads.thread_size(list_id, thread_parent)
+            next_after = None
+            if limit is not None and len(rows) == limit:
+                next_after = rows[-1][0]
+        return MessageStream(
+            generation.docstore,
+            store_ids,
+            total,
+            generation=generation.number,
+            next_after=next_after,
+        )
+
+    def thread_size(self, list_id, thread_parent):
+        with self.pin() as generation:
+            return generation.threads.thread_size(list_id, thread_parent)
+
+    def find_similar_messages(self, list_id, message_id, top=25):
+        """Returns the messages most similar to a message, best first
+
+        Similar messages are precomputed by `similar_cmd`, so this is a
+        lookup. Returns an empty list until it has been run.
+        """
+        with self.pin() as generation, generation.shards.lease() as lease:
+            keys = generation.similar_messages().similar(
+                message_key(list_id, message_id), top
+            )
+            return stored_messages(lease, generation.docstore, keys)
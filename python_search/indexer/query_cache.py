@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from .. import metrics
+
+LOOKUPS = metrics.counter(
+    "query_cache_lookups_total", "Search page cache lookups", ["result"]
+)
+INVALIDATIONS = metrics.counter(
+    "query_cache_invalidations_total",
+    "Times the search page cache was emptied by a new index generation",
+)
+SIZE = metrics.gauge("query_cache_size", "Search pages in the cache")
+
+
+class CachedPage:
+
+    """The scored documents of one page of search results
+
+    Attributes
+    ----------
+    docnums : list of (str, int)
+        The shard and document number of each of the page's documents, best
+        first
+    total : int
+        The number of documents matching the query
+    page : int
+        The page number, which is the last page if a later one was asked for
+    snippets : list of str
+        The highlighted snippet of each document, once they have been built
+    """
+
+    def __init__(self, docnums, total, page):
+        self.docnums = docnums
+        self.total = total
+        self.page = page
+        self.snippets = None
+
+
+class QueryCache:
+
+    """An LRU cache of search result pages, shared between requests
+
+    Entries hold document numbers, which are only meaningful for one
+    generation of the index. The cache is tied to the generation it was
+    filled from, and empties itself the first time it sees a newer one.
+
+    Attributes
+    ----------
+    maxsize : int
+        The maximum number of cached pages
+    hits : int
+        The number of lookups that were answered from the cache
+    misses : int
+        The number of lookups that had to run the query
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._generation = None
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, generation, key):
+        """Returns the cached page for `key` in `generation`, or None"""
+        with self._lock:
+            self._check_generation(generation)
+            page = self._pages.get(key) if generation == self._generation else None
+            if page is None:
+                self.misses += 1
+                LOOKUPS.inc(result="miss")
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            LOOKUPS.inc(result="hit")
+            return page
+
+    def put(self, generation, key, page):
+        with self._lock:
+            self._check_generation(generation)
+            # Requests still running on an older searcher can't add to it
+            if generation != self._generation:
+                return
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.maxsize:
+                self._pages.popitem(last=False)
+            SIZE.set(len(self._pages))
+
+    def _check_generation(self, generation):
+        if self._generation is None or generation > self._generation:
+            if self._pages:
+                self.invalidations += 1
+                INVALIDATIONS.inc()
+            self._pages.clear()
+            SIZE.set(0)
+            self._generation = generation
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._pages),
+                "maxsize": self.maxsize,
+                "generation": self._generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate(),
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,372 @@
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from whoosh import index
+from .shared import SharedSearcher
+
+# The index is split into shards by mailing list group and year, under
+# `<index_dir>/shards/g<group>-<year>`. Each shard is a Whoosh index of its
+# own. The document store, thread store, similar messages and watermark
+# stay at the top of the index directory, shared by every shard.
+SHARDS_DIR = "shards"
+LAYOUT_FILE = "shards.json"
+NUM_GROUPS = 8
+# The year of the shard of messages without a date
+NO_YEAR = 0
+SHARD_RE = re.compile(r"^g(\d+)-(\d+)$")
+
+
+def list_group(list_id, groups=NUM_GROUPS):
+    """Returns the group of a mailing list (a stable hash of its id)"""
+    return zlib.crc32(list_id.encode("utf-8")) % groups
+
+
+def shard_name(group, year):
+    return "g{:02d}-{:04d}".format(group, year)
+
+
+def shard_for(list_id, sent_at):
+    """Returns the name of the shard a message belongs in"""
+    year = sent_at.year if sent_at is not None else NO_YEAR
+    return shard_name(list_group(list_id), year)
+
+
+def parse_shard_name(name):
+    """Returns the (group, year) of a shard, or None if `name` isn't one"""
+    match = SHARD_RE.match(name)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_path(index_dir, name):
+    return os.path.join(index_dir, SHARDS_DIR, name)
+
+
+def shard_names(index_dir):
+    """Returns the names of the shards that have been written"""
+    root = os.path.join(index_dir, SHARDS_DIR)
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if parse_shard_name(name) is not None
+        and index.exists_in(os.path.join(root, name))
+    )
+
+
+def year_span(year):
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+
+def may_match(name, list_id=None, start=None, end=None):
+    """Returns whether the shard `name` can hold messages of `list_id` sent
+    in [start, end)
+
+    Messages without a date are never in a date range.
+    """
+    group, year = parse_shard_name(name)
+    if list_id and group != list_group(list_id):
+        return False
+    if start is None and end is None:
+        return True
+    if year == NO_YEAR:
+        return False
+    first, last = year_span(year)
+    return (start is None or start < last) and (end is None or end > first)
+
+
+def within_range(name, start=None, end=None):
+    """Returns whether every message of the shard `name` was sent in
+    [start, end), so the date range doesn't need to be applied to it
+    """
+    _, year = parse_shard_name(name)
+    if year == NO_YEAR:
+        return start is None and end is None
+    first, last = year_span(year)
+    return (start is None or start <= first) and (end is None or end >= last)
+
+
+def layout_is_current(index_dir, schema):
+    """Returns whether the shards were written with the current grouping
+    and schema (otherwise the index has to be rebuilt)
+    """
+    path = os.path.join(index_dir, LAYOUT_FILE)
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        layout = json.load(f)
+    return layout.get("groups") == NUM_GROUPS and layout.get("fields") == schema.names()
+
+
+def write_layout(index_dir, schema):
+    path = os.path.join(index_dir, LAYOUT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"groups": NUM_GROUPS, "fields": schema.names()}, f)
+    os.replace(path + ".tmp", path)
+
+
+class ShardWriters:
+
+    """The index writers of the shards a build writes to
+
+    Writers are opened when a shard is first written to. At most `max_open`
+    are kept open; the least recently used one is committed to make room.
+
+    If `merge` is False, commits never merge segments (Whoosh's default is
+    to merge the small ones), which keeps commits fast during a bulk load.
+    """
+
+    def __init__(self, index_dir, schema, open_writer, max_open=16,
+                 before_commit=None, merge=True):
+        self.index_dir = index_dir
+        self.schema = schema
+        self.open_writer = open_writer
+        self.max_open = max_open
+        self.merge = merge
+        # Called before a writer is committed to make room, so whatever the
+        # index refers to (the document store) can be committed first
+        self.before_commit = before_commit
+        self.touched = set()
+        self._writers = OrderedDict()
+        os.makedirs(os.path.join(index_dir, SHARDS_DIR), exist_ok=True)
+
+    def _open_index(self, name):
+        path = shard_path(self.index_dir, name)
+        if not os.path.exists(path):
+            os.mkdir(path)
+        if not index.exists_in(path):
+            return index.create_in(path, self.schema)
+        return index.open_dir(path)
+
+    def writer(self, name):
+        """Returns the writer of the shard `name`"""
+        writer = self._writers.get(name)
+        if writer is not None:
+            self._writers.move_to_end(name)
+            return writer
+
+        if len(self._writers) >= self.max_open:
+            oldest = next(iter(self._writers))
+            if self.before_commit is not None:
+                self.before_commit()
+            self._writers.pop(oldest).commit(merge=self.merge)
+        writer = self._writers[name] = self.open_writer(self._open_index(name))
+        self.touched.add(name)
+        return writer
+
+    def commit(self):
+        """Commits every open writer"""
+        while self._writers:
+            _, writer = self._writers.popitem(last=False)
+            writer.commit(merge=self.merge)
+
+    def finish(self):
+        """Commits every open writer, and records the shard layout"""
+        self.commit()
+        write_layout(self.index_dir, self.schema)
+
+    def optimize(self):
+        """Merges each shard that was written to into a single segment"""
+        for name in sorted(self.touched):
+            index.open_dir(shard_path(self.index_dir, name)).optimize()
+
+
+def shard_stats(path):
+    """Returns the number of segments of the shard in `path`, and the size
+    of its files in bytes
+    """
+    shard = index.open_dir(path)
+    size = sum(
+        os.path.getsize(os.path.join(path, filename))
+        for filename in os.listdir(path)
+        if not filename.endswith("LOCK")
+    )
+    return len(shard._segments()), size
+
+
+def needs_optimize(path):
+    """Returns whether merging the shard in `path` would change it: it has
+    several segments, or deleted documents to purge
+    """
+    shard = index.open_dir(path)
+    with shard.reader() as reader:
+        return len(shard._segments()) > 1 or reader.has_deletions()
+
+
+def find_document(searcher, key):
+    """Returns the document number of the doc key `key` in a shard, or None
+
+    Reads the key's postings directly, which is much cheaper than
+    `Searcher.document_number` when many keys are looked up across shards.
+    """
+    reader = searcher.reader()
+    if ("doc_key", key) not in reader:
+        return None
+    for docnum in reader.postings("doc_key", key).all_ids():
+        # Replaced documents stay in their segment until it is merged
+        if not reader.is_deleted(docnum):
+            return docnum
+    return None
+
+
+class ShardLease:
+
+    """The searchers of every shard, leased for the duration of a request
+
+    Attributes
+    ----------
+    leases : OrderedDict
+        The lease of each shard (see `SharedSearcher.lease`), by name
+    generation : int
+        A number that changes whenever the searcher of any shard does, for
+        keying caches of document numbers
+    """
+
+    def __init__(self, leases, generation):
+        self.leases = leases
+        self.generation = generation
+        self._groups = defaultdict(list)
+        for name in leases:
+            group, _ = parse_shard_name(name)
+            self._groups[group].append(name)
+
+    def searcher(self, name):
+        return self.leases[name].searcher
+
+    def names(self, list_id=None, start=None, end=None):
+        """Returns the shards that can hold messages of `list_id` sent in
+        [start, end)
+        """
+        names = self._groups[list_group(list_id)] if list_id else list(self.leases)
+        if start is None and end is None:
+            return list(names)
+        return [name for name in names if may_match(name, list_id, start, end)]
+
+    def documents(self, keys):
+        """Returns the (shard, docnum) of each of the doc `keys` that is in
+        the index, in the order of `keys`
+
+        A key is looked up in the shards of its mailing list's group,
+        starting with the shard the previous key was found in: messages that
+        are read together, like those of a thread, were usually sent close
+        together.
+        """
+        hits = []
+        last = None
+        for key in keys:
+            # Keys are "<list_id>/<message_id>" (see `indexer.message_key`)
+            names = self.names(key.split("/", 1)[0])
+            if last in names:
+                names.remove(last)
+                names.insert(0, last)
+            for name in names:
+                docnum = find_document(self.searcher(name), key)
+                if docnum is not None:
+                    hits.append((name, docnum))
+                    last = name
+                    break
+        return hits
+
+
+# Lease generations are numbered across every ShardedSearcher of a process,
+# so caches keyed on them stay consistent when the frontend switches to
+# another generation of the index
+_lease_generations = itertools.count(1)
+
+
+class ShardedSearcher:
+
+    """Shares the searchers of every shard of an index between requests
+
+    Each shard has its own `SharedSearcher`, which swaps in a new searcher
+    when the indexer commits to the shard. Shards that the indexer creates
+    are picked up at most every `check_interval` seconds.
+    """
+
+    def __init__(self, index_dir, check_interval=2.0):
+        self.index_dir = index_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._shards = OrderedDict()
+        self._leased = None
+        self._generation = None
+        self._add_new_shards()
+        self._last_check = time.monotonic()
+
+    def names(self):
+        return list(self._shards)
+
+    @contextmanager
+    def lease(self):
+        """Leases the current searcher of every shard for the duration of
+        the block
+
+        Yields
+        ------
+        ShardLease
+        """
+        self._maybe_add_shards()
+        with ExitStack() as stack:
+            leases = OrderedDict(
+                (name, stack.enter_context(shared.lease()))
+                for name, shared in self._shards.items()
+            )
+            with self._lock:
+                current = tuple(leases.values())
+                if current != self._leased:
+                    self._generation = next(_lease_generations)
+                    self._leased = current
+                generation = self._generation
+            yield ShardLease(leases, generation)
+
+    def up_to_date(self):
+        """Returns whether every shard is searched at its latest generation"""
+        if shard_names(self.index_dir) != list(self._shards):
+            return False
+        return all(shared.up_to_date() for shared in self._shards.values())
+
+    def reopen(self):
+        """Replaces the searcher of every shard with a newly opened one (see
+        `SharedSearcher.reopen`)
+        """
+        with self._reload_lock:
+            for shared in self._shards.values():
+                shared.reopen()
+            self._add_new_shards()
+
+    def close(self):
+        for shared in self._shards.values():
+            shared.close()
+
+    def _maybe_add_shards(self):
+        if time.monotonic() - self._last_check < self.check_interval:
+            return
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._add_new_shards()
+        finally:
+            self._reload_lock.release()
+
+    def _add_new_shards(self):
+        self._last_check = time.monotonic()
+        names = shard_names(self.index_dir)
+        if names == list(self._shards):
+            return
+        shards = OrderedDict()
+        for name in names:
+            shards[name] = self._shards.get(name) or SharedSearcher(
+                index.open_dir(shard_path(self.index_dir, name)),
+                self.check_interval,
+            )
+        # Swapped in whole, so requests can iterate it without the lock
+        self._shards = shards
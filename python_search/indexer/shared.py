@@ -0,0 +1,140 @@
+import threading
+import time
+from contextlib import contextmanager
+from .filters import FilterCache
+
+
+class _Lease:
+    def __init__(self, searcher, toc_generation):
+        self.searcher = searcher
+        self.filters = FilterCache(searcher)
+        # An empty index has no generation yet
+        generation = searcher.reader().generation()
+        self.generation = generation if generation is not None else -1
+        # The generation of the index's table of contents when the searcher
+        # was opened. Unlike the reader's, it is known for an empty index, so
+        # an emptied index isn't reopened on every check.
+        self.toc_generation = toc_generation
+        self.refs = 0
+        self.retired = False
+
+
+class SharedSearcher:
+
+    """A process-wide Whoosh searcher that is shared between requests
+
+    At most every `check_interval` seconds, the index is checked for a new
+    generation (written when `manage.py index` commits). If there is one, a
+    fresh searcher is opened and swapped in. Requests that are still using
+    the old searcher keep it until they finish; it is closed once the last
+    of them releases it.
+
+    `Searcher.refresh` isn't used because it closes the old searcher's
+    segment readers while other threads may still be reading from them.
+    """
+
+    def __init__(self, index, check_interval=2.0):
+        self.index = index
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._current = self._open()
+        self._last_check = time.monotonic()
+
+    @contextmanager
+    def searcher(self):
+        """Leases the current searcher for the duration of the block"""
+        with self.lease() as lease:
+            yield lease.searcher
+
+    @contextmanager
+    def lease(self):
+        """Leases the current searcher, along with its filter cache, for the
+        duration of the block
+        """
+        self._maybe_reload()
+        with self._lock:
+            lease = self._current
+            lease.refs += 1
+        try:
+            yield lease
+        finally:
+            self._release(lease)
+
+    def generation(self):
+        with self._lock:
+            return self._current.generation
+
+    def up_to_date(self):
+        """Returns whether the current searcher is over the latest generation"""
+        with self._lock:
+            lease = self._current
+        return self.index.latest_generation() == lease.toc_generation
+
+    def reload(self):
+        """Swaps in a searcher for the latest index generation, if the
+        current one is out of date
+
+        Returns True if a new searcher was swapped in.
+        """
+        with self._reload_lock:
+            return self._swap_if_stale()
+
+    def reopen(self):
+        """Replaces the searcher with a newly opened one
+
+        Used in worker processes forked from a warmed-up parent, so they
+        don't share its open files. The filter bitsets are kept if the
+        generation hasn't changed.
+        """
+        with self._reload_lock:
+            fresh = self._open()
+            with self._lock:
+                old, self._current = self._current, fresh
+                if old.generation == fresh.generation:
+                    fresh.filters.adopt(old.filters)
+                old.retired = True
+                if old.refs == 0:
+                    old.searcher.close()
+            self._last_check = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._current.retired = True
+            if self._current.refs == 0:
+                self._current.searcher.close()
+
+    def _maybe_reload(self):
+        if time.monotonic() - self._last_check < self.check_interval:
+            return
+        # Only one thread checks for a new generation; the others carry on
+        # with the current searcher
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._swap_if_stale()
+        finally:
+            self._reload_lock.release()
+
+    def _open(self):
+        toc_generation = self.index.latest_generation()
+        return _Lease(self.index.searcher(), toc_generation)
+
+    def _swap_if_stale(self):
+        self._last_check = time.monotonic()
+        if self.up_to_date():
+            return False
+
+        fresh = self._open()
+        with self._lock:
+            old, self._current = self._current, fresh
+            old.retired = True
+            if old.refs == 0:
+                old.searcher.close()
+        return True
+
+    def _release(self, lease):
+        with self._lock:
+            lease.refs -= 1
+            if lease.retired and lease.refs == 0:
+                lease.searcher.close()
@@ -0,0 +1,350 @@
+import os.path
+import re
+import zlib
+import numpy as np
+from tqdm import tqdm
+from whoosh.analysis import STOP_WORDS
+
+SIMILAR_FILE = "similar.npz"
+
+# MinHash signatures of NUM_PERM hashes, split into BANDS bands for LSH.
+# Two messages become candidates when every hash in one band matches, which
+# happens with probability ~ 1 - (1 - J^2)^32 for word-set Jaccard
+# similarity J (about 0.5 at J = 0.15).
+NUM_PERM = 64
+BANDS = 32
+SEED = 410
+TOP_K = 25
+# Buckets shared by more messages than this say little about any of them
+MAX_BUCKET = 50
+# Tokens hashed per batch: the batch's hash matrix is NUM_PERM times this
+BATCH_TOKENS = 100000
+
+# Universal hashing of 32 bit token hashes modulo a prime just above 2^32.
+# a * x + b stays below 2^64, so it can't overflow uint64.
+PRIME = np.uint64((1 << 32) + 15)
+EMPTY = np.uint32(0xFFFFFFFF)
+TOKEN_RE = re.compile(r"[a-z][a-z0-9_]{2,}")
+
+
+def tokens(content):
+    """Hashes the distinct words of a message into a uint64 array"""
+    words = set(TOKEN_RE.findall(content.lower())) - STOP_WORDS
+    return np.fromiter(
+        (zlib.crc32(word.encode("utf-8")) for word in words),
+        dtype=np.uint64,
+        count=len(words),
+    )
+
+
+def hash_functions(num_perm=NUM_PERM, seed=SEED):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+    b = rng.randint(0, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+    return a, b
+
+
+def minhash(token_arrays, a, b):
+    """Computes the MinHash signatures of a batch of token arrays
+
+    Returns
+    -------
+    np.ndarray
+        A (len(token_arrays), NUM_PERM) uint32 array. Messages without any
+        tokens get a signature of all EMPTY.
+    """
+    signatures = np.full((len(token_arrays), len(a)), EMPTY, dtype=np.uint32)
+    lengths = np.array([len(t) for t in token_arrays], dtype=np.int64)
+    nonempty = lengths > 0
+    if not nonempty.any():
+        return signatures
+
+    hashes = (a * np.concatenate(token_arrays)[None, :] + b) % PRIME
+    np.minimum(hashes, EMPTY - 1, out=hashes)
+    starts = (np.cumsum(lengths) - lengths)[nonempty]
+    signatures[nonempty] = np.minimum.reduceat(hashes, starts, axis=1).T
+    return signatures
+
+
+def band_keys(signatures, band, bands=BANDS):
+    rows = signatures.shape[1] // bands
+    keys = np.zeros(len(signatures), dtype=np.uint64)
+    for column in signatures[:, band * rows:(band + 1) * rows].T:
+        keys = keys * np.uint64(1000003) ^ column.astype(np.uint64)
+    return keys
+
+
+def candidate_pairs(signatures, is_new, bands=BANDS, max_bucket=MAX_BUCKET):
+    """Finds pairs of messages that share an LSH bucket in some band
+
+    Only pairs involving at least one new message are returned, both ways
+    round, so that each message's neighbours can be read off its own rows.
+    """
+    n = len(signatures)
+    members = np.flatnonzero(~np.all(signatures == EMPTY, axis=1))
+    codes = np.zeros(0, dtype=np.int64)
+    for band in range(bands):
+        keys = band_keys(signatures[members], band, bands)
+        order = np.argsort(keys, kind="stable")
+        keys, band_members = keys[order], members[order]
+
+        # Drop singletons and oversized buckets
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(keys)])
+        size = np.repeat(sizes, sizes)
+        keep = (size > 1) & (size <= max_bucket)
+        keys, band_members = keys[keep], band_members[keep]
+
+        left, right = [], []
+        for offset in range(1, max_bucket):
+            same = keys[offset:] == keys[:-offset]
+            if not same.any():
+                break
+            left.append(band_members[:-offset][same])
+            right.append(band_members[offset:][same])
+        if not left:
+            continue
+
+        i, j = np.concatenate(left), np.concatenate(right)
+        new = is_new[i] | is_new[j]
+        i, j = i[new], j[new]
+        band_codes = np.concatenate([i * n + j, j * n + i]).astype(np.int64)
+        codes = np.union1d(codes, band_codes)
+
+    return codes // n, codes % n
+
+
+def pair_scores(signatures, i, j, chunk=1 << 20):
+    """The number of matching hashes of each pair of signatures"""
+    scores = np.empty(len(i), dtype=np.uint8)
+    for start in range(0, len(i), chunk):
+        end = start + chunk
+        scores[start:end] = (
+            signatures[i[start:end]] == signatures[j[start:end]]
+        ).sum(axis=1)
+    return scores
+
+
+def top_k(n, i, j, scores, k=TOP_K):
+    """Keeps the `k` best scoring neighbours of each message
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        (n, k) arrays of neighbour indices (-1 if there are fewer than `k`)
+        and their scores, best first
+    """
+    order = np.lexsort((j, -scores.astype(np.int16), i))
+    i, j, scores = i[order], j[order], scores[order]
+    rank = np.arange(len(i)) - np.searchsorted(i, i)
+    keep = rank < k
+
+    neighbours = np.full((n, k), -1, dtype=np.int32)
+    neighbour_scores = np.zeros((n, k), dtype=np.uint8)
+    neighbours[i[keep], rank[keep]] = j[keep]
+    neighbour_scores[i[keep], rank[keep]] = scores[keep]
+    return neighbours, neighbour_scores
+
+
+class SimilarMessages:
+
+    """The precomputed most similar messages of every message in the index
+
+    Messages are compared by MinHash estimates of the Jaccard similarity of
+    their word sets, and candidate pairs come from locality-sensitive
+    hashing, so the build never compares every pair of messages.
+
+    Everything is stored in `similar.npz` in the index directory, sorted by
+    doc key: the keys, each message's signature and the store id of the
+    record it was computed from (kept so later builds only hash new and
+    re-indexed messages) and its top neighbours with their scores. The
+    frontend only reads the keys and neighbours.
+    """
+
+    def __init__(self, index_dir, keys=None, signatures=None, neighbours=None,
+                 scores=None, store_ids=None):
+        self.path = os.path.join(index_dir, SIMILAR_FILE)
+        self.keys = keys if keys is not None else np.zeros(0, dtype="S1")
+        self._signatures = signatures
+        self._store_ids = store_ids
+        self.neighbours = (
+            neighbours if neighbours is not None
+            else np.zeros((0, TOP_K), dtype=np.int32)
+        )
+        self.scores = (
+            scores if scores is not None else np.zeros((0, TOP_K), dtype=np.uint8)
+        )
+        self._data = None
+
+    @classmethod
+    def load(cls, index_dir):
+        path = os.path.join(index_dir, SIMILAR_FILE)
+        if not os.path.exists(path):
+            return cls(index_dir)
+
+        data = np.load(path)
+        params = tuple(data["params"])
+        if params != (NUM_PERM, BANDS, SEED, TOP_K) or "store_ids" not in data.files:
+            # Signatures built with other settings can't be extended, and
+            # without their store ids, re-indexed messages can't be found
+            return cls(index_dir)
+
+        similar = cls(index_dir, data["keys"], None, data["neighbours"],
+                      data["scores"])
+        # Signatures are only read if the index is extended
+        similar._data = data
+        return similar
+
+    @property
+    def signatures(self):
+        if self._signatures is None:
+            if self._data is not None:
+                self._signatures = self._data["signatures"]
+            else:
+                self._signatures = np.zeros((0, NUM_PERM), dtype=np.uint32)
+        return self._signatures
+
+    @property
+    def store_ids(self):
+        if self._store_ids is None:
+            if self._data is not None:
+                self._store_ids = self._data["store_ids"]
+            else:
+                self._store_ids = np.zeros(0, dtype=np.uint64)
+        return self._store_ids
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def _position(self, key):
+        key = key.encode("utf-8")
+        idx = np.searchsorted(self.keys, key)
+        if idx < len(self.keys) and self.keys[idx] == key:
+            return idx
+        return None
+
+    def store_id(self, key):
+        """Returns the store id of the record that the signature of `key` was
+        computed from, or None if `key` hasn't been hashed
+        """
+        idx = self._position(key)
+        if idx is None:
+            return None
+        return int(self.store_ids[idx])
+
+    def similar(self, key, top=TOP_K):
+        """Returns the doc keys of the messages most similar to `key`, best
+        first"""
+        idx = self._position(key)
+        if idx is None:
+            return []
+        neighbours = self.neighbours[idx][:top]
+        return [
+            self.keys[neighbour].decode("utf-8")
+            for neighbour in neighbours if neighbour >= 0
+        ]
+
+    def add(self, documents, count=None):
+        """Adds new messages and updates the neighbours of existing ones
+
+        Messages that are already in the index are replaced (see `remove`).
+
+        Parameters
+        ----------
+        documents : iterable of (str, int, str)
+            The doc key, store id and content of each new message
+        count : int, optional
+            The number of documents, for the progress bar
+        """
+        a, b = hash_functions()
+        new_keys, new_store_ids, new_signatures = [], [], []
+        batch, batch_tokens = [], 0
+        for key, store_id, content in tqdm(documents, total=count):
+            new_keys.append(key.encode("utf-8"))
+            new_store_ids.append(store_id)
+            batch.append(tokens(content or ""))
+            batch_tokens += len(batch[-1])
+            if batch_tokens >= BATCH_TOKENS:
+                new_signatures.append(minhash(batch, a, b))
+                batch, batch_tokens = [], 0
+        if batch:
+            new_signatures.append(minhash(batch, a, b))
+        if not new_keys:
+            return
+
+        self.remove(key.decode("utf-8") for key in new_keys)
+        old_count = len(self.keys)
+        keys = np.concatenate([self.keys, np.array(new_keys)])
+        signatures = np.concatenate([self.signatures] + new_signatures)
+        store_ids = np.concatenate(
+            [self.store_ids, np.array(new_store_ids, dtype=np.uint64)]
+        )
+        is_new = np.arange(len(keys)) >= old_count
+
+        i, j = candidate_pairs(signatures, is_new)
+        scores = pair_scores(signatures, i, j)
+
+        # New pairs always involve a new message, so they never repeat an
+        # existing neighbour
+        existing = self.neighbours >= 0
+        rows = np.repeat(np.arange(old_count), TOP_K).reshape(old_count, TOP_K)
+        i = np.concatenate([rows[existing], i])
+        j = np.concatenate([self.neighbours[existing], j])
+        scores = np.concatenate([self.scores[existing], scores])
+        neighbours, scores = top_k(len(keys), i, j, scores)
+
+        # Keep everything sorted by key, for lookups
+        order = np.argsort(keys, kind="stable")
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order))
+        neighbours = neighbours[order]
+        neighbours = np.where(neighbours >= 0, position[neighbours], -1)
+
+        self.keys = keys[order]
+        self._signatures = signatures[order]
+        self._store_ids = store_ids[order]
+        self.neighbours = neighbours.astype(np.int32)
+        self.scores = scores[order]
+
+    def remove(self, keys):
+        """Removes messages, and drops them from the neighbours of the others
+
+        A message keeps the rest of its neighbours in order, and its freed
+        places are filled by the next `add` if it finds better ones.
+        """
+        positions = [self._position(key) for key in keys]
+        positions = [idx for idx in positions if idx is not None]
+        if not positions:
+            return
+
+        keep = np.ones(len(self.keys), dtype=bool)
+        keep[positions] = False
+        position = np.cumsum(keep) - 1
+        neighbours = self.neighbours[keep]
+        scores = self.scores[keep]
+        valid = neighbours >= 0
+        targets = np.where(valid, neighbours, 0)
+        valid &= keep[targets]
+
+        self.keys = self.keys[keep]
+        self._signatures = self.signatures[keep]
+        self._store_ids = self.store_ids[keep]
+        self.neighbours = np.where(valid, position[targets], -1).astype(np.int32)
+        self.scores = np.where(valid, scores, 0).astype(scores.dtype)
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                keys=self.keys,
+                signatures=self.signatures,
+                store_ids=self.store_ids,
+                neighbours=self.neighbours,
+                scores=self.scores,
+                params=np.array([NUM_PERM, BANDS, SEED, TOP_K]),
+            )
+        os.replace(tmp_path, self.path)
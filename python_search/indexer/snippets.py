@@ -0,0 +1,65 @@
+from html import escape
+from whoosh import highlight
+
+SNIPPET_CHARS = 300
+
+
+def query_terms(query, reader, fieldname="content"):
+    """Returns the words of `fieldname` that `query` matches in the index
+
+    Wildcards and other multi-term queries are expanded against `reader`, so
+    "asyn*" highlights "asyncio".
+    """
+    terms = set()
+    for field, text in query.existing_terms(reader, expand=True):
+        if field == fieldname:
+            terms.add(text.decode("utf-8") if isinstance(text, bytes) else text)
+    return terms
+
+
+class Snippets:
+
+    """Builds highlighted HTML snippets of the parts of messages that match
+    a query
+
+    The message text is re-analyzed with the field's analyzer, and the best
+    scoring fragments around matched words are kept. Only the first
+    `charlimit` characters of a message are searched for fragments, so
+    digests cost no more than ordinary messages.
+    """
+
+    def __init__(self, terms, analyzer, top=3, surround=60, charlimit=32768):
+        self.terms = terms
+        self.analyzer = analyzer
+        self.top = top
+        self.fragmenter = highlight.ContextFragmenter(
+            maxchars=SNIPPET_CHARS, surround=surround, charlimit=charlimit
+        )
+        self.formatter = highlight.HtmlFormatter(tagname="mark")
+
+    def snippet(self, text):
+        """Returns an HTML snippet of `text`
+
+        Falls back to the start of the message if none of the query's words
+        appear in it.
+        """
+        text = text or ""
+        if self.terms:
+            fragments = highlight.highlight(
+                text,
+                self.terms,
+                self.analyzer,
+                self.fragmenter,
+                self.formatter,
+                top=self.top,
+            )
+            if fragments:
+                return fragments
+        return escape(leading_text(text))
+
+
+def leading_text(text, chars=SNIPPET_CHARS):
+    if len(text) <= chars:
+        return text
+    cut = text.rfind(" ", 0, chars)
+    return text[:cut if cut > 0 else chars] + "..."
@@ -0,0 +1,104 @@
+import sqlite3
+from sqlalchemy.dialects import sqlite
+from ..scraper.model import Message
+
+# The columns the indexer reads, in the shape of `prepare_documents`'s rows
+COLUMNS = [
+    "rowid",
+    "list_id",
+    "message_id",
+    "text",
+    "author",
+    "sent_at",
+    "thread_parent",
+    "thread_idx",
+    "thread_indent",
+    "page",
+    "subject",
+]
+
+_dialect = sqlite.dialect()
+# Parses stored datetimes the same way the ORM does
+_parse_sent_at = Message.__table__.c.sent_at.type.dialect_impl(
+    _dialect
+).result_processor(_dialect, None)
+
+
+def dict_factory(cursor, row):
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+class MessageSource:
+
+    """Streams message rows out of the scraper database for indexing
+
+    Only the indexed columns are selected, straight from `sqlite3`. Each
+    list is read in rowid order a batch at a time, continuing from the last
+    rowid of the previous batch (keyset pagination on the `list_id` index),
+    so every batch is an index range scan and memory use doesn't grow with
+    the size of the database.
+    """
+
+    def __init__(self, db_path, batch_size=1000):
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(
+            "file:{}?mode=ro".format(db_path), uri=True
+        )
+        self.connection.row_factory = dict_factory
+
+    def list_ids(self):
+        rows = self.connection.execute(
+            "SELECT DISTINCT list_id FROM message ORDER BY list_id"
+        )
+        return [row["list_id"] for row in rows]
+
+    def approximate_count(self, watermark=None):
+        """Estimates the number of rows `rows` will yield, for progress bars
+
+        A full read is estimated from the largest rowid, which skips
+        counting the whole table. Past a watermark, only the new rows of
+        each list are counted.
+        """
+        if watermark is None or not watermark.lists:
+            row = self.connection.execute(
+                "SELECT max(rowid) AS count FROM message"
+            ).fetchone()
+            return row["count"] or 0
+
+        return sum(
+            self.connection.execute(
+                "SELECT count(*) AS count FROM message "
+                "WHERE list_id = ? AND rowid > ?",
+                (list_id, watermark.rowid(list_id)),
+            ).fetchone()["count"]
+            for list_id in self.list_ids()
+        )
+
+    def rows(self, watermark=None):
+        """Yields message rows as dicts, list by list in rowid order
+
+        If a watermark is given, only rows newer than the watermark of their
+        list are yielded.
+        """
+        query = (
+            "SELECT {} FROM message WHERE list_id = ? AND rowid > ? "
+            "ORDER BY rowid LIMIT ?".format(", ".join(COLUMNS))
+        )
+        for list_id in self.list_ids():
+            last_rowid = watermark.rowid(list_id) if watermark is not None else 0
+            while True:
+                batch = self.connection.execute(
+                    query, (list_id, last_rowid, self.batch_size)
+                ).fetchall()
+                for row in batch:
+                    row["sent_at"] = _parse_sent_at(row["sent_at"])
+                    yield row
+                if len(batch) < self.batch_size:
+                    break
+                last_rowid = batch[-1]["rowid"]
+
+    def close(self):
+        self.connection.close()
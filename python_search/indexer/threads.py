@@ -0,0 +1,116 @@
+import os.path
+import sqlite3
+import threading
+
+THREADS_FILE = "threads.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    list_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    thread_parent INTEGER,
+    thread_idx INTEGER,
+    PRIMARY KEY (list_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_threads_thread
+    ON threads (list_id, thread_parent, thread_idx);
+"""
+
+
+class ThreadStore:
+
+    """A table of message ids keyed by (list_id, thread_parent), in
+    thread_idx order
+
+    The table lives in a SQLite file inside the index directory. It is
+    written by the indexer alongside the index, and lets the frontend load a
+    thread with one keyed range scan instead of a search.
+    """
+
+    def __init__(self, index_dir):
+        self.path = os.path.join(index_dir, THREADS_FILE)
+        self._local = threading.local()
+        self._pending = []
+
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _connection(self):
+        # SQLite connections can't be shared between threads, or with a
+        # forked process
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, list_id, message_id, thread_parent, thread_idx):
+        """Queues a message to be written on the next `commit`"""
+        self._pending.append((list_id, message_id, thread_parent, thread_idx))
+
+    def clear(self):
+        """Deletes every thread. Takes effect on the next `commit`"""
+        self._pending = []
+        self._connection().execute("DELETE FROM threads")
+
+    def commit(self):
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO threads VALUES (?, ?, ?, ?)", self._pending
+        )
+        conn.commit()
+        self._pending = []
+
+    def close(self):
+        """Closes this thread's connection. Closing the last connection
+        moves the write-ahead log into the database file
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    def thread(self, list_id, thread_parent, offset=0, limit=None):
+        """Returns the message ids of a thread in thread_idx order"""
+        rows = self._connection().execute(
+            "SELECT message_id FROM threads "
+            "WHERE list_id = ? AND thread_parent = ? "
+            "ORDER BY thread_idx LIMIT ? OFFSET ?",
+            (list_id, thread_parent, -1 if limit is None else limit, offset),
+        )
+        return [message_id for message_id, in rows]
+
+    def thread_after(self, list_id, thread_parent, after=None, limit=None):
+        """Returns the messages of a thread that come after `thread_idx`
+        `after`, in thread_idx order
+
+        Positions are unique within a thread, so a page can resume from the
+        last position of the previous one with a range scan of the index.
+
+        Returns
+        -------
+        list of (int, str)
+            The thread_idx and message id of each message
+        """
+        rows = self._connection().execute(
+            "SELECT thread_idx, message_id FROM threads "
+            "WHERE list_id = ? AND thread_parent = ? AND thread_idx > ? "
+            "ORDER BY thread_idx LIMIT ?",
+            (
+                list_id,
+                thread_parent,
+                -1 if after is None else after,
+                -1 if limit is None else limit,
+            ),
+        )
+        return rows.fetchall()
+
+    def thread_size(self, list_id, thread_parent):
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM threads "
+            "WHERE list_id = ? AND thread_parent = ?",
+            (list_id, thread_parent),
+        ).fetchone()
+        return row[0]
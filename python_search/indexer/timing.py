@@ -0,0 +1,58 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class StageTimer:
+
+    """Accumulates the time spent and documents handled by each stage of the
+    indexing pipeline, so throughput can be reported per stage
+
+    Each timing is also observed by `histogram` (a `metrics.Histogram` with a
+    "stage" label), if given.
+    """
+
+    def __init__(self, histogram=None):
+        self.seconds = OrderedDict()
+        self.docs = OrderedDict()
+        self.histogram = histogram
+
+    def add(self, stage, seconds, docs=1):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.docs[stage] = self.docs.get(stage, 0) + docs
+        if self.histogram is not None:
+            self.histogram.observe(seconds, stage=stage)
+
+    @contextmanager
+    def time(self, stage, docs=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, docs)
+
+    def timed_iter(self, stage, iterable):
+        """Wraps `iterable`, charging the time taken to produce each item to
+        `stage`
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def report(self):
+        lines = []
+        for stage, seconds in self.seconds.items():
+            docs = self.docs[stage]
+            rate = docs / seconds if seconds else float("inf")
+            lines.append(
+                "{:>10}: {:>9} docs in {:>8.1f}s ({:>10.1f} docs/sec)".format(
+                    stage, docs, seconds, rate
+                )
+            )
+        return "\n".join(lines)
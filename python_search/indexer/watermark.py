@@ -0,0 +1,66 @@
+import json
+import os.path
+from datetime import datetime
+
+WATERMARK_FILE = "watermark.json"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class Watermark:
+
+    """The high-water mark of an index: the last database row indexed for
+    each mailing list
+
+    The watermark is stored as a JSON file inside the index directory and is
+    only saved after the index writer has committed, so the index never
+    claims to contain rows it has not written.
+    """
+
+    def __init__(self, index_dir, lists=None, render_version=None):
+        self.path = os.path.join(index_dir, WATERMARK_FILE)
+        self.lists = lists if lists is not None else {}
+        # The version of the renderer that produced the index's stored HTML
+        self.render_version = render_version
+
+    @classmethod
+    def load(cls, index_dir):
+        path = os.path.join(index_dir, WATERMARK_FILE)
+        if not os.path.exists(path):
+            return cls(index_dir)
+
+        with open(path) as f:
+            data = json.load(f)
+        return cls(index_dir, data.get("lists", {}), data.get("render_version"))
+
+    def rowid(self, list_id):
+        """Returns the rowid of the last indexed row of `list_id` (0 if the
+        list has never been indexed)
+        """
+        return self.lists.get(list_id, {}).get("rowid", 0)
+
+    def rowids(self):
+        return {list_id: mark["rowid"] for list_id, mark in self.lists.items()}
+
+    def advance(self, list_id, rowid, sent_at=None):
+        mark = self.lists.setdefault(list_id, {"rowid": 0, "sent_at": None})
+        mark["rowid"] = max(mark["rowid"], rowid)
+        if sent_at is not None:
+            sent_at = sent_at.strftime(DATE_FORMAT)
+            if mark["sent_at"] is None or sent_at > mark["sent_at"]:
+                mark["sent_at"] = sent_at
+
+    def sent_at(self, list_id):
+        sent_at = self.lists.get(list_id, {}).get("sent_at")
+        if sent_at is None:
+            return None
+        return datetime.strptime(sent_at, DATE_FORMAT)
+
+    def reset(self):
+        self.lists = {}
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            data = {"lists": self.lists, "render_version": self.render_version}
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
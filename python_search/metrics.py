@@ -0,0 +1,371 @@
+"""Counters, gauges and histograms shared by the scraper, indexer and frontend
+
+Metrics are registered once, at import time, in the process-wide `REGISTRY`:
+
+    FETCH_SECONDS = metrics.histogram(
+        "scraper_fetch_seconds", "Time taken by HTTP requests"
+    )
+    with FETCH_SECONDS.time():
+        ...
+
+The registry is exposed by the frontend on `/metrics` in the Prometheus text
+exposition format, and batch jobs write the same text to a file with `dump`.
+
+Metrics live in process memory, so work done in a `multiprocessing` pool
+has to be carried back to the parent: workers `drain` their registry and
+return the samples along with their results, and the parent `merge`s them.
+Long-lived processes that serve together (the frontend's workers) instead
+`write_samples` to a shared directory, and `aggregate` sums them up.
+"""
+import glob
+import math
+import os
+import pickle
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket bounds (in seconds) suited to everything from parsing a message to
+# committing an index
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(name, _escape(value)) for name, value in pairs
+    ) + "}"
+
+
+class _Metric:
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("{} takes the labels {}, not {}".format(
+                self.name, self.labelnames, tuple(sorted(labels))
+            ))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def expose(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        with self._lock:
+            for key in sorted(self._values):
+                lines += self._sample_lines(key, self._values[key])
+        return lines
+
+    def _sample_lines(self, key, value):
+        return ["{}{} {}".format(
+            self.name, _format_labels(self.labelnames, key), _format_value(value)
+        )]
+
+    def _empty(self):
+        """Returns a metric of the same kind and name, with no samples"""
+        return type(self)(self.name, self.documentation, self.labelnames)
+
+    def _drain(self):
+        values = self._samples()
+        self._values = {}
+        return values
+
+
+class Counter(_Metric):
+
+    """A count that only goes up, e.g. requests made or bytes downloaded"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return dict(self._values)
+
+    def _merge(self, values):
+        for key, value in values.items():
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(_Metric):
+
+    """A value that can go up and down, e.g. the size of a cache"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        # A gauge is the state of one process, so isn't carried over
+        return {}
+
+    def _drain(self):
+        return {}
+
+    def _merge(self, values):
+        pass
+
+
+class _HistogramValue:
+
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+
+    """The distribution of a measurement, e.g. request latency
+
+    Observations are counted in cumulative buckets with upper bounds
+    `buckets`, along with their sum and count.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = _HistogramValue(len(self.buckets))
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram.buckets[idx] += 1
+                    break
+            histogram.sum += value
+            histogram.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the time taken by the body of a `with` block, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _sample_lines(self, key, histogram):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, histogram.buckets):
+            cumulative += count
+            lines.append("{}_bucket{} {}".format(
+                self.name,
+                _format_labels(self.labelnames, key, [("le", _format_value(bound))]),
+                cumulative,
+            ))
+        labels = _format_labels(self.labelnames, key)
+        lines.append("{}_sum{} {}".format(self.name, labels, _format_value(histogram.sum)))
+        lines.append("{}_count{} {}".format(self.name, labels, histogram.count))
+        return lines
+
+    def _empty(self):
+        return type(self)(
+            self.name, self.documentation, self.labelnames, self.buckets[:-1]
+        )
+
+    def _samples(self):
+        return {
+            key: (list(histogram.buckets), histogram.sum, histogram.count)
+            for key, histogram in self._values.items()
+        }
+
+    def _merge(self, values):
+        for key, (buckets, total, count) in values.items():
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = _HistogramValue(len(self.buckets))
+            for idx, bucket in enumerate(buckets):
+                histogram.buckets[idx] += bucket
+            histogram.sum += total
+            histogram.count += count
+
+
+class Registry:
+
+    """The set of metrics of a process"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, cls, name, documentation, labelnames=(), **kwargs):
+        """Returns the metric called `name`, creating it if needed
+
+        Registering the same name twice returns the existing metric, so
+        modules can be reloaded.
+        """
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(
+                    name, documentation, labelnames, **kwargs
+                )
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError("{} is already registered as a different metric".format(name))
+            return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def exposition(self):
+        """Returns every metric in the Prometheus text exposition format"""
+        lines = []
+        for name in sorted(self._metrics):
+            lines += self._metrics[name].expose()
+        return "\n".join(lines) + "\n"
+
+    def drain(self):
+        """Returns the counters and histograms observed since the last
+        drain, and resets them (for `merge` into another process's registry)
+        """
+        samples = {}
+        for name, metric in list(self._metrics.items()):
+            with metric._lock:
+                values = metric._drain()
+            if values:
+                samples[name] = values
+        return samples
+
+    def samples(self):
+        """Returns every counter and histogram observed since the last
+        drain, without resetting them (in the format of `drain`)
+        """
+        samples = {}
+        for name, metric in list(self._metrics.items()):
+            with metric._lock:
+                values = metric._samples()
+            if values:
+                samples[name] = values
+        return samples
+
+    def merge(self, samples):
+        """Adds samples drained from another process"""
+        for name, values in samples.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                with metric._lock:
+                    metric._merge(values)
+
+    def dump(self, path):
+        """Writes the exposition of every metric to `path`, atomically"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        with os.fdopen(fd, "w") as f:
+            f.write(self.exposition())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(
+        Histogram, name, documentation, labelnames, buckets=buckets
+    )
+
+
+def exposition():
+    return REGISTRY.exposition()
+
+
+def dump(path):
+    REGISTRY.dump(path)
+
+
+def drain():
+    """Returns and resets the samples observed since the last drain (see
+    `Registry.drain`)
+
+    Worker pools use it as their initializer, so that forked workers don't
+    send back the samples they inherited from their parent.
+    """
+    return REGISTRY.drain()
+
+
+def write_samples(directory):
+    """Writes this process's counters and histograms to its file in
+    `directory`, atomically, for `aggregate`
+    """
+    path = os.path.join(directory, "{}.samples".format(os.getpid()))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".samples-")
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(REGISTRY.samples(), f)
+    os.replace(tmp_path, path)
+
+
+def aggregate(directory):
+    """Returns the exposition of the counters and histograms of every
+    process that wrote its samples to `directory`, summed up, along with
+    this process's gauges
+
+    This process's samples are written first. Files are kept after their
+    process exits, so totals never go down while the directory is in use.
+    """
+    write_samples(directory)
+    total = Registry()
+    for name, metric in list(REGISTRY._metrics.items()):
+        total._metrics[name] = metric if isinstance(metric, Gauge) else metric._empty()
+    for path in glob.glob(os.path.join(directory, "*.samples")):
+        try:
+            with open(path, "rb") as f:
+                total.merge(pickle.load(f))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            continue
+    return total.exposition()
@@ -0,0 +1,28 @@
+import re
+import threading
+from markdown import Markdown
+
+# Bump this whenever the rendered output changes, so the indexer knows to
+# re-render the HTML it stores
+RENDER_VERSION = 1
+
+# Headings and emphasis are usually accidental in plain-text email (e.g. "#"
+# comments or "*" bullets), so they're rendered as plain paragraphs
+_demoted_tags = re.compile(r'<(/?)(?:h[1-4]|strong|i)>')
+
+# Markdown instances aren't thread-safe, so each thread gets its own
+_local = threading.local()
+
+
+def _renderer():
+    renderer = getattr(_local, 'renderer', None)
+    if renderer is None:
+        renderer = _local.renderer = Markdown(
+            extensions=['urlize', 'markdown.extensions.nl2br']
+        )
+    return renderer
+
+
+def render_as_html(message_text):
+    rendered = _renderer().reset().convert(message_text)
+    return _demoted_tags.sub(r'<\1p>', rendered)
@@ -0,0 +1,216 @@
+import email
+import gzip
+import logging
+import re
+from datetime import datetime
+from email.header import decode_header, make_header
+from email.utils import parseaddr, parsedate_to_datetime
+from .extract import PARSE_SECONDS
+from .message import Message
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The "From " line that starts each message of an mbox. Pipermail
+# obfuscates the address, e.g. "From guido at python.org  Tue May  1 10:00:00 2018"
+ENVELOPE_RE = re.compile(
+    rb"^From (?:\S+ at )?\S+ +(\w{3} \w{3} [ \d]\d \d\d:\d\d:\d\d \d{4})\s*$"
+)
+# Pipermail's obfuscated From header, e.g. "guido at python.org (Guido)"
+AUTHOR_RE = re.compile(r"^(.*?)\s*\((.*)\)\s*$")
+GZIP_MAGIC = b"\x1f\x8b"
+# Reply prefixes and list tags, which pipermail's listings may leave out
+SUBJECT_NOISE_RE = re.compile(r"^\s*(?:(?:re|fwd?|aw)\s*:|\[[^\]]*\])\s*", re.I)
+
+
+def open_archive(fileobj):
+    """Wraps a downloaded monthly text archive, which may be gzipped, for
+    streaming
+
+    Parameters
+    ----------
+    fileobj : file
+        The archive, opened in binary mode
+    """
+    fileobj.seek(0)
+    magic = fileobj.read(2)
+    fileobj.seek(0)
+    if magic == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    return fileobj
+
+
+def split_archive(fileobj):
+    """Splits an mbox stream into messages, without parsing them
+
+    Only one message is held in memory at a time.
+
+    Yields
+    ------
+    (str, list of bytes)
+        The date on the envelope line of each message, and its lines
+    """
+    envelope_date, lines = None, []
+    previous_blank = True
+    for line in fileobj:
+        match = ENVELOPE_RE.match(line) if previous_blank else None
+        if match:
+            if envelope_date is not None:
+                yield envelope_date, lines
+            envelope_date, lines = match.group(1).decode("ascii"), []
+        elif envelope_date is not None:
+            lines.append(line)
+        previous_blank = not line.strip()
+
+    if envelope_date is not None:
+        yield envelope_date, lines
+
+
+def count_archive(fileobj):
+    """Returns the number of messages in an mbox stream"""
+    return sum(1 for _ in split_archive(fileobj))
+
+
+def iter_archive(fileobj):
+    """Parses the messages of an mbox stream
+
+    Only one message is held in memory at a time.
+
+    Parameters
+    ----------
+    fileobj : file
+        The archive, opened in binary mode
+
+    Yields
+    ------
+    dict
+        The text, sent_at, author, email and subject of each message, in
+        archive order
+    """
+    for envelope_date, lines in split_archive(fileobj):
+        yield parse_archived_message(envelope_date, lines)
+
+
+def parse_archived_message(envelope_date, lines):
+    """Parses the lines of one archived message into message fields"""
+    with PARSE_SECONDS.time(mode="mbox"):
+        return _parse_archived_message(envelope_date, lines)
+
+
+def _parse_archived_message(envelope_date, lines):
+    parsed = email.message_from_bytes(b"".join(lines))
+
+    author, address = None, None
+    sender = decode(parsed.get("From"))
+    if sender:
+        match = AUTHOR_RE.match(sender)
+        if match:
+            address, author = match.group(1), match.group(2)
+        else:
+            author, address = parseaddr(sender)
+
+    return {
+        "text": message_body(parsed),
+        "sent_at": parse_sent_at(envelope_date, parsed.get("Date")),
+        "author": author.strip() if author else None,
+        "email": address.strip() if address else None,
+        "subject": decode(parsed.get("Subject")),
+    }
+
+
+def decode(header):
+    """Decodes an RFC 2047 encoded header into a string"""
+    if header is None:
+        return None
+    try:
+        return str(make_header(decode_header(header))).strip()
+    except Exception:
+        return str(header).strip()
+
+
+def parse_sent_at(envelope_date, date_header):
+    # Pipermail's pages show the archive's local time, which is the time
+    # on the envelope line
+    try:
+        return datetime.strptime(envelope_date, "%a %b %d %H:%M:%S %Y")
+    except ValueError:
+        pass
+
+    try:
+        return parsedate_to_datetime(date_header).replace(tzinfo=None)
+    except Exception:
+        logger.warning("Unable to parse '{}' as a datetime".format(date_header))
+        return None
+
+
+def message_body(parsed):
+    """Returns the first text/plain part of a message"""
+    for part in parsed.walk():
+        if part.is_multipart() or part.get_content_type() != "text/plain":
+            continue
+        payload = part.get_payload(decode=True) or b""
+        charset = part.get_content_charset() or "utf-8"
+        try:
+            return payload.decode(charset, errors="replace").strip()
+        except LookupError:
+            return payload.decode("utf-8", errors="replace").strip()
+    return None
+
+
+def _normalize_subject(subject):
+    previous = None
+    while subject != previous:
+        previous, subject = subject, SUBJECT_NOISE_RE.sub("", subject)
+    return _normalize(subject)
+
+
+def _normalize(text):
+    return " ".join(text.split()).casefold()
+
+
+def matches_listing(message, fields):
+    """Returns whether the fields parsed from an archived message agree with
+    the subject and author that the thread listing shows for `message`
+
+    Values that either side is missing aren't compared.
+    """
+    if message.listed_subject is not None and fields["subject"] is not None:
+        if (_normalize_subject(message.listed_subject)
+                != _normalize_subject(fields["subject"])):
+            return False
+    if message.listed_author is not None and fields["author"] is not None:
+        if _normalize(message.listed_author) != _normalize(fields["author"]):
+            return False
+    return True
+
+
+class ArchivedMessage(Message):
+
+    """A message whose fields were read from a monthly archive rather than
+    scraped from its content page
+    """
+
+    def __init__(self, message, fields):
+        """
+        Parameters
+        ----------
+        message : Message
+            The message from the page's thread listing, which carries its id
+            and its place in its thread
+        fields : dict
+            The fields parsed from the archive (see `iter_archive`)
+        """
+        super().__init__(
+            message.list_id,
+            message.page,
+            message.message_id,
+            message.thread_parent,
+            message.thread_idx,
+            message.thread_indent,
+        )
+        self._fields = fields
+
+    @property
+    def url(self):
+        # There's nothing left to fetch
+        return None
@@ -0,0 +1,105 @@
+import logging
+from datetime import datetime
+import lxml.html
+from dateutil.parser import parse
+from .. import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PARSE_SECONDS = metrics.histogram(
+    "scraper_parse_seconds",
+    "Time taken to parse the fields of a message",
+    ["mode"],
+)
+
+# The first element of each of these tags holds one field of the message
+FIELD_TAGS = {
+    "h1": "subject",
+    "b": "author",
+    "a": "email",
+    "i": "sent_at",
+    "pre": "text",
+}
+
+MONTHS = {
+    month: idx + 1
+    for idx, month in enumerate(
+        [
+            "Jan", "Feb", "Mar", "Apr", "May", "Jun",
+            "Jul", "Aug", "Sep", "Oct", "Nov", "Dec",
+        ]
+    )
+}
+
+
+def parse_pipermail_date(text):
+    """Parses a pipermail date, e.g. "Tue May  1 10:00:00 EDT 2018"
+
+    Pipermail always uses this format, so it is parsed directly. Anything
+    else falls back to `dateutil`. Time zones are dropped: pipermail shows
+    the archive's local time.
+
+    Returns
+    -------
+    DateTime
+        The parsed date, or None if it can't be parsed
+    """
+    parts = text.split()
+    try:
+        if len(parts) in (5, 6) and parts[1] in MONTHS:
+            hour, minute, second = parts[3].split(":")
+            return datetime(
+                int(parts[-1]),
+                MONTHS[parts[1]],
+                int(parts[2]),
+                int(hour),
+                int(minute),
+                int(second),
+            )
+    except ValueError:
+        pass
+
+    try:
+        return parse(text).replace(tzinfo=None)
+    except (ValueError, OverflowError):
+        logger.warn("Unable to parse '{}' as a datetime".format(text))
+        return None
+
+
+def extract_message(html):
+    """Extracts the fields of a message from its content page in one pass
+
+    The page is parsed once with lxml, and a single walk over the tree picks
+    out the first <h1> (subject), <b> (author), <a> (email), <i> (sent_at)
+    and <pre> (text).
+
+    Parameters
+    ----------
+    html : str
+        The content page of the message
+
+    Returns
+    -------
+    dict
+        The text, sent_at, author, email and subject of the message. Fields
+        that couldn't be found are None.
+    """
+    fields = dict.fromkeys(FIELD_TAGS.values())
+    if not html or not html.strip():
+        return fields
+
+    root = lxml.html.fromstring(html)
+    remaining = len(FIELD_TAGS)
+    for elem in root.iter(*FIELD_TAGS):
+        field = FIELD_TAGS[elem.tag]
+        if fields[field] is not None:
+            continue
+        fields[field] = elem.text_content().strip()
+        remaining -= 1
+        if not remaining:
+            break
+
+    if fields["sent_at"] is not None:
+        fields["sent_at"] = parse_pipermail_date(fields["sent_at"])
+    return fields
@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+import aiohttp
+import backoff
+from .. import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FETCH_SECONDS = metrics.histogram(
+    "scraper_fetch_seconds",
+    "Time taken by HTTP requests, excluding rate limiting",
+)
+FETCH_BYTES = metrics.counter(
+    "scraper_fetch_bytes_total", "Bytes of response bodies downloaded"
+)
+FETCH_RETRIES = metrics.counter(
+    "scraper_fetch_retries_total", "HTTP requests retried after an error"
+)
+FETCH_FAILURES = metrics.counter(
+    "scraper_fetch_failures_total", "HTTP requests that failed on every retry"
+)
+
+# The server that is scraped (see `configure`)
+DEFAULT_BASE_URL = "https://mail.python.org"
+
+# Default politeness settings for mail.python.org
+DEFAULT_REQUESTS_PER_SECOND = 4.0
+DEFAULT_CONCURRENCY = 8
+
+
+class RateLimiter:
+
+    """Spaces out requests so that at most `requests_per_second` start in any
+    one second
+    """
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_event_loop().time()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _count_retry(details):
+    FETCH_RETRIES.inc()
+
+
+def _count_failure(details):
+    FETCH_FAILURES.inc()
+
+
+def _is_permanent(error):
+    """Returns whether retrying a failed request can't help: client errors
+    (e.g. a deleted message's 404), other than being rate limited
+    """
+    return (
+        isinstance(error, aiohttp.ClientResponseError)
+        and 400 <= error.status < 500
+        and error.status != 429
+    )
+
+
+class Fetcher:
+
+    """Fetches pages over a pool of keep-alive HTTP connections
+
+    Requests run on an asyncio event loop in a background thread, so the
+    fetcher can be used from ordinary blocking code: `get` fetches a single
+    page, while `get_all` keeps a window of requests in flight. Each host is
+    limited to `requests_per_second`, and at most `concurrency` requests are
+    open at once.
+
+    Attributes
+    ----------
+    requests_per_second : float
+        The maximum request rate per host
+    concurrency : int
+        The maximum number of requests in flight
+    """
+
+    def __init__(
+        self,
+        requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+        concurrency=DEFAULT_CONCURRENCY,
+        timeout=60,
+    ):
+        """
+        Parameters
+        ----------
+        requests_per_second : float
+            The maximum request rate per host
+        concurrency : int
+            The maximum number of requests in flight
+        timeout : float
+            The total timeout of a request, in seconds
+        """
+        self.requests_per_second = requests_per_second
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="fetcher", daemon=True
+        )
+        self._thread.start()
+        self._run(self._open()).result()
+
+    async def _open(self):
+        # asyncio primitives must be created on the loop that uses them
+        self._limiters = {}
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _limiter(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._limiters:
+            self._limiters[host] = RateLimiter(self.requests_per_second)
+        return self._limiters[host]
+
+    @backoff.on_exception(
+        backoff.expo,
+        (aiohttp.ClientError, asyncio.TimeoutError),
+        max_tries=8,
+        giveup=_is_permanent,
+        on_backoff=_count_retry,
+        on_giveup=_count_failure,
+    )
+    async def fetch(self, url):
+        """Fetches the text of `url`, retrying with exponential backoff
+
+        Returns
+        -------
+        str
+            The body of the page
+        """
+        async with self._semaphore:
+            await self._limiter(url).wait()
+            with FETCH_SECONDS.time():
+                async with self._session.get(url) as response:
+                    response.raise_for_status()
+                    FETCH_BYTES.inc(len(await response.read()))
+                    return await response.text(errors="replace")
+
+    @backoff.on_exception(
+        backoff.expo,
+        (aiohttp.ClientError, asyncio.TimeoutError),
+        max_tries=8,
+        giveup=_is_permanent,
+        on_backoff=_count_retry,
+        on_giveup=_count_failure,
+    )
+    async def _download(self, url, fileobj):
+        async with self._semaphore:
+            await self._limiter(url).wait()
+            with FETCH_SECONDS.time():
+                async with self._session.get(url) as response:
+                    response.raise_for_status()
+                    fileobj.seek(0)
+                    fileobj.truncate()
+                    async for chunk in response.content.iter_chunked(1 << 16):
+                        FETCH_BYTES.inc(len(chunk))
+                        fileobj.write(chunk)
+
+    async def _fetch_or_none(self, url):
+        try:
+            return await self.fetch(url)
+        except Exception as e:
+            logger.warning("Request failed for {}: {}".format(url, e))
+            return None
+
+    def get(self, url):
+        """Fetches the text of `url`, blocking until it has been downloaded
+
+        Raises the last error if every retry fails.
+        """
+        return self._run(self.fetch(url)).result()
+
+    def download(self, url, fileobj):
+        """Streams the body of `url` into the binary file `fileobj`, without
+        holding it in memory
+        """
+        self._run(self._download(url, fileobj)).result()
+        fileobj.flush()
+
+    def get_all(self, urls, window=None):
+        """Fetches many urls concurrently
+
+        Parameters
+        ----------
+        urls : iterable of str
+            The urls to fetch. Consumed lazily, at most `window` ahead of the
+            pages that have been yielded. None entries are yielded back as
+            None without making a request.
+        window : int, optional
+            The number of requests to queue ahead
+
+        Yields
+        ------
+        str or None
+            The text of each url, in the order given. None if the request
+            failed.
+        """
+        window = window or self.concurrency * 4
+        pending = deque()
+        for url in urls:
+            if url is None:
+                future = Future()
+                future.set_result(None)
+            else:
+                future = self._run(self._fetch_or_none(url))
+            pending.append(future)
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        self._run(self._session.close()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+_fetcher = None
+_fetcher_pid = None
+_settings = {}
+_base_url = DEFAULT_BASE_URL
+_fetcher_lock = threading.Lock()
+
+
+def configure(base_url=None, **settings):
+    """Sets the server to scrape (e.g. a local stand-in for tests), and the
+    options (see `Fetcher`) of the process-wide fetcher
+    """
+    global _base_url
+    if base_url:
+        _base_url = base_url.rstrip("/")
+    _settings.update(settings)
+    shutdown()
+
+
+def url(*parts):
+    """Returns the url of the path `parts` on the server being scraped"""
+    return "/".join((_base_url,) + parts)
+
+
+def shutdown():
+    """Closes the process-wide fetcher's connections"""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is not None and _fetcher_pid == os.getpid():
+            _fetcher.close()
+        _fetcher = None
+
+
+def get_fetcher():
+    """Returns the process-wide fetcher
+
+    Each process gets its own fetcher, since the event loop thread doesn't
+    survive a fork.
+    """
+    global _fetcher, _fetcher_pid
+    with _fetcher_lock:
+        if _fetcher is None or _fetcher_pid != os.getpid():
+            _fetcher = Fetcher(**_settings)
+            _fetcher_pid = os.getpid()
+        return _fetcher
@@ -1,22 +1,22 @@
 from bs4 import BeautifulSoup
-import requests
 from datetime import datetime
 from dateutil.parser import parse
 import time
 import logging
+import tempfile
+import threading
+from .archive import (
+    ArchivedMessage, count_archive, iter_archive, matches_listing,
+    open_archive,
+)
+from . import fetcher
+from .fetcher import get_fetcher
+from .manifest import PageComplete
 from .message import Message
-import backoff
 
 logging.basicConfig(level="INFO")
 logger = logging.getLogger(__name__)
 
-BASE_URL = "https://mail.python.org/pipermail/"
-
-@backoff.on_exception(backoff.expo,
-                      requests.exceptions.RequestException)
-def get_page(url):
-    return requests.get(url)
-
 
 class MailingList:
 
@@ -38,6 +38,10 @@ class MailingList:
         """
         self.list_id = list_id.lower()
         self._soup = None
+        self._archives = None
+        # The scheduler's workers scrape several pages of a list at once, so
+        # each thread caches its own thread listing
+        self._local = threading.local()
 
     @property
     def soup(self):
@@ -55,13 +59,14 @@ class MailingList:
             return self._soup
 
         try:
-            req = get_page(BASE_URL + self.list_id)
+            text = get_fetcher().get(fetcher.url("pipermail", self.list_id))
         except Exception as e:
             logger.error(
-                "Request failed for list {}. ".format(self.list_id), e
+                "Request failed for list {}. {}".format(self.list_id, e)
             )
+            text = ""
 
-        self._soup = BeautifulSoup(req.text, "lxml")
+        self._soup = BeautifulSoup(text, "lxml")
         return self._soup
 
     def _message_link_to_id(self, link):
@@ -81,6 +86,22 @@ class MailingList:
         """
         return link.split(".")[0]
 
+    def _listing_entry(self, item):
+        """Parses an entry of a thread listing
+
+        Returns
+        -------
+        (str, str, str)
+            The message id, and the subject and author shown for it
+        """
+        link = item.find("a", href=True)
+        author = item.find("i", recursive=False)
+        return (
+            self._message_link_to_id(link["href"]),
+            link.get_text().strip(),
+            author.get_text().strip() if author is not None else None,
+        )
+
     def _scrape_page(self, page):
         """Scrapes all the messages from this mailing list that were posted
         during the given page
@@ -97,17 +118,15 @@ class MailingList:
         """
         logger.info('Scraping "{}" for page {}'.format(self.list_id, page))
 
-        req = requests.get(
-            "/".join([BASE_URL, self.list_id, page, "thread.html"])
-        )
-        soup = BeautifulSoup(req.text, "lxml")
+        soup = self._thread_soup(page)
         thread_ul = soup.find_all("ul")[1]
 
         for thread in thread_ul.find_all("li", recursive=False):
-            thread_id = self._message_link_to_id(
-                thread.find("a", href=True)["href"]
+            thread_id, subject, author = self._listing_entry(thread)
+            yield Message(
+                self.list_id, page, thread_id, thread_id, 0, 0,
+                listed_subject=subject, listed_author=author,
             )
-            yield Message(self.list_id, page, thread_id, thread_id, 0, 0)
 
             for child_idx, child in enumerate(thread.find_all("li")):
                 depth = 0
@@ -116,9 +135,7 @@ class MailingList:
                     depth += 1
                     tmp = tmp.parent
 
-                child_id = self._message_link_to_id(
-                    child.find("a", href=True)["href"]
-                )
+                child_id, subject, author = self._listing_entry(child)
                 yield Message(
                     list_id=self.list_id,
                     page=page,
@@ -126,6 +143,8 @@ class MailingList:
                     thread_parent=thread_id,
                     thread_idx=child_idx + 1,
                     thread_indent=depth,
+                    listed_subject=subject,
+                    listed_author=author,
                 )
 
     def _get_pages(self):
@@ -143,15 +162,130 @@ class MailingList:
                 pages.append(page)
         return pages
 
-    def _get_page_starting_at(self, page):
-        """Return the starting date of the page
+    def _get_archive_url(self, page):
+        """Returns the url of the downloadable text archive of the page, or
+        None if the page has no archive
+
+        Past months are gzipped (e.g. "2018-April.txt.gz"), but the current
+        month is usually plain text, so the link is read from the summary page.
         """
-        logger.info('Scraping "{}" for page {}'.format(self.list_id, page))
+        if self._archives is None:
+            archives = {}
+            for row in self.soup.find_all("tr")[1:]:
+                links = [a["href"] for a in row.find_all("a", href=True)]
+                if not links:
+                    continue
+                page_url = links[0].replace("/thread.html", "")
+                for link in links[1:]:
+                    if ".txt" in link:
+                        archives[page_url] = link
+            # Assigned once complete, since other threads may be reading it
+            self._archives = archives
+
+        link = self._archives.get(page)
+        if link is None:
+            return None
+        return fetcher.url("pipermail", self.list_id, link)
+
+    def _scrape_archive(self, page, known=()):
+        """Scrapes all the messages of the page from its monthly text archive
+
+        The archive is downloaded to a temporary file once and parsed as a
+        stream. Messages are listed in the archive in the order pipermail
+        numbered them, so the n-th archived message is matched with the n-th
+        lowest message id on the page's thread listing, which also supplies
+        the thread structure. Falls back to scraping the messages' content
+        pages if the archive can't be matched up with the listing, or from
+        the first message whose subject or author doesn't match its listing
+        (see `_match_archive`).
+
+        Parameters
+        ----------
+        page : str
+            The subpage to scrape
+        known : set of str, optional
+            The ids of messages that are already stored. If every message of
+            the page is known, the archive isn't downloaded.
 
-        req = requests.get(
-            "/".join([BASE_URL, self.list_id, page, "thread.html"])
+        Yields
+        ------
+        Message
+            The scraped message, in the order pipermail numbered them
+        """
+        listed = sorted(self._scrape_page(page), key=lambda m: int(m.message_id))
+        if all(message.message_id in known for message in listed):
+            yield from listed
+            return
+
+        url = self._get_archive_url(page)
+        if url is not None:
+            with tempfile.TemporaryFile() as f:
+                try:
+                    get_fetcher().download(url, f)
+                except Exception as e:
+                    logger.warning("Unable to download {}: {}".format(url, e))
+                else:
+                    archived = self._match_archive(listed, f, page)
+                    if archived is not None:
+                        yield from archived
+                        return
+
+        logger.warning(
+            "Unable to use the archive of {}/{}. "
+            "Scraping message pages instead".format(self.list_id, page)
         )
-        soup = BeautifulSoup(req.text, "lxml")
+        yield from listed
+
+    def _match_archive(self, listed, fileobj, page=None):
+        """Pairs the listed messages with the messages of the archive in
+        `fileobj`, parsing one at a time as they are consumed
+
+        The archive's messages are counted first, so None is returned before
+        anything is parsed if it holds a different number of messages. Each
+        pair is checked against the subject and author on the listing: from
+        the first that doesn't match (e.g. a message was scrubbed from the
+        archive and another added), the archive is out of step with the
+        listing, so the rest of the listed messages are yielded to be scraped
+        from their content pages instead.
+        """
+        if count_archive(open_archive(fileobj)) != len(listed):
+            return None
+        return self._paired_messages(
+            listed, iter_archive(open_archive(fileobj)), page
+        )
+
+    def _paired_messages(self, listed, archived, page):
+        for idx, (message, fields) in enumerate(zip(listed, archived)):
+            if not matches_listing(message, fields):
+                logger.warning(
+                    "Message {} of {}/{} doesn't match the archive. Scraping "
+                    "message pages from there instead".format(
+                        message.message_id, self.list_id, page
+                    )
+                )
+                yield from listed[idx:]
+                return
+            yield ArchivedMessage(message, fields)
+
+    def _thread_soup(self, page):
+        """Requests the thread listing of the page, and returns a
+        BeautifulSoup soup object
+
+        The listing of the most recent page is cached, since both
+        `_scrape_page` and `_get_page_starting_at` read it.
+        """
+        if getattr(self._local, "page", None) != page:
+            text = get_fetcher().get(
+                fetcher.url("pipermail", self.list_id, page, "thread.html")
+            )
+            self._local.page = page
+            self._local.soup = BeautifulSoup(text, "lxml")
+        return self._local.soup
+
+    def _get_page_starting_at(self, page):
+        """Return the starting date of the page
+        """
+        soup = self._thread_soup(page)
 
         try:
             date_block = soup.find("p")
@@ -167,12 +301,92 @@ class MailingList:
             )
             return datetime.now()
 
-    def messages(self, page=None, since=None):
+    def pending_pages(self, manifest=None):
+        """Returns the pages of the list that need to be scraped, newest first
+
+        Parameters
+        ----------
+        manifest : PageManifest, optional
+            If provided, completed past pages are left out
+
+        Returns
+        -------
+        list of (str, bool)
+            Each page, and whether it is the list's newest page (which is
+            never skipped, since it may still change)
+        """
+        all_pages = self._get_pages()
+        completed = set()
+        if manifest is not None:
+            completed = manifest.completed_pages(self.list_id)
+
+        pages = []
+        for idx, page in enumerate(all_pages):
+            is_open = idx == 0
+            if page in completed and not is_open:
+                logger.info(
+                    'Skipping completed page {} of "{}"'.format(page, self.list_id)
+                )
+                continue
+            pages.append((page, is_open))
+        return pages
+
+    def page_messages(self, page, is_open=False, mode="html", manifest=None):
+        """Scrapes the messages of a single page
+
+        Parameters
+        ----------
+        page : str
+            The subpage to scrape
+        is_open : bool
+            Whether the page is the list's newest page
+        mode : str, optional
+            "html" to scrape each message's content page, or "mbox" to read
+            messages from the page's monthly text archive
+        manifest : PageManifest, optional
+            If provided, messages that are already stored aren't yielded,
+            and the page's messages are followed by a `PageComplete` marker
+
+        Yields
+        ------
+        Message
+            The scraped message
+        """
+        known = set()
+        if manifest is not None:
+            known = manifest.known_message_ids(self.list_id, page)
+
+        if mode == "mbox":
+            page_messages = self._scrape_archive(page, known)
+        else:
+            page_messages = self._scrape_page(page)
+
+        message_count = 0
+        for message in page_messages:
+            message_count += 1
+            if message.message_id not in known:
+                yield message
+
+        if manifest is not None:
+            yield PageComplete(self.list_id, page, message_count, is_open)
+
+    def page_starting_at(self, page):
+        """Returns the date of the first message of the page"""
+        return self._get_page_starting_at(page)
+
+    def messages(self, page=None, since=None, mode="html", manifest=None):
         """
         Parameters
         ----------
         page : str, optional
             If provided, `messages` will only yield messages that were posted on this subpage
+        mode : str, optional
+            "html" to scrape each message's content page, or "mbox" to read
+            messages from each page's monthly text archive
+        manifest : PageManifest, optional
+            If provided, completed past pages are skipped without being
+            requested, messages that are already stored aren't yielded, and
+            each page is followed by a `PageComplete` marker
 
         Yields
         ------
@@ -180,17 +394,14 @@ class MailingList:
             The scraped message, yielded in ascending order of creation time
 
         """
-
+        pages = self.pending_pages(manifest)
         if page is not None:
-            pages = [page]
-        else:
-            pages = self._get_pages()
+            pages = [(p, is_open) for p, is_open in pages if p == page]
 
-        for page in pages:
-            for message in self._scrape_page(page):
-                yield message
+        for page, is_open in pages:
+            yield from self.page_messages(page, is_open, mode, manifest)
 
-            most_recent = self._get_page_starting_at(page)
+            most_recent = self.page_starting_at(page)
             if since is not None and most_recent < since:
                 logger.info(
                     "Stopping scraper because {} is before {}".format(
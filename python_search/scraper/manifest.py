@@ -0,0 +1,91 @@
+from datetime import datetime
+from sqlalchemy import func
+from .model import Message, Page
+
+
+class PageComplete:
+
+    """Marks the end of a page in a stream of scraped messages
+
+    Attributes
+    ----------
+    list_id : str
+        The list the page belongs to
+    page : str
+        The page that was scraped
+    message_count : int
+        The number of messages on the page
+    is_open : bool
+        Whether the page is the list's newest page, which may still change
+    """
+
+    url = None
+
+    def __init__(self, list_id, page, message_count, is_open):
+        self.list_id = list_id
+        self.page = page
+        self.message_count = message_count
+        self.is_open = is_open
+
+    def __str__(self):
+        return "<PageComplete - List: {}, Page: {}, Messages: {}>".format(
+            self.list_id, self.page, self.message_count
+        )
+
+
+class PageManifest:
+
+    """Records which pages of each mailing list have been scraped, so later
+    scrapes can skip them
+
+    Past pages never change, so once one has been completely scraped it is
+    never requested again. The newest page of a list is always re-scraped,
+    but only messages that aren't stored yet are fetched.
+
+    Pages are recorded by the `MessageWriter`, after their messages.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def completed_pages(self, list_id):
+        """Returns the pages of `list_id` that can be skipped"""
+        rows = (
+            self.session.query(Page.page)
+            .filter(Page.list_id == list_id)
+            .filter(Page.completed_at.isnot(None))
+        )
+        return {page for page, in rows}
+
+    def known_message_ids(self, list_id, page):
+        """Returns the ids of the messages of a page that are already stored"""
+        rows = (
+            self.session.query(Message.message_id)
+            .filter(Message.list_id == list_id)
+            .filter(Message.page == page)
+        )
+        return {message_id for message_id, in rows}
+
+    def last_activity(self):
+        """Returns when the newest stored message of each list was sent"""
+        rows = (
+            self.session.query(Message.list_id, func.max(Message.sent_at))
+            .group_by(Message.list_id)
+        )
+        return {list_id: sent_at for list_id, sent_at in rows if sent_at}
+
+
+def page_row(marker):
+    """Converts an end-of-page marker into the `Page` row recording it
+
+    Parameters
+    ----------
+    marker : PageComplete
+        The end-of-page marker of the scraped page
+    """
+    return Page(
+        list_id=marker.list_id,
+        page=marker.page,
+        message_count=marker.message_count,
+        completed_at=None if marker.is_open else datetime.now(),
+    )
@@ -1,21 +1,13 @@
-from dateutil.parser import parse
-import requests
 from bs4 import BeautifulSoup
 import logging
-import backoff
+from .extract import PARSE_SECONDS, extract_message
+from . import fetcher
+from .fetcher import get_fetcher
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-BASE_URL = "https://mail.python.org/pipermail"
-
-
-@backoff.on_exception(backoff.expo,
-                      requests.exceptions.RequestException)
-def get_page(url):
-    return requests.get(url)
-
 
 class Message:
 
@@ -35,6 +27,15 @@ class Message:
         The message id of the root parent of this message
     thread_indent: int
         The indent level of this message in its thread
+    html : str
+        The content page of the message, if it has been fetched
+    listed_subject : str
+        The subject shown for the message on its page's thread listing
+    listed_author : str
+        The author shown for the message on its page's thread listing
+    fetch_failed : bool
+        Whether requesting the content page failed. The page isn't requested
+        again, since the fetcher has already retried it.
     """
 
     def __init__(
@@ -45,6 +46,9 @@ class Message:
         thread_parent,
         thread_idx,
         thread_indent,
+        html=None,
+        listed_subject=None,
+        listed_author=None,
     ):
         """
         Parameters
@@ -61,6 +65,12 @@ class Message:
             The message id of the root parent of this message
         thread_indent: int
             The indent level of this message in its thread
+        html : str, optional
+            The content page of the message, if it has already been fetched
+        listed_subject : str, optional
+            The subject shown for the message on its page's thread listing
+        listed_author : str, optional
+            The author shown for the message on its page's thread listing
         """
 
         self.list_id = list_id
@@ -69,14 +79,27 @@ class Message:
         self.thread_parent = thread_parent
         self.thread_idx = thread_idx
         self.thread_indent = thread_indent
+        self.html = html
+        self.listed_subject = listed_subject
+        self.listed_author = listed_author
+        self.fetch_failed = False
 
         self._soup = None
+        self._fields = None
+
+    @property
+    def url(self):
+        """The url of the message's content page"""
+        return fetcher.url(
+            "pipermail", self.list_id, self.page, self.message_id + ".html"
+        )
 
     @property
     def soup(self):
         """Requests the content page of the message, and returns a BeautifulSoup soup object
         
-        Caches the page data once fetched
+        Caches the page data once fetched. The page isn't requested if its
+        html has already been fetched.
         
         Returns
         -------
@@ -86,24 +109,67 @@ class Message:
         if self._soup is not None:
             return self._soup
 
-        try:
-            url = "/".join(
-                    [
-                        BASE_URL,
-                        self.list_id,
-                        self.page,
-                        self.message_id + ".html",
-                    ]
+        if self._fetch():
+            self._soup = BeautifulSoup(self.html, "lxml")
+        return self._soup
+
+    @property
+    def fields(self):
+        """Extracts every field of the message from its content page in a
+        single pass (see `extract_message`)
+
+        Caches the fields once extracted
+
+        Returns
+        -------
+        dict
+            The text, sent_at, author, email and subject of the message
+        """
+        if self._fields is None:
+            html = self.html if self._fetch() else None
+            with PARSE_SECONDS.time(mode="html"):
+                self._fields = extract_message(html)
+        return self._fields
+
+    def _fetch(self):
+        """Requests the content page of the message, unless it has already
+        been fetched
+
+        Returns
+        -------
+        bool
+            Whether the page is available
+        """
+        if self.html is not None:
+            return True
+        if self.fetch_failed:
+            logger.warn(
+                "Message {} in list {} is unavailable".format(
+                    self.message_id, self.list_id
                 )
-            req = get_page(url)
-            self._soup = BeautifulSoup(req.text, "lxml")
+            )
+            return False
+
+        try:
+            self.html = get_fetcher().get(self.url)
         except:
             logger.warn(
                 "Request failed for message {} in list {}".format(
                     self.message_id, self.list_id
                 )
             )
-        return self._soup
+            self.fetch_failed = True
+        return self.html is not None
+
+    def _field(self, name):
+        value = self.fields[name]
+        if value is None:
+            logger.warn(
+                "Couldn't find {} for message {} in list {}".format(
+                    name, self.message_id, self.list_id
+                )
+            )
+        return value
 
     @property
     def text(self):
@@ -114,16 +180,7 @@ class Message:
         str
             The message text
         """
-        pre_elem = self.soup.find("pre")
-        if pre_elem is None:
-            logger.warn(
-                "Couldn't find message text for message {} in list {}".format(
-                    self.message_id, self.list_id
-                )
-            )
-            return None
-
-        return pre_elem.text.strip()
+        return self._field("text")
 
     @property
     def sent_at(self):
@@ -134,23 +191,7 @@ class Message:
         DateTime
             The sent_at time of the message
         """
-        sent_at_elem = self.soup.find("i")
-        if sent_at_elem is None:
-            logger.warn(
-                "Couldn't find sent_at for message {} in list {}".format(
-                    self.message_id, self.list_id
-                )
-            )
-            return None
-
-        try:
-            return parse(sent_at_elem.text)
-
-        except:
-            logger.warn(
-                "Unable to parse '{}' as a datetime".format(sent_at_elem.text)
-            )
-            return None
+        return self._field("sent_at")
 
     @property
     def author(self):
@@ -161,16 +202,7 @@ class Message:
         str
             The author name of the message
         """
-        author_elem = self.soup.find("b")
-        if author_elem is None:
-            logger.warn(
-                "Couldn't find author for message {} in list {}".format(
-                    self.message_id, self.list_id
-                )
-            )
-            return None
-
-        return author_elem.text.strip()
+        return self._field("author")
 
     @property
     def email(self):
@@ -181,16 +213,7 @@ class Message:
         str
             The sending email of the message
         """
-        email_elem = self.soup.find("a")
-        if email_elem is None:
-            logger.warn(
-                "Couldn't find email for message {} in list {}".format(
-                    self.message_id, self.list_id
-                )
-            )
-            return None
-
-        return email_elem.text.strip()
+        return self._field("email")
 
     @property
     def subject(self):
@@ -201,17 +224,7 @@ class Message:
         str
             The subject of the message
         """
-        subject_elem = self.soup.find("h1")
-        if subject_elem is None:
-            logger.warn(
-                "Couldn't find subject for message {} in list {}".format(
-                    self.message_id, self.list_id
-                )
-            )
-            return None
-
-        return subject_elem.text.strip()
-
+        return self._field("subject")
 
     def __str__(self):
         return "<Message - List: {}, Page: {}, ID: {}>".format(
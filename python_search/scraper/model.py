@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -18,3 +18,26 @@ class Message(Base):
     thread_idx = Column(Integer)
     thread_indent = Column(Integer)
     page = Column(String)
+
+    __table_args__ = (
+        # Incremental indexing reads each list in rowid order
+        Index("ix_message_list_id", "list_id"),
+        # The scraper's manifest looks up the stored messages of a page
+        Index("ix_message_list_id_page", "list_id", "page"),
+        Index("ix_message_thread", "list_id", "thread_parent", "thread_idx"),
+        Index("ix_message_sent_at", "sent_at"),
+        Index("ix_message_author", "author"),
+    )
+
+
+class Page(Base):
+    """A page (usually a month) of a mailing list that has been scraped
+
+    `completed_at` is only set once the page can no longer change, i.e. when
+    it was scraped after a newer page had been opened.
+    """
+    __tablename__ = "page"
+    list_id = Column(String, primary_key=True)
+    page = Column(String, primary_key=True)
+    message_count = Column(Integer)
+    completed_at = Column(DateTime)
@@ -0,0 +1,248 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from .. import metrics
+from .mailing_list import MailingList
+from .manifest import PageManifest
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PAGES_SCRAPED = metrics.counter(
+    "scraper_pages_scraped_total", "Pages scraped, by mailing list", ["list_id"]
+)
+PAGE_FAILURES = metrics.counter(
+    "scraper_page_failures_total",
+    "Pages that failed to scrape (they are retried by the next run)",
+    ["list_id"],
+)
+QUEUED_UNITS = metrics.gauge(
+    "scraper_queued_units", "Lists and pages waiting for a scraper worker"
+)
+
+DEFAULT_WORKERS = 4
+
+
+class ListProgress:
+
+    """The progress of the scrape of one mailing list
+
+    Attributes
+    ----------
+    list_id : str
+        The list being scraped
+    rank : int
+        The list's priority (lower is scraped first)
+    mailing_list : MailingList
+        The list, until it has finished
+    pages : list of (str, bool)
+        The pages to scrape (see `MailingList.pending_pages`), or None until
+        the list has been planned
+    queued : int
+        The number of pages handed to the workers so far
+    done : int
+        The number of pages scraped
+    failed : int
+        The number of pages that failed to scrape
+    messages : int
+        The number of messages scraped
+    """
+
+    def __init__(self, list_id, rank):
+        self.list_id = list_id
+        self.rank = rank
+        self.mailing_list = MailingList(list_id)
+        self.pages = None
+        self.queued = 0
+        self.done = 0
+        self.failed = 0
+        self.messages = 0
+        self.started_at = None
+
+    @property
+    def finished(self):
+        return self.pages is not None and self.done + self.failed == self.queued
+
+    def __str__(self):
+        return '"{}": {}/{} pages, {} messages{}'.format(
+            self.list_id,
+            self.done,
+            self.queued,
+            self.messages,
+            ", {} failed".format(self.failed) if self.failed else "",
+        )
+
+
+class ListScheduler:
+
+    """Scrapes many mailing lists at once from one shared work queue
+
+    Each list is first planned (its summary page is read to find the pages
+    it still needs), then each of those pages is a unit of work of its own.
+    A fixed pool of worker threads takes units from a priority queue: lists
+    earlier in the order given to `run` go first, and each list's pages go
+    newest first. Workers move on to the next list as soon as the pages of
+    the current ones have all been taken, so small lists never leave
+    workers idle.
+
+    Every worker shares the process-wide fetcher, so requests stay within
+    its rate limit however many lists are being scraped at once.
+
+    With `since`, a list's pages are queued one at a time, and the list
+    stops at the first page that starts before `since` (like
+    `MailingList.messages`).
+    """
+
+    def __init__(self, sessions, scrape_page, workers=DEFAULT_WORKERS,
+                 since=None):
+        """
+        Parameters
+        ----------
+        sessions : sessionmaker
+            Opens a database session for each worker, to read the page
+            manifest with
+        scrape_page : callable
+            Called as `scrape_page(mailing_list, page, is_open, manifest)`
+            to scrape a page. Returns the number of messages scraped.
+        workers : int
+            The number of worker threads
+        since : datetime, optional
+            Only scrape the pages of each list back to this date
+        """
+        self.sessions = sessions
+        self.scrape_page = scrape_page
+        self.workers = workers
+        self.since = since
+        self.progress = {}
+        self._queue = queue.PriorityQueue()
+        # Breaks ties between units of the same priority, in queuing order
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._finished = 0
+
+    def run(self, list_ids):
+        """Scrapes the lists `list_ids`, in order of priority
+
+        Returns
+        -------
+        list of ListProgress
+            The progress of each list
+        """
+        for rank, list_id in enumerate(list_ids):
+            self.progress[list_id] = ListProgress(list_id, rank)
+            self._put((rank, -1), self._plan, self.progress[list_id])
+
+        threads = [
+            threading.Thread(
+                target=self._work, name="scraper-{}".format(idx), daemon=True
+            )
+            for idx in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        self._queue.join()
+        for _ in threads:
+            self._put((float("inf"),), None)
+        for thread in threads:
+            thread.join()
+        return list(self.progress.values())
+
+    def _put(self, priority, task, *args):
+        self._queue.put((priority, next(self._order), task, args))
+        QUEUED_UNITS.set(self._queue.qsize())
+
+    def _work(self):
+        session = self.sessions()
+        manifest = PageManifest(session)
+        try:
+            while True:
+                _, _, task, args = self._queue.get()
+                QUEUED_UNITS.set(self._queue.qsize())
+                try:
+                    if task is None:
+                        return
+                    task(manifest, *args)
+                finally:
+                    self._queue.task_done()
+        finally:
+            session.close()
+
+    def _plan(self, manifest, progress):
+        logger.info('Beginning to scrape "{}"'.format(progress.list_id))
+        progress.started_at = time.monotonic()
+        try:
+            pages = progress.mailing_list.pending_pages(manifest)
+        except Exception:
+            logger.exception('Failed to plan "{}"'.format(progress.list_id))
+            pages = []
+
+        with self._lock:
+            progress.pages = pages
+            # Queued before the plan is marked done, so the queue can't
+            # empty out in between
+            if not pages:
+                self._list_finished(progress)
+            elif self.since is None:
+                for idx in range(len(pages)):
+                    self._queue_page(progress, idx)
+            else:
+                self._queue_page(progress, 0)
+
+    def _queue_page(self, progress, idx):
+        progress.queued += 1
+        self._put((progress.rank, idx), self._scrape, progress, idx)
+
+    def _scrape(self, manifest, progress, idx):
+        page, is_open = progress.pages[idx]
+        try:
+            messages = self.scrape_page(
+                progress.mailing_list, page, is_open, manifest
+            )
+            keep_going = (
+                self.since is None
+                or progress.mailing_list.page_starting_at(page) >= self.since
+            )
+        except Exception:
+            logger.exception(
+                'Failed to scrape page {} of "{}"'.format(page, progress.list_id)
+            )
+            PAGE_FAILURES.inc(list_id=progress.list_id)
+            failed, messages, keep_going = True, 0, False
+        else:
+            PAGES_SCRAPED.inc(list_id=progress.list_id)
+            failed = False
+
+        with self._lock:
+            if failed:
+                progress.failed += 1
+            else:
+                progress.done += 1
+                progress.messages += messages
+                logger.info("Scraped page {} of {}".format(page, progress))
+
+            if self.since is not None and idx + 1 < len(progress.pages):
+                if keep_going:
+                    self._queue_page(progress, idx + 1)
+                elif not failed:
+                    logger.info(
+                        'Stopping "{}" at page {}, which starts before {}'.format(
+                            progress.list_id, page, self.since
+                        )
+                    )
+            if progress.finished:
+                self._list_finished(progress)
+
+    def _list_finished(self, progress):
+        self._finished += 1
+        logger.info(
+            "Finished scraping {} in {:.0f}s ({}/{} lists done)".format(
+                progress,
+                time.monotonic() - progress.started_at,
+                self._finished,
+                len(self.progress),
+            )
+        )
+        # Frees the list's summary page
+        progress.mailing_list = None
@@ -1,11 +1,17 @@
 from bs4 import BeautifulSoup
-import requests
-from .mailing_list import MailingList
-from sqlalchemy import create_engine
+from .. import metrics
+from .fetcher import get_fetcher
+from . import fetcher
+from .manifest import PageComplete, PageManifest
 from sqlalchemy.orm import sessionmaker
-from .model import Base, Message
+from .model import Message
+from .scheduler import DEFAULT_WORKERS, ListScheduler
+from .storage import MessageWriter, open_engine
 from multiprocessing import Pool
+from itertools import tee
+from collections import deque
 from datetime import datetime, timedelta
+from functools import partial
 import logging
 import sys
 
@@ -36,34 +42,73 @@ def get_list_ids():
     """
     Returns a list of all message lists (i.e. topics) from mail;
     """
-    req = requests.get("https://mail.python.org/mailman/listinfo")
-    soup = BeautifulSoup(req.text, "lxml")
+    text = get_fetcher().get(fetcher.url("mailman", "listinfo"))
+    soup = BeautifulSoup(text, "lxml")
     for row in soup.find("table").find_all("tr")[4:]:
         link = row.find("a", href=True)["href"]
         yield link.split("/")[-1]
 
 
-def scrape_all(engine, start_at=None, parallelism=1, since=None):
+def scrape_all(engine, start_at=None, parallelism=1, since=None, mode="html",
+               workers=DEFAULT_WORKERS):
     """
     Scrape all mailing lists on mail.python.org
-    """
-    session = sessionmaker(bind=engine)()
-
-    for list_id in get_list_ids():
-        if start_at is not None and list_id < start_at:
-            continue
-
-        if list_id in BLACKLISTED_LISTS:
-            continue
 
-        logger.info('Beginning to scrape "{}"'.format(list_id))
-        scrape_list(session, list_id, parallelism, since=since)
+    The pages of every list are scraped by `workers` threads from one shared
+    queue (see `ListScheduler`), and parsed across `parallelism` processes.
+    Lists are scraped in alphabetical order, or, when updating (`since` is
+    given), starting with the lists that most recently had messages.
+    """
+    # Forked before `get_list_ids` starts the fetcher's event loop thread,
+    # since a fork of a process with running threads can leave the children
+    # holding locks that are never released. The workers also inherit a
+    # copy of this process's samples, which they would otherwise send back
+    # with their first drain.
+    pool = None
+    if parallelism > 1:
+        logger.info("Initializing Pool with Parallelism: {}".format(parallelism))
+        pool = Pool(processes=parallelism, initializer=metrics.drain)
+
+    try:
+        list_ids = [
+            list_id for list_id in get_list_ids()
+            if (start_at is None or list_id >= start_at)
+            and list_id not in BLACKLISTED_LISTS
+        ]
+
+        sessions = sessionmaker(bind=engine)
+        if since is not None:
+            session = sessions()
+            activity = PageManifest(session).last_activity()
+            session.close()
+            list_ids.sort(
+                key=lambda list_id: activity.get(list_id, datetime.min),
+                reverse=True,
+            )
+
+        with MessageWriter(engine) as writer:
+            scheduler = ListScheduler(
+                sessions,
+                partial(scrape_page, writer=writer, pool=pool, mode=mode),
+                workers,
+                since=since,
+            )
+            scheduler.run(list_ids)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 
 def message_to_db_message(message):
     """
     Converts a message object (from scraper) into a Database Message object
+
+    Page markers are passed through unchanged
     """
+    if isinstance(message, PageComplete):
+        return message
+
     db_message = Message(
         message_id=message.message_id,
         text=message.text,
@@ -81,46 +126,128 @@ def message_to_db_message(message):
     return db_message
 
 
-def scrape_list(session, list_id, parallelism=1, since=None):
+def prefetch(messages, page_fetcher):
     """
-    Scrapes a mailing list into the provided database session
+    Fetches the content pages of messages concurrently, yielding each message
+    once its page has been downloaded
+
+    Messages whose page couldn't be fetched are marked as failed, so that
+    they aren't requested again (e.g. by a pool worker's own fetcher, which
+    would be outside the shared rate limit)
     """
-    mailing_list = MailingList(list_id)
-    message_generator = mailing_list.messages(since=since)
-    logger.info("Initializing Pool with Parallelism: {}".format(parallelism))
+    messages, to_fetch = tee(messages)
+    pages = page_fetcher.get_all(message.url for message in to_fetch)
+    for message, html in zip(messages, pages):
+        if html is None and message.url is not None:
+            message.fetch_failed = True
+        message.html = html
+        yield message
 
-    if parallelism > 1:
-        pool = Pool(processes=parallelism)
-        message_generator = pool.imap(message_to_db_message, message_generator)
+
+def convert_and_drain(message):
+    """
+    Converts a message in a pool worker, returning it along with the metrics
+    the worker recorded while converting it
+    """
+    return message_to_db_message(message), metrics.REGISTRY.drain()
+
+
+def convert_in_pool(pool, messages, window=100):
+    """
+    Converts messages in the pool, in order, keeping up to `window` of them
+    in flight
+
+    Messages are read on the calling thread (rather than by Pool.imap's
+    feeder thread), since reading them queries the session's connection
+    """
+    pending = deque()
+
+    def collect():
+        db_message, samples = pending.popleft().get()
+        metrics.REGISTRY.merge(samples)
+        return db_message
+
+    for message in messages:
+        pending.append(pool.apply_async(convert_and_drain, (message,)))
+        if len(pending) >= window:
+            yield collect()
+    while pending:
+        yield collect()
+
+
+def scrape_page(mailing_list, page, is_open, manifest, writer, pool=None,
+                mode="html"):
+    """
+    Scrapes a page of a mailing list into the database
+
+    The manifest's messages that are already stored are skipped. Messages
+    are handed to the writer, which saves them in batches on its own thread,
+    followed by the page's `PageComplete` marker, so completed past pages
+    are skipped on later runs.
+
+    Message pages are downloaded concurrently by the fetcher, and parsed in
+    `pool` if one is given. In "mbox" mode, messages are read from the
+    page's monthly text archive instead (see `MailingList.page_messages`).
+
+    Returns the number of messages scraped.
+    """
+    message_generator = prefetch(
+        mailing_list.page_messages(page, is_open, mode=mode, manifest=manifest),
+        get_fetcher(),
+    )
+    if pool is not None:
+        message_generator = convert_in_pool(pool, message_generator)
     else:
         message_generator = (
             message_to_db_message(m) for m in message_generator
         )
 
-    for i, db_message in enumerate(message_generator):
-        session.merge(db_message)
-        if i > 0 and i % 100 == 0:
-            session.commit()
-            logger.info("Committed messages to database")
-    session.commit()
-
-    if parallelism > 1:
-        pool.close()
-
-
-def scrape_cmd(parallelism=4, start_at=None, update=None):
+    count = 0
+    for db_message in message_generator:
+        writer.put(db_message)
+        if not isinstance(db_message, PageComplete):
+            count += 1
+    return count
+
+
+def scrape_cmd(
+    parallelism=4,
+    start_at=None,
+    update=None,
+    requests_per_second=None,
+    concurrency=None,
+    mode="html",
+    metrics_file=None,
+    workers=DEFAULT_WORKERS,
+    base_url=None,
+):
     """
     Runs the scraper with the given settings
+
+    If `metrics_file` is given, the run's metrics are written to it when the
+    run ends. `base_url` replaces mail.python.org, e.g. with a mirror.
     """
+    settings = {}
+    if requests_per_second:
+        settings["requests_per_second"] = requests_per_second
+    if concurrency:
+        settings["concurrency"] = concurrency
+    fetcher.configure(base_url=base_url, **settings)
 
-    engine = create_engine("sqlite:///scraper.db")
-    Base.metadata.create_all(engine)
+    engine = open_engine("scraper.db")
 
     since = None
     if update:
         since = datetime.now() - timedelta(days=30)
 
-    scrape_all(engine, start_at, parallelism, since=since)
+    try:
+        scrape_all(
+            engine, start_at, parallelism, since=since, mode=mode, workers=workers
+        )
+    finally:
+        fetcher.shutdown()
+        if metrics_file:
+            metrics.dump(metrics_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,233 @@
+import logging
+import queue
+import threading
+from sqlalchemy import create_engine, event, inspect
+from .. import metrics
+from .manifest import PageComplete, page_row
+from .model import Base, Message, Page
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COMMIT_SECONDS = metrics.histogram(
+    "scraper_db_commit_seconds",
+    "Time taken to write and commit a batch of messages",
+)
+MESSAGES_WRITTEN = metrics.counter(
+    "scraper_messages_written_total", "Messages written to the database"
+)
+PAGES_COMPLETED = metrics.counter(
+    "scraper_pages_completed_total", "Pages recorded in the page manifest"
+)
+QUEUE_SIZE = metrics.gauge(
+    "scraper_writer_queue_size", "Items waiting for the message writer"
+)
+
+# Applied to every new connection. WAL lets the indexer and the scraper's
+# manifest queries read while the writer thread is writing.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=30000",
+]
+
+
+def set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def ensure_indexes(engine):
+    """Creates the indexes declared on the models that an existing database
+    is missing
+
+    `create_all` only creates indexes along with their tables, so databases
+    created before an index was added need them created separately.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info("Creating index {}".format(index.name))
+                index.create(engine)
+
+
+def open_engine(db_path):
+    """Opens the scraper database, creating its tables and indexes if needed
+
+    Parameters
+    ----------
+    db_path : str
+        The path of the SQLite database file
+    """
+    engine = create_engine("sqlite:///{}".format(db_path))
+    event.listen(engine, "connect", set_pragmas)
+    Base.metadata.create_all(engine)
+    ensure_indexes(engine)
+    return engine
+
+
+def upsert_statement(table, key):
+    """Builds an `INSERT ... ON CONFLICT DO UPDATE` statement for `table`,
+    taking its values in column order
+    """
+    columns = [column.name for column in table.columns]
+    updates = [column for column in columns if column not in key]
+    return (
+        "INSERT INTO {table} ({columns}) VALUES ({params}) "
+        "ON CONFLICT({key}) DO UPDATE SET {updates}".format(
+            table=table.name,
+            columns=", ".join(columns),
+            params=", ".join("?" for _ in columns),
+            key=", ".join(key),
+            updates=", ".join(
+                "{0}=excluded.{0}".format(column) for column in updates
+            ),
+        )
+    )
+
+
+class TableWriter:
+
+    """Converts model objects into parameter rows for a table's upsert"""
+
+    def __init__(self, engine, model, key):
+        table = model.__table__
+        self.statement = upsert_statement(table, key)
+        self.columns = [column.name for column in table.columns]
+        # Formats values (e.g. datetimes) the same way the ORM does
+        self.processors = [
+            column.type.dialect_impl(engine.dialect).bind_processor(engine.dialect)
+            for column in table.columns
+        ]
+
+    def row(self, obj):
+        return tuple(
+            processor(getattr(obj, column)) if processor else getattr(obj, column)
+            for column, processor in zip(self.columns, self.processors)
+        )
+
+
+class MessageWriter:
+
+    """Writes scraped messages to the database from a dedicated thread
+
+    `put` only appends to an unbounded queue, so scraping never waits on the
+    database. The writer thread drains whatever has been queued, up to
+    `batch_size` items, and upserts it in a single transaction.
+
+    Page markers (see `PageComplete`) go through the same queue, so a page
+    is recorded in the manifest in the same transaction as its last
+    messages, and never before them.
+
+    Attributes
+    ----------
+    batch_size : int
+        The maximum number of items written per transaction
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, engine, batch_size=5000):
+        """
+        Parameters
+        ----------
+        engine : Engine
+            The scraper database (see `open_engine`)
+        batch_size : int
+            The maximum number of items written per transaction
+        """
+        self.engine = engine
+        self.batch_size = batch_size
+        self._messages = TableWriter(engine, Message, ["message_id", "list_id"])
+        self._pages = TableWriter(engine, Page, ["list_id", "page"])
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, name="message-writer", daemon=True
+        )
+        self._thread.start()
+
+    def put(self, item):
+        """Queues a database `Message` or a `PageComplete` marker to be
+        written
+
+        Raises the writer thread's error if it has failed.
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put(item)
+
+    def close(self):
+        """Writes everything that has been queued, and stops the writer
+        thread"""
+        self._queue.put(self._CLOSE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        connection = self.engine.raw_connection()
+        try:
+            closing = False
+            while not closing:
+                items = [self._queue.get()]
+                while len(items) < self.batch_size:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if items[-1] is self._CLOSE:
+                    closing = True
+                    items.pop()
+                QUEUE_SIZE.set(self._queue.qsize())
+                if items:
+                    with COMMIT_SECONDS.time():
+                        self._write(connection, items)
+        except Exception as e:
+            logger.exception("Message writer failed")
+            self._error = e
+        finally:
+            connection.close()
+
+    def _write(self, connection, items):
+        cursor = connection.cursor()
+        rows, pages = [], 0
+        try:
+            for item in items:
+                if isinstance(item, PageComplete):
+                    # Flush the page's messages before recording it
+                    cursor.executemany(self._messages.statement, rows)
+                    cursor.execute(
+                        self._pages.statement, self._pages.row(page_row(item))
+                    )
+                    logger.info("Completed {}".format(item))
+                    rows, pages = [], pages + 1
+                else:
+                    rows.append(self._messages.row(item))
+            cursor.executemany(self._messages.statement, rows)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        MESSAGES_WRITTEN.inc(len(items) - pages)
+        PAGES_COMPLETED.inc(pages)
+        logger.info(
+            "Committed {} messages and {} pages to database".format(
+                len(items) - pages, pages
+            )
+        )
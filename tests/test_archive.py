@@ -0,0 +1,124 @@
+import os
+import shutil
+from datetime import datetime
+import pytest
+from python_search.scraper import mailing_list
+from python_search.scraper.archive import (
+    ArchivedMessage, count_archive, iter_archive, open_archive,
+)
+from python_search.scraper.mailing_list import MailingList
+from python_search.scraper.message import Message
+
+ARCHIVE = os.path.join(
+    os.path.dirname(__file__), "fixtures", "python-dev-2018-May.txt.gz"
+)
+
+
+@pytest.fixture
+def archive():
+    with open(ARCHIVE, "rb") as f:
+        yield f
+
+
+# The subjects and authors that the thread listing shows for the archive
+LISTED = [
+    ("[Python-Dev] PEP 572", "Guido van Rossum"),
+    ("[Python-Dev] PEP 572", "Tim Peters"),
+    ("[Python-Dev] PEP 572 \u2713", "Barry Warsaw"),
+    ("[Python-Dev] PEP 8", "Nick Coghlan"),
+]
+
+
+def listing(count, listed=LISTED):
+    """The thread listing of the archived page: one thread with replies"""
+    messages = []
+    for idx in range(count):
+        subject, author = listed[idx]
+        messages.append(
+            Message("python-dev", "2018-May", "{:06d}".format(100 + idx),
+                    "000100", idx, min(idx, 1),
+                    listed_subject=subject, listed_author=author)
+        )
+    return messages
+
+
+def test_iter_archive(archive):
+    fields = list(iter_archive(open_archive(archive)))
+    assert len(fields) == count_archive(open_archive(archive)) == 3
+
+    assert fields[0]["author"] == "Guido van Rossum"
+    assert fields[0]["email"] == "guido at python.org"
+    assert fields[0]["subject"] == "[Python-Dev] PEP 572"
+    assert fields[0]["sent_at"] == datetime(2018, 5, 1, 10, 0)
+    # A "From " line inside a body doesn't start a new message
+    assert fields[0]["text"].endswith("From the top, please.")
+
+    assert fields[1]["text"].endswith("I'm +1.")
+    assert fields[2]["author"] == "Barry Warsaw"
+    assert fields[2]["subject"] == "Re: [Python-Dev] PEP 572 ✓"
+
+
+def test_match_archive(archive):
+    listed = listing(3)
+    matched = MailingList("python-dev")._match_archive(listed, archive)
+    matched = list(matched)
+
+    assert all(isinstance(message, ArchivedMessage) for message in matched)
+    assert [m.message_id for m in matched] == ["000100", "000101", "000102"]
+    assert [m.author for m in matched] == [
+        "Guido van Rossum", "Tim Peters", "Barry Warsaw"
+    ]
+    assert matched[1].thread_parent == "000100"
+    assert matched[1].url is None
+
+
+@pytest.mark.parametrize("count", [2, 4])
+def test_match_archive_count_mismatch(archive, count):
+    assert MailingList("python-dev")._match_archive(listing(count), archive) is None
+
+
+def test_match_archive_out_of_step(archive):
+    # The second message was scrubbed from the archive, and another added
+    listed = listing(3, [LISTED[0], LISTED[3], LISTED[2]])
+    matched = list(MailingList("python-dev")._match_archive(listed, archive))
+
+    assert [m.message_id for m in matched] == ["000100", "000101", "000102"]
+    assert isinstance(matched[0], ArchivedMessage)
+    # Everything from the first mismatch is scraped from its content page
+    assert not any(isinstance(m, ArchivedMessage) for m in matched[1:])
+    assert matched[1].url is not None
+
+
+class ArchiveFetcher:
+
+    """Serves the fixture as every downloaded archive"""
+
+    def download(self, url, fileobj):
+        with open(ARCHIVE, "rb") as f:
+            shutil.copyfileobj(f, fileobj)
+
+
+@pytest.fixture
+def offline_list(monkeypatch):
+    monkeypatch.setattr(mailing_list, "get_fetcher", ArchiveFetcher)
+    python_dev = MailingList("python-dev")
+    monkeypatch.setattr(
+        python_dev, "_get_archive_url", lambda page: "2018-May.txt.gz"
+    )
+    return python_dev
+
+
+def test_scrape_archive(offline_list, monkeypatch):
+    monkeypatch.setattr(offline_list, "_scrape_page", lambda page: listing(3))
+    messages = list(offline_list._scrape_archive("2018-May"))
+    assert all(isinstance(message, ArchivedMessage) for message in messages)
+    assert messages[2].subject == "Re: [Python-Dev] PEP 572 ✓"
+
+
+def test_scrape_archive_falls_back_to_message_pages(offline_list, monkeypatch):
+    monkeypatch.setattr(offline_list, "_scrape_page", lambda page: listing(4))
+    messages = list(offline_list._scrape_archive("2018-May"))
+    assert [m.message_id for m in messages] == [
+        "000100", "000101", "000102", "000103"
+    ]
+    assert not any(isinstance(message, ArchivedMessage) for message in messages)
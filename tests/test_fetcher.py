@@ -0,0 +1,83 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import aiohttp
+import pytest
+from python_search.scraper import fetcher
+from python_search.scraper.fetcher import Fetcher
+
+
+class StandIn(BaseHTTPRequestHandler):
+
+    """Serves the responses queued in `responses` for each path, and then
+    200s, recording every request
+    """
+
+    responses = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        queued = self.responses.get(self.path)
+        status = queued.pop(0) if queued else 200
+        body = "{} {}".format(self.path, status).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StandIn.responses = {}
+    StandIn.requests = []
+    httpd = HTTPServer(("127.0.0.1", 0), StandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_port)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def page_fetcher():
+    page_fetcher = Fetcher(requests_per_second=1000, concurrency=4)
+    yield page_fetcher
+    page_fetcher.close()
+
+
+def test_get(server, page_fetcher):
+    assert page_fetcher.get(server + "/pipermail/python-dev") == (
+        "/pipermail/python-dev 200"
+    )
+
+
+def test_server_errors_are_retried(server, page_fetcher):
+    StandIn.responses["/flaky"] = [503]
+    assert page_fetcher.get(server + "/flaky") == "/flaky 200"
+    assert StandIn.requests == ["/flaky", "/flaky"]
+
+
+def test_client_errors_are_not_retried(server, page_fetcher):
+    StandIn.responses["/missing"] = [404]
+    with pytest.raises(aiohttp.ClientResponseError):
+        page_fetcher.get(server + "/missing")
+    assert StandIn.requests == ["/missing"]
+
+    StandIn.responses["/gone"] = [410]
+    assert list(page_fetcher.get_all([server + "/gone", None])) == [None, None]
+    assert StandIn.requests == ["/missing", "/gone"]
+
+
+def test_configured_base_url(server):
+    fetcher.configure(base_url=server + "/")
+    try:
+        assert fetcher.url("pipermail", "python-dev") == (
+            server + "/pipermail/python-dev"
+        )
+        text = fetcher.get_fetcher().get(fetcher.url("mailman", "listinfo"))
+        assert text == "/mailman/listinfo 200"
+    finally:
+        fetcher.configure(base_url=fetcher.DEFAULT_BASE_URL)
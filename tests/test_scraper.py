@@ -0,0 +1,45 @@
+import pickle
+from python_search.scraper import message as message_module
+from python_search.scraper import scraper
+from python_search.scraper.manifest import PageComplete
+from python_search.scraper.message import Message
+
+
+class FailingFetcher:
+
+    """Fails every request, like a fetcher that has given up retrying"""
+
+    def __init__(self):
+        self.requested = []
+
+    def get_all(self, urls):
+        for url in urls:
+            if url is not None:
+                self.requested.append(url)
+            yield None
+
+    def get(self, url):
+        self.requested.append(url)
+        raise RuntimeError("unavailable")
+
+
+def test_failed_prefetch_isnt_requested_again(monkeypatch):
+    shared = FailingFetcher()
+    messages = [
+        Message("python-dev", "2018-May", "000100", "000100", 0, 0),
+        PageComplete("python-dev", "2018-May", 1, False),
+    ]
+    prefetched = list(scraper.prefetch(iter(messages), shared))
+    assert len(shared.requested) == 1
+    assert prefetched[0].fetch_failed
+    assert not prefetched[1].html
+
+    # As in a pool worker, which has a fetcher of its own
+    worker = FailingFetcher()
+    monkeypatch.setattr(message_module, "get_fetcher", lambda: worker)
+    db_message = scraper.message_to_db_message(
+        pickle.loads(pickle.dumps(prefetched[0]))
+    )
+    assert db_message.message_id == "000100"
+    assert db_message.text is None
+    assert worker.requested == []
@@ -0,0 +1,27 @@
+from python_search.indexer.similar import SimilarMessages
+
+ASYNCIO = "asyncio event loop coroutine await tasks futures scheduling"
+PACKAGING = "packaging wheels setuptools metadata pip install distributions"
+
+
+def test_reindexed_messages_are_rehashed(tmp_path):
+    similar = SimilarMessages(str(tmp_path))
+    similar.add([
+        ("python-dev/1", 1, ASYNCIO),
+        ("python-dev/2", 2, ASYNCIO + " cancellation"),
+        ("python-dev/3", 3, PACKAGING),
+        ("python-dev/4", 4, PACKAGING + " sdist"),
+    ])
+    similar.save()
+    assert similar.similar("python-dev/1") == ["python-dev/2"]
+
+    similar = SimilarMessages.load(str(tmp_path))
+    assert similar.store_id("python-dev/2") == 2
+    # Message 2 was re-indexed with new content, in a new record
+    similar.add([("python-dev/2", 5, PACKAGING + " wheel")])
+
+    assert len(similar) == 4
+    assert similar.store_id("python-dev/2") == 5
+    assert similar.similar("python-dev/1") == []
+    assert "python-dev/2" in similar.similar("python-dev/3")
+    assert similar.similar("python-dev/2")[0] in ("python-dev/3", "python-dev/4")